@@ -11,31 +11,61 @@ import os
 import re
 import time
 import json
+import uuid
 import logging
 from datetime import datetime
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room
 
 import requests
 import threading
+from collections import deque
 from typing import Any, cast
 
 # ---------- 业务模块（保持你的原有功能） ----------
 # 兼容包方式（backend.app:app）与目录方式（app:app）启动
 try:
     from .logic import get_bot_reply
-    from .bot_store import init_db, log_message, upsert_qa, retrieve_best
+    from .bot_store import (init_db, log_message, upsert_qa_async, retrieve_best,
+                             db_stats, log_stats, learn_stats, hits_stats)
     from .policy import detect_lang, classify_topic, out_of_scope_reply, ALLOWED_TOPICS
     from .templates_kb import render_template
     from .responses import polite_short
+    from .translate_cache import translation_cache
+    from .endpoints import libre_pool
+    from .llm_gateway import gateway, PRIORITY_TRANSLATE
+    from .llm_bot import warm_prefix
+    from .conv_state import conversations
+    from .keywords import keyword_extractor
+    from .kb_index import kb_index, KB_INDEX_ENABLED
+    from .kb_semantic import kb_semantic, KB_SEMANTIC_ENABLED
+    from .sio_broker import message_queue_options
+    from .pipeline import MessagePipeline
+    from .scheduler import DeadlineScheduler
+    from .media_store import media_store, MediaError
+    from . import metrics
 except Exception:
     from logic import get_bot_reply
-    from bot_store import init_db, log_message, upsert_qa, retrieve_best
+    from bot_store import (init_db, log_message, upsert_qa_async, retrieve_best,
+                            db_stats, log_stats, learn_stats, hits_stats)
     from policy import detect_lang, classify_topic, out_of_scope_reply, ALLOWED_TOPICS
     from templates_kb import render_template
     from responses import polite_short
+    from translate_cache import translation_cache
+    from endpoints import libre_pool
+    from llm_gateway import gateway, PRIORITY_TRANSLATE
+    from llm_bot import warm_prefix
+    from conv_state import conversations
+    from keywords import keyword_extractor
+    from kb_index import kb_index, KB_INDEX_ENABLED
+    from kb_semantic import kb_semantic, KB_SEMANTIC_ENABLED
+    from sio_broker import message_queue_options
+    from pipeline import MessagePipeline
+    from scheduler import DeadlineScheduler
+    from media_store import media_store, MediaError
+    import metrics
 
 # ============== 基础配置 ==============
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -59,11 +89,14 @@ logging.info("[CORS] allowed origins: %s", _ALLOWED_ORIGINS)
 
 CORS(app, supports_credentials=True, resources={r"/*": {"origins": _ALLOWED_ORIGINS}})
 
+# 多实例部署：SOCKETIO_MESSAGE_QUEUE（redis://... 或 sqlite:///sio_queue.db）让 emit 跨进程送达
+# 图片走 HTTP 上传（/api/v1/media），Socket 消息只带引用，单条消息上限按文本与旧客户端的小图设置
 socketio = SocketIO(
     app,
     cors_allowed_origins=_ALLOWED_ORIGINS,
     async_mode="gevent",
-    max_http_buffer_size=20 * 1024 * 1024
+    max_http_buffer_size=int(os.getenv("SOCKETIO_MAX_BUFFER_BYTES", str(1024 * 1024))),
+    **message_queue_options()
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
@@ -168,40 +201,33 @@ def safe_translate(text: str, target: str, source: str = "auto", timeout: float
 
     payload = {"q": text, "source": src or "auto", "target": tgt, "format": "text"}
 
-    for url in LIBRE_ENDPOINTS:
-        try:
-            # 先尝试 JSON 提交
-            resp = requests.post(url, json=payload, timeout=timeout)
-            if resp.ok:
-                data = resp.json()
-                out = (data.get("translatedText") or "").strip()
-                if out:
-                    return out
-                else:
-                    logging.warning(f"[翻译失败-空返回] endpoint={url}")
-            else:
-                # 若 JSON 返回 400/415/422 等，尝试表单回退
-                if resp.status_code in (400, 415, 422):
-                    try:
-                        resp2 = requests.post(url, data=payload, timeout=timeout)
-                        if resp2.ok:
-                            data2 = resp2.json()
-                            out2 = (data2.get("translatedText") or "").strip()
-                            if out2:
-                                return out2
-                        else:
-                            logging.warning(f"[翻译失败-HTTP{resp2.status_code}-form] endpoint={url} text={text[:60]}")
-                    except Exception as e2:
-                        logging.warning(f"[翻译异常-form] endpoint={url} err={e2}")
-                else:
-                    logging.warning(f"[翻译失败-HTTP{resp.status_code}] endpoint={url} text={text[:60]}")
-        except Exception as e:
-            logging.warning(f"[翻译异常] endpoint={url} err={e}")
+    # 健康度排序 + 熔断跳过 + 复用连接；端点接受 JSON 还是表单由连接池记住
+    # 主端点慢于其 p95 时对冲到下一个端点，先返回者胜出
+    data = libre_pool.hedged_call(
+        libre_pool.ordered(LIBRE_ENDPOINTS), payload, timeout=timeout,
+        validate=lambda d: isinstance(d, dict) and bool((d.get("translatedText") or "").strip()),
+    )
+    if data:
+        return data["translatedText"].strip()
 
     logging.warning("[翻译失败-已回退原文] (可能网络不可达或端点限流) text=%s", text[:80])
     return text
 
 def safe_translate_with_fallback(text: str, target: str, source: str = "auto", timeout: float = TRANSLATION_TIMEOUT) -> str:
+    """
+    带缓存的翻译入口：L1 LRU → L2 SQLite → 上游（并发同文本只请求一次）。
+    未成功翻译（返回原文）的结果不落缓存，避免把端点故障缓存下来。
+    """
+    text = (text or "").strip()
+    if not text:
+        return text
+    return translation_cache.get_or_compute(
+        text, source, target,
+        lambda: _translate_with_fallback(text, target=target, source=source, timeout=timeout),
+        cacheable=lambda out: bool(out) and out != text,
+    )
+
+def _translate_with_fallback(text: str, target: str, source: str = "auto", timeout: float = TRANSLATION_TIMEOUT) -> str:
     """
     先使用 safe_translate；若返回与原文相同且确实需要跨语种翻译，则使用本地 LLM 兜底。
     """
@@ -215,14 +241,17 @@ def safe_translate_with_fallback(text: str, target: str, source: str = "auto", t
     # 判断是否确实需要翻译（避免同语种、中文直返等情况）
     tgt = (target or "en").strip().lower()[:2]
     src = (source or "auto").strip().lower()
-    try:
+    lang = src
+    if src == "auto":
+        # 调用方未给出源语种时才检测（消息管线已检测过的直接沿用）
         try:
-            from .policy import detect_lang
+            try:
+                from .policy import detect_lang
+            except Exception:
+                from policy import detect_lang
+            lang = (detect_lang(text) or "auto").lower()
         except Exception:
-            from policy import detect_lang
-        lang = (detect_lang(text) or "auto").lower()
-    except Exception:
-        lang = src
+            pass
     if (lang or "").startswith(tgt):
         return text
     # 使用本地 LLM 兜底翻译（可通过 LLM_FALLBACK_ENABLED 关闭）
@@ -238,25 +267,8 @@ def safe_translate_with_fallback(text: str, target: str, source: str = "auto", t
 def _llm_translate_fallback(text: str, target: str, source: str = "auto") -> str:
     """
     使用本地/自托管 OpenAI 兼容模型进行翻译兜底。
-    依赖环境变量：LLM_BASE_URL, LLM_API_KEY, LLM_MODEL
+    经 LLM 网关排队（优先级低于机器人实时回复），依赖环境变量：LLM_BASE_URL, LLM_API_KEY, LLM_MODEL
     """
-    try:
-        from openai import OpenAI
-    except Exception as e:
-        logging.warning("openai SDK 不可用: %s", e)
-        return text
-
-    base_url = os.getenv("LLM_BASE_URL", "http://127.0.0.1:8080/v1")
-    api_key  = os.getenv("LLM_API_KEY", "sk-noauth")
-    model    = os.getenv("LLM_MODEL", "qwen2.5-3b-instruct-q5_k_m")
-
-    # 配置重试次数（默认 0，避免 500 时重复重试）
-    try:
-        max_retries = int(os.getenv("LLM_MAX_RETRIES", "0"))
-    except Exception:
-        max_retries = 0
-    client = OpenAI(base_url=base_url, api_key=api_key, max_retries=max_retries)
-
     tgt = (target or "en").lower()[:2]
     _ = (source or "auto").lower()
 
@@ -279,25 +291,15 @@ def _llm_translate_fallback(text: str, target: str, source: str = "auto") -> str
         )
         user_prompt = f"Target language: {tgt}\nText:\n{text}"
 
-    # llama.cpp OpenAI server 需要正确的 chat handler；
-    # 支持通过环境变量显式指定，或基于模型名自动推断（如 qwen2* -> qwen）。
-    chat_format = (os.getenv("LLM_CHAT_FORMAT", "").strip() or "")
-    if not chat_format:
-        m = model.lower()
-        if "qwen" in m:
-            chat_format = "qwen"  # 覆盖 qwen2.x 等为 qwen
-
     try:
-        extra_body = {"chat_format": chat_format} if chat_format else None
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[
+        resp = gateway.chat(
+            [
                 {"role": "system", "content": sys_prompt},
                 {"role": "user", "content": user_prompt},
             ],
+            priority=PRIORITY_TRANSLATE,
             temperature=0.0,
             max_tokens=max(128, min(2048, len(text) * 3)),
-            **({"extra_body": extra_body} if extra_body else {}),
         )
         out = (resp.choices[0].message.content or "").strip()
         return out or text
@@ -307,16 +309,19 @@ def _llm_translate_fallback(text: str, target: str, source: str = "auto") -> str
 
 # ============== 状态与会话 ==============
 init_db()  # 初始化学习库
+translation_cache.start(purge_interval_sec=float(os.getenv("TRANSLATION_CACHE_PURGE_SEC", "21600")))  # 清理过期的持久翻译缓存
+if KB_INDEX_ENABLED:
+    kb_index.start()  # 知识库载入内存，retrieve_best 改走内存检索
+if KB_SEMANTIC_ENABLED:
+    kb_semantic.start(refresh_interval_sec=float(os.getenv("KB_INDEX_REFRESH_SEC", "5")))  # 语义兜底检索
+socketio.start_background_task(warm_prefix)  # 预热 LLM system prompt 前缀缓存（后台，不阻塞启动）
+socketio.start_background_task(keyword_extractor.warmup)  # 预加载 jieba 词典与 spaCy NER 管线
 
 INACTIVITY_SEC = int(os.getenv("BOT_INACTIVITY_SEC", "30"))   # 无人响应阈值（秒）
-SUPPRESS_WINDOW_SEC = int(os.getenv("BOT_SUPPRESS_SEC", "5")) # 打字抑制窗口（秒）
 
-session_info = {}                         # sid -> {'role': 'agent'|'client', 'cid': str}
-manual_online_by_cid = {}                 # cid -> bool (True=人工上线/不介入; False=下线/介入)
-suppress_until_by_cid = {}                # cid -> epoch 秒（客服打字抑制到期时间）
-last_agent_activity_by_cid = {}           # cid -> epoch 秒（客服上次活动时间）
-last_client_by_cid = {}                   # cid -> {'fr','zh','ts'}  用于自动学习
-last_client_msg_ts_by_cid = {}            # cid -> 最近一条客户消息 token
+# 会话状态（按 cid 的紧凑记录 + sid 绑定；空闲超时与条目上限回收，见 conv_state.py）
+# 记录字段：manual_online / last_agent_activity / last_client / last_client_msg_ts
+# 多实例部署时 nginx 按 cid 亲和路由，同一 cid 的计时与 LLM 上下文只在一个进程；需跨进程可见的字段经 conversations.update 写穿共享存储
 
 def _get_sid() -> str:
     # Flask's request type stub lacks 'sid' provided by Flask-SocketIO at runtime
@@ -324,24 +329,256 @@ def _get_sid() -> str:
 
 
 def _cid_of_current():
-    info = session_info.get(_get_sid(), {})
-    return info.get('cid', 'default')
+    info = conversations.session(_get_sid())
+    return info[1] if info else 'default'
 
 def _manual_online(cid):
-    return manual_online_by_cid.get(cid, True)
+    return conversations.get(cid).manual_online
 
 def _set_manual_online(cid, online: bool):
-    manual_online_by_cid[cid] = bool(online)
+    conversations.update(cid, manual_online=bool(online))
+
+# 客服在线时的延迟代答：每个 cid 一个截止时间，由单个调度循环统一等待（不再每条消息一个轮询 greenlet）
+reply_timers = DeadlineScheduler(
+    spawn=socketio.start_background_task,
+    make_event=lambda: socketio.server.eio.create_event(),
+    name="bot-reply-timers",
+)
+reply_timers.start(socketio.start_background_task)
 
 def _update_agent_activity(cid):
-    last_agent_activity_by_cid[cid] = time.time()
+    conversations.get(cid).last_agent_activity = time.time()
+    reply_timers.cancel(cid)  # 客服有活动（连接 / 打字 / 发消息），本条不再代答
 
-def _typing_suppressed(cid):
-    return time.time() < suppress_until_by_cid.get(cid, 0)
+def _reply_superseded(cid, token) -> bool:
+    """有更新的客户消息，或客服在该消息之后有活动（记录已被回收同样视为失效）"""
+    rec = conversations.peek(cid)
+    if rec is None:
+        return True
+    return rec.last_client_msg_ts != token or rec.last_agent_activity > token
 
 def broadcast_agent_status(cid):
     socketio.emit('agent_status', {'cid': cid, 'online': _manual_online(cid)}, to=cid)
 
+# ============== 机器人回复（LLM 可流式） ==============
+_SENTENCE_END_RE = re.compile(r"[。！？!?；;…\n]+|\.(?=\s|$)")
+
+
+class BotReplyStream:
+    """
+    LLM 流式回复推送：
+    - 每个增量立即以 bot_reply_delta 推送到 {cid}:agents（中文）
+    - 按句子边界切出的中文句子进入队列，由单个后台任务按顺序翻译后以 bot_reply_delta 推送到 {cid}:clients；
+      on_delta 在 LLM 读流循环内调用，不在这里翻译：翻译（含对冲与 LLM 翻译兜底）不占用流式回复的 LLM 并发槽，
+      兜底翻译要另取槽位时也不会与本流互相等待
+    - finish() 等队列翻译完，返回与客户端已看到内容一致的完整译文，供最终 new_message 与日志使用
+    """
+
+    def __init__(self, cid: str, target_lang: str):
+        self.cid = cid
+        self.target_lang = target_lang
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.streamed = False
+        self._text = ""          # 当前可见中文全文
+        self._cut = 0            # 已切出（入队）的中文前缀长度
+        self._client_parts: list[str] = []
+        self._lock = threading.Lock()
+        self._queue: deque = deque()   # (代数, 中文句子)
+        self._generation = 0            # 可见文本重置时 +1，旧代数的句子与译文作废
+        self._worker = None
+
+    def on_delta(self, delta: str, text_zh: str):
+        self.streamed = True
+        if not text_zh.startswith(self._text[:self._cut]):
+            # 可见文本被重置（如出现 <|message|> 锚点），客户端侧重新开始
+            self._cut = 0
+            with self._lock:
+                self._generation += 1
+                self._queue.clear()
+                self._client_parts = []
+        self._text = text_zh
+        socketio.emit('bot_reply_delta', {
+            "cid": self.cid, "stream_id": self.stream_id, "side": "agent",
+            "delta": delta, "text": text_zh,
+        }, to=f"{self.cid}:agents")
+        for m in _SENTENCE_END_RE.finditer(text_zh, self._cut):
+            self._enqueue(text_zh[self._cut:m.end()])
+            self._cut = m.end()
+
+    def _enqueue(self, sentence_zh: str):
+        sentence_zh = sentence_zh.strip()
+        if not sentence_zh:
+            return
+        with self._lock:
+            self._queue.append((self._generation, sentence_zh))
+            if self._worker is None:
+                self._worker = socketio.start_background_task(self._drain)
+
+    def _drain(self):
+        """后台按入队顺序逐句翻译并推送客户端；队列空时退出（之后有新句子再启动）"""
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._worker = None
+                    return
+                generation, sentence_zh = self._queue.popleft()
+            try:
+                part = safe_translate_with_fallback(sentence_zh, target=self.target_lang, source="zh")
+            except Exception as e:
+                logging.warning("[流式回复][cid=%s] 句子翻译失败: %s", self.cid, e)
+                part = sentence_zh
+            with self._lock:
+                if generation != self._generation:
+                    continue
+                self._client_parts.append(part)
+                text = " ".join(self._client_parts)
+            socketio.emit('bot_reply_delta', {
+                "cid": self.cid, "stream_id": self.stream_id, "side": "client",
+                "delta": part, "text": text,
+            }, to=f"{self.cid}:clients")
+
+    def finish(self, reply_zh: str) -> str:
+        if self.streamed and reply_zh.startswith(self._text[:self._cut]):
+            self._enqueue(reply_zh[self._cut:])
+            self._cut = len(reply_zh)
+            with self._lock:
+                worker = self._worker
+            if worker is not None:
+                worker.join()
+            if self._client_parts:
+                return " ".join(self._client_parts)
+        return safe_translate_with_fallback(reply_zh, target=self.target_lang, source="zh")
+
+
+# 客户消息管线：语种检测 / 翻译 / 检索 / 回复 / 回译每条消息各算一次，即时与延迟代答路径共用
+# BOT_INTENT_FAST_PATH=true（默认）：原文话题分类命中且客户语种有模板时直接用模板回复，中文视图异步补齐
+BOT_INTENT_FAST_PATH = os.getenv("BOT_INTENT_FAST_PATH", "true").lower() != "false"
+
+pipeline = MessagePipeline(
+    detect=detect_lang,
+    translate=safe_translate_with_fallback,
+    retrieve=retrieve_best,
+    generate=get_bot_reply,
+    classify=classify_topic if BOT_INTENT_FAST_PATH else None,
+    render=render_template,
+    intent_topics=ALLOWED_TOPICS,
+)
+
+
+# 渐进式投递（PROGRESSIVE_DELIVERY=true，默认）：消息原文带 id 立即推送，翻译 / 检索 / 机器人回复
+# 在后台任务中完成后以 message_update 事件修补同一 id；false 时恢复“全部算完再推送整条消息”
+PROGRESSIVE_DELIVERY = os.getenv("PROGRESSIVE_DELIVERY", "true").lower() != "false"
+
+
+def _emit_update(cid: str, msg_id: str, patch: dict, agents: bool = True, clients: bool = True):
+    payload = {"cid": cid, "id": msg_id, **patch}
+    if agents:
+        socketio.emit('message_update', payload, to=f"{cid}:agents")
+    if clients:
+        socketio.emit('message_update', payload, to=f"{cid}:clients")
+
+
+def _remember_client_zh(ctx, msg_zh: str):
+    """客户消息的中文译文晚于消息本身就绪时，补记到自动学习上下文（已有更新消息则跳过）"""
+    rec = conversations.peek(ctx.cid)
+    if rec is not None and rec.last_client_msg_ts == ctx.token:
+        conversations.update(ctx.cid, last_client={"fr": ctx.text, "zh": msg_zh, "ts": ctx.token})
+
+
+def _send_agent_view(ctx, with_client: bool):
+    """快速通道的中文视图：翻译客户原文与模板回复后推送给客服端；with_client 时补记客户中文与自动学习上下文"""
+    cid = ctx.cid
+    try:
+        msg_zh = ctx.text_zh
+        reply_zh = pipeline.reply(ctx)
+    except Exception as e:
+        logging.warning("[管线][cid=%s] 中文视图翻译失败: %s", cid, e)
+        return
+    if with_client:
+        log_message("client", "zh", msg_zh, conv_id=cid)
+        _remember_client_zh(ctx, msg_zh)
+    if PROGRESSIVE_DELIVERY:
+        # 带 bot_reply 才会被前端当作机器人回复渲染（客户端气泡已由 _send_intent_reply 修补，这里补客服侧中文）
+        _emit_update(cid, ctx.message_id, {"client_zh": msg_zh, "bot_reply": True, "reply_zh": reply_zh,
+                                           "intent": ctx.intent["topic"]})
+        log_message("bot", "zh", reply_zh, conv_id=cid)
+        return
+    payload = {
+        "cid": cid,
+        "from": "client",
+        "original": ctx.text,
+        "client_zh": msg_zh,
+        "bot_reply": True,
+        "reply_zh": reply_zh,
+        "reply_fr": ctx.intent["text"],
+        "intent": ctx.intent["topic"],
+        "agent_view": True,   # 客户端已收到回复，这条只更新客服视图
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M")
+    }
+    socketio.emit('new_message', payload, to=f"{cid}:agents")
+    socketio.emit('new_message', payload, to=f"{cid}:clients")
+    log_message("bot", "zh", reply_zh, conv_id=cid)
+    logging.debug("[管线][cid=%s] 阶段耗时(ms) %s", cid, ctx.timings)
+
+
+def _send_intent_reply(ctx, with_client: bool):
+    """快速通道：客户语种模板直接回复客户端（无翻译往返），中文视图交给后台任务"""
+    cid = ctx.cid
+    reply = pipeline.translate_back(ctx)
+    if PROGRESSIVE_DELIVERY:
+        _emit_update(cid, ctx.message_id, {"bot_reply": True, "reply_fr": reply, "intent": ctx.intent["topic"]})
+        log_message("bot", ctx.intent["lang"], reply, conv_id=cid)
+        socketio.start_background_task(_send_agent_view, ctx, with_client)
+        return
+    socketio.emit('new_message', {
+        "cid": cid,
+        "from": "client",
+        "original": ctx.text,
+        "bot_reply": True,
+        "reply_fr": reply,
+        "intent": ctx.intent["topic"],
+        "zh_pending": True,   # 中文（客服视图）稍后以 agent_view 消息送达
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M")
+    }, to=f"{cid}:clients")
+    log_message("bot", ctx.intent["lang"], reply, conv_id=cid)
+    socketio.start_background_task(_send_agent_view, ctx, with_client)
+
+
+def _send_bot_reply(ctx):
+    """知识库命中直接用答案，否则走 get_bot_reply（LLM 兜底时流式推送）；最后推送整条消息并记录日志"""
+    cid = ctx.cid
+    if pipeline.decide(ctx) == "intent":
+        _send_intent_reply(ctx, with_client=False)
+        return
+    stream = BotReplyStream(cid, ctx.target_lang)
+    reply_zh = pipeline.reply(ctx, on_delta=stream.on_delta)
+    reply_fr = pipeline.translate_back(ctx, finish=stream.finish)
+    logging.debug("[管线][cid=%s] 阶段耗时(ms) %s", cid, ctx.timings)
+    if PROGRESSIVE_DELIVERY:
+        patch = {"bot_reply": True, "reply_zh": reply_zh, "reply_fr": reply_fr}
+        if stream.streamed:
+            patch["stream_id"] = stream.stream_id
+        _emit_update(cid, ctx.message_id, patch)
+        log_message("bot", "zh", reply_zh, conv_id=cid)
+        log_message("bot", "fr", reply_fr, conv_id=cid)
+        return
+    payload = {
+        "cid": cid,
+        "from": "client",
+        "original": ctx.text,
+        "client_zh": ctx.text_zh,
+        "bot_reply": True,
+        "reply_zh": reply_zh,
+        "reply_fr": reply_fr,
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M")
+    }
+    if stream.streamed:
+        payload["stream_id"] = stream.stream_id
+    socketio.emit('new_message', payload, to=f"{cid}:agents")
+    socketio.emit('new_message', payload, to=f"{cid}:clients")
+    log_message("bot", "zh", reply_zh, conv_id=cid)
+    log_message("bot", "fr", reply_fr, conv_id=cid)
+
 # ============== REST ==============
 @app.route('/api/v1/config', methods=['GET'])
 def get_config():
@@ -351,13 +588,99 @@ def get_config():
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/api/v1/stats', methods=['GET'])
+def get_stats():
+    return jsonify({
+        "status": "success",
+        "translation_cache": translation_cache.stats(),
+        "endpoints": libre_pool.stats(),
+        "hedging": libre_pool.hedge_stats(),
+        "llm": gateway.stats(),
+        "pipeline": pipeline.stats(),
+        "reply_timers": reply_timers.stats(),
+        "media": media_store.stats(),
+        "conversations": conversations.stats(),
+        "db": db_stats(),
+        "message_log": log_stats(),
+        "learning": learn_stats(),
+        "hits": hits_stats(),
+        "kb_index": kb_index.stats(),
+        "kb_semantic": kb_semantic.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+# ============== 指标（Prometheus） ==============
+# 各模块在调用点记录直方图 / 计数（见 metrics.py）；这里登记回调式仪表并暴露 /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() != "false"
+
+metrics.gauge("chatbot_connected_sids", "当前 Socket.IO 连接数（客户 + 客服）",
+              lambda: conversations.connection_counts()[0])
+metrics.gauge("chatbot_active_cids", "当前有连接的会话数", lambda: conversations.connection_counts()[1])
+metrics.gauge("chatbot_pending_delayed_replies", "等待超时代答的会话数", lambda: reply_timers.stats()["pending"])
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"status": "error", "message": "metrics disabled"}), 404
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# ============== 图片（内容寻址存储） ==============
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 3600  # 地址即内容哈希，内容不可变
+
+@app.route('/api/v1/media', methods=['POST'])
+def upload_media():
+    """multipart 字段 file，或直接以图片为请求体；流式落盘，按内容哈希去重"""
+    if request.content_length and request.content_length > media_store.max_bytes + 64 * 1024:
+        return jsonify({"status": "error", "message": "file too large"}), 413
+    upload = request.files.get("file")
+    try:
+        info = media_store.save_stream(upload.stream if upload else request.stream)
+    except MediaError as e:
+        return jsonify({"status": "error", "message": str(e)}), e.status
+    return jsonify({"status": "success", "size": info["size"], "mime": info["mime"],
+                    "dedup": info["dedup"], **media_store.reference(str(info["id"]))})
+
+def _send_media(found, digest):
+    path, mime = found
+    resp = send_file(path, mimetype=mime, conditional=True, etag=digest, max_age=MEDIA_CACHE_MAX_AGE)
+    resp.headers["Cache-Control"] = f"public, max-age={MEDIA_CACHE_MAX_AGE}, immutable"
+    return resp
+
+@app.route('/api/v1/media/<digest>', methods=['GET'])
+def get_media(digest):
+    found = media_store.locate(digest)
+    if not found:
+        return jsonify({"status": "error", "message": "not found"}), 404
+    return _send_media(found, digest)
+
+@app.route('/api/v1/media/<digest>/thumb', methods=['GET'])
+def get_media_thumb(digest):
+    thumb = media_store.locate_thumb(digest)
+    if thumb:
+        return _send_media(thumb, f"{digest}-thumb")
+    # 缩略图尚未生成（或未安装 Pillow）：回退原图，但不长期缓存，之后可拿到真正的缩略图
+    found = media_store.locate(digest)
+    if not found:
+        return jsonify({"status": "error", "message": "not found"}), 404
+    resp = send_file(found[0], mimetype=found[1], conditional=True, etag=digest)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def _image_ref(image, cid, role):
+    """消息中的图片转为存储引用（旧客户端的 data URL 在此转存）；无效时返回 None"""
+    try:
+        return media_store.resolve(image)
+    except MediaError as e:
+        logging.warning("[图片][cid=%s] %s 图片被拒绝: %s", cid, role, e)
+        return None
+
 # ============== Socket.IO 事件 ==============
 @socketio.on('connect')
 def handle_connect():
     role = request.args.get("role", "client")
     cid  = request.args.get("cid", "default")
     sid = _get_sid()
-    session_info[sid] = {'role': role, 'cid': cid}
+    conversations.bind_session(sid, role, cid)
 
     join_room(cid)
     if role == "agent":
@@ -372,7 +695,7 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     sid = _get_sid()
-    info = session_info.pop(sid, None)
+    info = conversations.unbind_session(sid)
     logging.info(f"disconnected: sid={sid}, info={info}")
 
 @socketio.on('agent_set_status')
@@ -386,52 +709,16 @@ def handle_agent_set_status(data):
 @socketio.on('agent_typing')
 def handle_agent_typing(_data=None):
     cid = _cid_of_current()
-    suppress_until_by_cid[cid] = time.time() + SUPPRESS_WINDOW_SEC
     _update_agent_activity(cid)
 
-def _delayed_bot_reply(cid, token, msg_fr, msg_zh):
-    deadline = token + INACTIVITY_SEC
-    while time.time() < deadline:
-        socketio.sleep(0.5)  # type: ignore[arg-type]
-        if last_client_msg_ts_by_cid.get(cid, 0) != token:
-            return
-        if last_agent_activity_by_cid.get(cid, 0) > token:
-            return
-
-    if last_client_msg_ts_by_cid.get(cid, 0) != token:
+def _delayed_bot_reply(ctx):
+    """reply_timers 到期回调：客服在 INACTIVITY_SEC 内未响应"""
+    cid, token = ctx.cid, ctx.token
+    # 客服的任何活动（连接 / 打字 / 发消息）都会取消计时；到期时再校验一次，防止与取消并发
+    if _reply_superseded(cid, token):
         return
-    if last_agent_activity_by_cid.get(cid, 0) > token:
-        return
-
-    while _typing_suppressed(cid):
-        socketio.sleep(0.3)  # type: ignore[arg-type]
-        if last_client_msg_ts_by_cid.get(cid, 0) != token:
-            return
-        if last_agent_activity_by_cid.get(cid, 0) > token:
-            return
-
-    kb = retrieve_best(query_fr=msg_fr, query_zh=msg_zh)
-    if kb:
-        reply_zh = kb["answer_zh"]
-    else:
-        reply_zh = (get_bot_reply(msg_zh, cid) or msg_zh)
-
-    reply_fr = safe_translate_with_fallback(reply_zh, target="fr", source="zh")
-    ts_send = datetime.now().strftime("%Y-%m-%d %H:%M")
-    payload = {
-        "cid": cid,
-        "from": "client",
-        "original": msg_fr,
-        "client_zh": msg_zh,
-        "bot_reply": True,
-        "reply_zh": reply_zh,
-        "reply_fr": reply_fr,
-        "timestamp": ts_send
-    }
-    socketio.emit('new_message', payload, to=f"{cid}:agents")
-    socketio.emit('new_message', payload, to=f"{cid}:clients")
-    log_message("bot", "zh", reply_zh, conv_id=cid)
-    log_message("bot", "fr", reply_fr, conv_id=cid)
+    # 检索结果沿用即时路径已算好的（同一条消息只检索一次）
+    _send_bot_reply(ctx)
 
 @socketio.on('client_message')
 def handle_client_message(data):
@@ -442,27 +729,51 @@ def handle_client_message(data):
 
     # 图片
     if image:
-        payload_img = {"cid": cid, "from": "client", "image": image, "timestamp": ts}
+        ref = _image_ref(image, cid, "client")
+        if not ref:
+            return
+        payload_img = {"cid": cid, "from": "client", **ref, "timestamp": ts}
         socketio.emit('new_message', payload_img, to=f"{cid}:agents")
         socketio.emit('new_message', payload_img, to=f"{cid}:clients")
-        log_message("client", "img", "[image]", conv_id=cid)
+        log_message("client", "img", ref["image"], conv_id=cid)
         return
 
-    msg_fr = (msg_fr or "").strip()
+    ctx = pipeline.new_context(cid, msg_fr, target_lang=config_store.config["DEFAULT_CLIENT_LANG"])
+    msg_fr = ctx.text
     if not msg_fr:
         return
-    
-    # 统一用 auto → zh，容错多语言
-    msg_zh = safe_translate_with_fallback(msg_fr, target="zh", source="auto")
 
-    token = time.time()
-    last_client_msg_ts_by_cid[cid] = token
-    last_client_by_cid[cid] = {"fr": msg_fr, "zh": msg_zh, "ts": token}
+    token = ctx.token
+
+    if PROGRESSIVE_DELIVERY:
+        # 原文立即送达两端（带消息 id），其余阶段在后台完成后以 message_update 修补
+        conversations.update(cid, last_client_msg_ts=token,
+                             last_client={"fr": msg_fr, "zh": "", "ts": token})
+        payload = {"cid": cid, "id": ctx.message_id, "from": "client", "original": msg_fr,
+                   "pending": True, "timestamp": ts}
+        socketio.emit('new_message', payload, to=f"{cid}:agents")
+        socketio.emit('new_message', payload, to=f"{cid}:clients")
+        socketio.start_background_task(_client_message_stages, ctx)
+        return {"id": ctx.message_id}
+
+    # 机器人代答、知识库未命中且原文命中客户语种模板：直接用模板回复（不回译），中文视图异步推送
+    if not _manual_online(cid) and pipeline.decide(ctx) == "intent":
+        conversations.update(cid, last_client_msg_ts=token,
+                             last_client={"fr": msg_fr, "zh": "", "ts": token})
+        log_message("client", ctx.lang, msg_fr, conv_id=cid)
+        _send_intent_reply(ctx, with_client=True)
+        return
+
+    # 检测语种后翻译为中文（检测结果直接作为源语种，翻译层不再重复检测）
+    msg_zh = ctx.text_zh
+
+    conversations.update(cid, last_client_msg_ts=token,
+                         last_client={"fr": msg_fr, "zh": msg_zh, "ts": token})
 
     log_message("client", "fr", msg_fr, conv_id=cid)
     log_message("client", "zh", msg_zh, conv_id=cid)
 
-    kb = retrieve_best(query_fr=msg_fr, query_zh=msg_zh)
+    kb = ctx.kb
 
     payload = {
         "cid": cid,
@@ -479,28 +790,44 @@ def handle_client_message(data):
 
     # 机器人介入逻辑
     if not _manual_online(cid):
-        kb2 = kb or retrieve_best(query_fr=msg_fr, query_zh=msg_zh)
-        if kb2:
-            reply_zh = kb2["answer_zh"]
-        else:
-            reply_zh = (get_bot_reply(msg_zh, cid) or msg_zh)
-        reply_fr = safe_translate_with_fallback(reply_zh, target=config_store.config["DEFAULT_CLIENT_LANG"], source="zh")
-        payload2 = {
-            "cid": cid,
-            "from": "client",
-            "original": msg_fr,
-            "client_zh": msg_zh,
-            "bot_reply": True,
-            "reply_zh": reply_zh,
-            "reply_fr": reply_fr,
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M")
-        }
-        socketio.emit('new_message', payload2, to=f"{cid}:agents")
-        socketio.emit('new_message', payload2, to=f"{cid}:clients")
-        log_message("bot", "zh", reply_zh, conv_id=cid)
-        log_message("bot", "fr", reply_fr, conv_id=cid)
+        _send_bot_reply(ctx)
     else:
-        socketio.start_background_task(_delayed_bot_reply, cid, token, msg_fr, msg_zh)
+        reply_timers.schedule(cid, token + INACTIVITY_SEC, _delayed_bot_reply, ctx)
+
+def _client_message_stages(ctx):
+    """渐进式投递的后台阶段：快速通道 / 翻译 → 建议答案或机器人代答 / 延迟代答计时"""
+    cid, token = ctx.cid, ctx.token
+    try:
+        # 原文日志在语种检测之后记录，语种标记与非渐进式路径一致
+        if not _manual_online(cid) and pipeline.decide(ctx) == "intent":   # 知识库优先，未命中才用模板
+            log_message("client", ctx.lang, ctx.text, conv_id=cid)
+            _send_intent_reply(ctx, with_client=True)
+            return
+        log_message("client", "fr", ctx.text, conv_id=cid)
+
+        msg_zh = ctx.text_zh
+        _emit_update(cid, ctx.message_id, {"client_zh": msg_zh})
+        log_message("client", "zh", msg_zh, conv_id=cid)
+        _remember_client_zh(ctx, msg_zh)
+
+        if not _manual_online(cid):
+            _send_bot_reply(ctx)
+            return
+        kb = ctx.kb
+        if kb:
+            _emit_update(cid, ctx.message_id, {"suggest_zh": kb["answer_zh"]})
+        if not _reply_superseded(cid, token):
+            reply_timers.schedule(cid, token + INACTIVITY_SEC, _delayed_bot_reply, ctx)
+    except Exception as e:
+        logging.warning("[管线][cid=%s] 消息 %s 后台处理失败: %s", cid, ctx.message_id, e)
+
+
+def _agent_message_translate(cid, msg_id, msg, target_lang):
+    """渐进式投递：客服原文已送达客户端，译文就绪后修补同一条消息"""
+    translated = safe_translate_with_fallback(msg, target=target_lang, source="auto")
+    _emit_update(cid, msg_id, {"translated": translated}, agents=False)
+    log_message("agent", target_lang, translated, conv_id=cid)
+
 
 @socketio.on('agent_message')
 def handle_agent_message(data):
@@ -513,36 +840,51 @@ def handle_agent_message(data):
     _update_agent_activity(cid)
 
     if image:
-        payload = {"cid": cid, "from": "agent", "image": image, "timestamp": ts}
+        ref = _image_ref(image, cid, "agent")
+        if not ref:
+            return
+        payload = {"cid": cid, "from": "agent", **ref, "timestamp": ts}
         socketio.emit('new_message', payload, to=f"{cid}:clients")
-        log_message("agent", "img", "[image]", conv_id=cid)
+        log_message("agent", "img", ref["image"], conv_id=cid)
         return
 
     if not msg:
         return
 
-    # 客服发中文 → 客户端显示目标语（如 fr）
-    translated = safe_translate_with_fallback(msg, target=target_lang, source="auto")
+    msg_id = None
+    if PROGRESSIVE_DELIVERY:
+        # 原文立即送达客户端（带消息 id），译文在后台完成后以 message_update 修补
+        msg_id = uuid.uuid4().hex[:12]
+        socketio.emit('new_message', {"cid": cid, "id": msg_id, "from": "agent", "original": msg,
+                                      "pending": True, "timestamp": ts}, to=f"{cid}:clients")
+        log_message("agent", "zh", msg, conv_id=cid)
+        socketio.start_background_task(_agent_message_translate, cid, msg_id, msg, target_lang)
+    else:
+        # 客服发中文 → 客户端显示目标语（如 fr）
+        translated = safe_translate_with_fallback(msg, target=target_lang, source="auto")
 
-    payload = {
-        "cid": cid,
-        "from": "agent",
-        "original": msg,          # 客服端原文（中文）
-        "translated": translated, # 客户端收到的翻译
-        "timestamp": ts
-    }
-    socketio.emit('new_message', payload, to=f"{cid}:clients")
-    log_message("agent", "zh", msg, conv_id=cid)
-    log_message("agent", target_lang, translated, conv_id=cid)
+        payload = {
+            "cid": cid,
+            "from": "agent",
+            "original": msg,          # 客服端原文（中文）
+            "translated": translated, # 客户端收到的翻译
+            "timestamp": ts
+        }
+        socketio.emit('new_message', payload, to=f"{cid}:clients")
+        log_message("agent", "zh", msg, conv_id=cid)
+        log_message("agent", target_lang, translated, conv_id=cid)
 
     # 自动学习（最近客户问 → 本次客服答）
     try:
-        lc = last_client_by_cid.get(cid, {})
+        lc = conversations.get(cid).last_client or {}
         if lc.get("zh") and (time.time() - lc.get("ts", 0) < 180):
-            upsert_qa(q_fr=lc.get("fr", ""), q_zh=lc["zh"], a_zh=msg, source="agent_auto")
+            upsert_qa_async(q_fr=lc.get("fr", ""), q_zh=lc["zh"], a_zh=msg, source="agent_auto")
     except Exception as e:
         logging.warning(f"auto-learn failed: {e}")
 
+    if msg_id:
+        return {"id": msg_id}  # Socket.IO ack：客户端据此关联后续 message_update
+
 # ============== 前端静态文件 ==============
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -1,20 +1,159 @@
 # bot_store.py
+import atexit
+import json
+import logging
 import os
-import re
 import sqlite3
 import threading
 import time
+from contextlib import contextmanager
 from datetime import datetime
 
+try:
+    from .keywords import keyword_extractor
+    from .textseg import segment, tokenize, overlap_ratio
+    from . import metrics
+except Exception:
+    from keywords import keyword_extractor  # type: ignore
+    from textseg import segment, tokenize, overlap_ratio  # type: ignore
+    import metrics  # type: ignore
+
 
 _DB_PATH = os.getenv("BOT_DB_PATH", "bot_store.db")
-_lock = threading.Lock()
+_READ_POOL_SIZE = int(os.getenv("BOT_DB_READ_POOL", "8"))          # 并发读连接上限
+_BUSY_TIMEOUT_SEC = float(os.getenv("BOT_DB_BUSY_TIMEOUT_SEC", "5"))
+_STMT_CACHE_SIZE = int(os.getenv("BOT_DB_STMT_CACHE", "256"))       # 每个连接缓存的预编译语句数
+_FTS_MIN_OVERLAP = float(os.getenv("KB_FTS_MIN_OVERLAP", "0.5"))     # 检索词与问题词重合比例下限
+_FTS_MAX_QUERY_TOKENS = 32
+
+# op：retrieve_best 检索 / upsert_qa 学习写入 / log_message 消息日志入队 / log_flush 消息日志批量落盘
+_OP_SECONDS = metrics.histogram(
+    "chatbot_store_op_seconds", "知识库与消息日志存储操作耗时", ["op"], buckets=metrics.STORAGE_BUCKETS)
+_OP_ERRORS = metrics.counter("chatbot_store_errors_total", "存储操作失败次数", ["op"])
+_FLUSH_SECONDS = _OP_SECONDS.labels("log_flush")
+_FLUSH_ERRORS = _OP_ERRORS.labels("log_flush")
+
+def _timed_op(op: str):
+    return metrics.timed(_OP_SECONDS.labels(op), _OP_ERRORS.labels(op))
 
 def _connect():
     conn = sqlite3.connect(_DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
+
+class _ConnectionManager:
+    """
+    长连接管理（WAL 模式下读写分离）：
+    - 读：最多 pool_size 个只读长连接，借出/归还，读之间不加锁、可并发
+    - 写：单个写连接 + 写锁，所有写操作串行走同一路径
+    - 连接长期复用，sqlite3 按连接缓存预编译语句（cached_statements），同一 SQL 不再重复解析
+    - 进程 fork 后（pid 变化）自动丢弃继承来的连接
+    """
+
+    def __init__(self, pool_size: int = 8):
+        self.pool_size = max(1, int(pool_size))
+        self._write_lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._idle: list = []
+        self._writer = None
+        self._opened = 0
+        self._pid = os.getpid()
+        self._counters = {"reads": 0, "writes": 0, "write_wait_total": 0.0}
+
+    def _open(self, readonly: bool) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            _DB_PATH, timeout=_BUSY_TIMEOUT_SEC, check_same_thread=False,
+            cached_statements=_STMT_CACHE_SIZE,
+            isolation_level=None if readonly else "DEFERRED",
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(_BUSY_TIMEOUT_SEC * 1000)}")
+        if readonly:
+            conn.execute("PRAGMA query_only=1")
+        else:
+            conn.execute("PRAGMA synchronous=NORMAL")  # WAL 下安全，减少 fsync
+        return conn
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            with self._pool_lock:
+                self._idle = []
+                self._writer = None
+                self._opened = 0
+                self._pid = os.getpid()
+
+    @contextmanager
+    def reader(self):
+        self._check_fork()
+        self._slots.acquire()
+        conn = None
+        try:
+            with self._pool_lock:
+                conn = self._idle.pop() if self._idle else None
+                self._counters["reads"] += 1
+            if conn is None:
+                conn = self._open(readonly=True)
+                with self._pool_lock:
+                    self._opened += 1
+            yield conn
+        finally:
+            if conn is not None:
+                with self._pool_lock:
+                    self._idle.append(conn)
+            self._slots.release()
+
+    @contextmanager
+    def writer(self):
+        self._check_fork()
+        t0 = time.time()
+        with self._write_lock:
+            waited = time.time() - t0
+            if self._writer is None:
+                self._writer = self._open(readonly=False)
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                with self._pool_lock:
+                    self._counters["writes"] += 1
+                    self._counters["write_wait_total"] += waited
+
+    def close_all(self):
+        """关闭所有连接（测试/切换 BOT_DB_PATH 时使用）"""
+        with self._write_lock, self._pool_lock:
+            for conn in self._idle + ([self._writer] if self._writer else []):
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._idle = []
+            self._writer = None
+            self._opened = 0
+
+    def stats(self) -> dict:
+        with self._pool_lock:
+            c = dict(self._counters)
+            out = {
+                "read_pool_size": self.pool_size,
+                "readers_open": self._opened,
+                "readers_idle": len(self._idle),
+            }
+        out.update(reads=c["reads"], writes=c["writes"],
+                   write_wait_avg=round(c["write_wait_total"] / c["writes"], 6) if c["writes"] else 0.0)
+        return out
+
+
+_db = _ConnectionManager(pool_size=_READ_POOL_SIZE)
+
+def db_stats() -> dict:
+    return _db.stats()
+
 def init_db():
     with _connect() as conn:
         c = conn.cursor()
@@ -38,88 +177,526 @@ def init_db():
             source TEXT DEFAULT 'agent_auto',
             hits INTEGER DEFAULT 0,
             created_at TEXT,
-            updated_at TEXT
+            updated_at TEXT,
+            keywords TEXT DEFAULT ''
+        );
+
+        -- 翻译缓存（持久层）：key = sha1(source|target|规范化原文)
+        CREATE TABLE IF NOT EXISTS translation_cache (
+            key TEXT PRIMARY KEY,
+            source TEXT,
+            target TEXT,
+            src_text TEXT,
+            out_text TEXT,
+            created_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_translation_cache_created ON translation_cache(created_at);
+
+        -- 会话共享状态（多实例部署时跨进程可见；进程内热数据仍在 conv_state.ConversationStore）
+        CREATE TABLE IF NOT EXISTS conv_state (
+            cid TEXT PRIMARY KEY,
+            data TEXT,
+            updated_at REAL
         );
         """)
-        # FTS5 视项目 SQLite 构建情况决定是否启用
-        try:
-            c.executescript("""
-            CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts
-            USING fts5(question_all, answer_zh, content='knowledge', content_rowid='id');
-            """)
-            # 全量同步（首次）
-            rows = c.execute("SELECT id, COALESCE(q_fr,'')||' '||COALESCE(q_zh,'') AS q, a_zh FROM knowledge").fetchall()
-            for r in rows:
-                c.execute("INSERT OR REPLACE INTO knowledge_fts(rowid, question_all, answer_zh) VALUES(?,?,?)",
-                          (r["id"], r["q"], r["a_zh"]))
-        except sqlite3.Error:
-            pass
+        _migrate(conn)
         conn.commit()
 
+# ---------- 结构迁移（PRAGMA user_version） ----------
+def _knowledge_fts_text(q_fr: str, q_zh: str, keywords: str) -> str:
+    return segment(q_fr or "", q_zh or "", (keywords or "").replace(",", " "))
+
+def rebuild_fts(conn):
+    """按当前分词规则重建 knowledge_fts（全量）"""
+    conn.execute("DELETE FROM knowledge_fts")
+    rows = conn.execute("SELECT id, q_fr, q_zh, a_zh, keywords FROM knowledge").fetchall()
+    conn.executemany(
+        "INSERT INTO knowledge_fts(rowid, question_all, answer_zh) VALUES(?,?,?)",
+        [(r["id"], _knowledge_fts_text(r["q_fr"], r["q_zh"], r["keywords"]), r["a_zh"]) for r in rows]
+    )
+
+def _migrate_v1_cjk_fts(conn):
+    """
+    中文分词索引：
+    - knowledge 增加 keywords 列（关键词不再只存在于 FTS 中，可随时重建索引）
+    - knowledge_fts 改为独立 FTS5 表：question_all 存切词后文本（中文二元组 + 小写去变音词），answer_zh 不索引；
+      旧表为 content='knowledge' 外部内容表，但 knowledge 并无 question_all 列，查询会报错并退化为 LIKE 全表扫描
+    """
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(knowledge)").fetchall()}
+    if "keywords" not in cols:
+        conn.execute("ALTER TABLE knowledge ADD COLUMN keywords TEXT DEFAULT ''")
+    try:
+        conn.execute("DROP TABLE IF EXISTS knowledge_fts")
+        conn.execute("CREATE VIRTUAL TABLE knowledge_fts USING fts5("
+                     "question_all, answer_zh UNINDEXED, tokenize='unicode61 remove_diacritics 2')")
+        rebuild_fts(conn)
+    except sqlite3.Error as e:
+        logging.warning("[知识库] FTS5 不可用，检索回退 LIKE: %s", e)
+
+# (目标版本, 迁移函数)；未设置 user_version 的旧库为 0
+def _migrate_v2_kb_version(conn):
+    """知识库版本号：每次 knowledge 写入同事务 +1，内存索引据此判断是否与数据库一致"""
+    conn.execute("CREATE TABLE IF NOT EXISTS kb_meta (key TEXT PRIMARY KEY, value INTEGER)")
+    conn.execute("INSERT OR IGNORE INTO kb_meta(key, value) VALUES ('knowledge_version', 0)")
+
+_MIGRATIONS = [
+    (1, _migrate_v1_cjk_fts),
+    (2, _migrate_v2_kb_version),
+]
+
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, fn in _MIGRATIONS:
+        if version < target:
+            fn(conn)
+            conn.execute(f"PRAGMA user_version={target}")
+            version = target
+            logging.info("[知识库] 结构迁移到 v%s", target)
+
+_INSERT_MESSAGE_SQL = "INSERT INTO messages(conv_id, role, lang, content, created_at) VALUES (?,?,?,?,?)"
+
+
+class _MessageLogWriter:
+    """
+    消息日志写后（write-behind）：
+    - log_message 只把行放进内存队列，后台线程（gevent 下为 greenlet）攒批后用 executemany 单事务写入
+    - 达到 batch_size 立即唤醒刷盘；否则最多每 flush_interval_sec 刷一次（崩溃最多丢失这段时间内的日志）
+    - 队列有上限：满了由调用方同步刷盘（反压），不丢行
+    - 进程退出时（atexit）刷盘；sync=True 时每条直接写入（测试用）
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval_sec: float = 1.0,
+                 max_queue: int = 10000, sync: bool = False):
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval_sec = float(flush_interval_sec)
+        self.max_queue = max(self.batch_size, int(max_queue))
+        self.sync = sync
+        self._cond = threading.Condition()
+        self._rows: list = []
+        self._thread = None
+        self._pid = os.getpid()
+        self._counters = {"rows": 0, "batches": 0, "max_batch": 0, "backpressure": 0, "errors": 0}
+
+    def _ensure_thread(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="bot_store-log-writer", daemon=True)
+            self._thread.start()
+
+    def append(self, row: tuple):
+        if self.sync:
+            self._write([row])
+            return
+        with self._cond:
+            self._ensure_thread()
+            full = len(self._rows) >= self.max_queue
+            if not full:
+                self._rows.append(row)
+                if len(self._rows) >= self.batch_size:
+                    self._cond.notify()
+                return
+            self._counters["backpressure"] += 1
+        # 反压：队列已满，由调用方先同步刷盘再写入本行
+        self.flush()
+        self._write([row])
+
+    def _take(self) -> list:
+        with self._cond:
+            rows, self._rows = self._rows, []
+            return rows
+
+    def _write(self, rows: list):
+        if not rows:
+            return
+        t0 = time.perf_counter()
+        try:
+            with _db.writer() as conn:
+                conn.executemany(_INSERT_MESSAGE_SQL, rows)
+        except sqlite3.Error as e:
+            _FLUSH_ERRORS.inc()
+            with self._cond:
+                self._counters["errors"] += 1
+            logging.warning("[消息日志] 批量写入失败 rows=%s err=%s", len(rows), e)
+            return
+        finally:
+            _FLUSH_SECONDS.observe(time.perf_counter() - t0)
+        with self._cond:
+            self._counters["rows"] += len(rows)
+            self._counters["batches"] += 1
+            self._counters["max_batch"] = max(self._counters["max_batch"], len(rows))
+
+    def flush(self):
+        self._write(self._take())
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._rows) < self.batch_size:
+                    self._cond.wait(self.flush_interval_sec)
+            self.flush()
+
+    def stats(self) -> dict:
+        with self._cond:
+            out = dict(self._counters)
+            out["queued"] = len(self._rows)
+        out.update(sync=self.sync, batch_size=self.batch_size, flush_interval_sec=self.flush_interval_sec)
+        return out
+
+
+_log_writer = _MessageLogWriter(
+    batch_size=int(os.getenv("BOT_LOG_BATCH_SIZE", "100")),
+    flush_interval_sec=float(os.getenv("BOT_LOG_FLUSH_SEC", "1.0")),
+    max_queue=int(os.getenv("BOT_LOG_MAX_QUEUE", "10000")),
+    sync=os.getenv("BOT_LOG_SYNC", "false").lower() == "true",
+)
+atexit.register(_log_writer.flush)
+
+@_timed_op("log_message")
 def log_message(role: str, lang: str, content: str, conv_id: str):
-    with _connect() as conn, _lock:
+    """记录一条消息（默认写后批量落盘，见 _MessageLogWriter）"""
+    _log_writer.append((conv_id, role, lang, content, datetime.now().isoformat(timespec="seconds")))
+
+def flush_messages():
+    """立即把队列中的消息日志写入数据库"""
+    _log_writer.flush()
+
+def log_stats() -> dict:
+    return _log_writer.stats()
+
+def get_translation(key: str, max_age_sec: float = 0):
+    """
+    读取持久化的翻译缓存；过期（max_age_sec>0 且超龄）或不存在返回 None
+    """
+    with _db.reader() as conn:
+        row = conn.execute("SELECT out_text, created_at FROM translation_cache WHERE key=?", (key,)).fetchone()
+    if not row:
+        return None
+    if max_age_sec and time.time() - (row["created_at"] or 0) > max_age_sec:
+        return None
+    return row["out_text"]
+
+def put_translation(key: str, source: str, target: str, src_text: str, out_text: str):
+    with _db.writer() as conn:
         conn.execute(
-            "INSERT INTO messages(conv_id, role, lang, content, created_at) VALUES (?,?,?,?,?)",
-            (conv_id, role, lang, content, datetime.now().isoformat(timespec="seconds"))
+            "INSERT OR REPLACE INTO translation_cache(key, source, target, src_text, out_text, created_at) VALUES (?,?,?,?,?,?)",
+            (key, source, target, src_text[:2000], out_text, time.time())
         )
-        conn.commit()
 
-def upsert_qa(q_fr: str, q_zh: str, a_zh: str, source: str = "agent_auto"):
-    q_fr = (q_fr or "").strip()[:500]
-    q_zh = (q_zh or "").strip()[:500]
-    a_zh = (a_zh or "").strip()[:2000]
-    now = datetime.now().isoformat(timespec="seconds")
+def purge_translations(max_age_sec: float) -> int:
+    """删除超过 max_age_sec 的持久翻译缓存（读取时已视为过期，不删则表随不同原文无限增长）；返回删除行数"""
+    if max_age_sec <= 0:
+        return 0
+    with _db.writer() as conn:
+        cur = conn.execute("DELETE FROM translation_cache WHERE created_at < ?", (time.time() - max_age_sec,))
+        return cur.rowcount
 
-    # 自动提取关键词（中文和法语）
-    keywords = []
-    # 提取中文关键词
-    if q_zh:
-        import jieba
-        keywords += jieba.lcut(q_zh)[:10]
-    # 提取法语关键词
-    if q_fr:
-        import spacy
-        nlp = spacy.load("fr_core_news_sm")
-        doc = nlp(q_fr)
-        keywords += [ent.text.lower() for ent in doc.ents[:5]]
-    # 去重并限制长度
-    keywords = list(set(keywords))[:15]
-    keywords_str = ",".join(keywords)
-    
-    with _connect() as conn, _lock:
-        # 去重策略：同 q_zh 且答案相似（这里简化为完全相同）则 hits+1
-        row = conn.execute("SELECT id, a_zh FROM knowledge WHERE q_zh=? LIMIT 1", (q_zh,)).fetchone()
-        if row:
-            if row["a_zh"] == a_zh:
-                conn.execute("UPDATE knowledge SET hits=hits+1, updated_at=? WHERE id=?", (now, row["id"]))
-            else:
-                conn.execute("UPDATE knowledge SET a_zh=?, updated_at=? WHERE id=?", (a_zh, now, row["id"]))
-            kid = row["id"]
+def load_conv_state(cid: str):
+    """读取会话共享状态（dict）；不存在返回 None"""
+    with _db.reader() as conn:
+        row = conn.execute("SELECT data FROM conv_state WHERE cid=?", (cid,)).fetchone()
+    if not row:
+        return None
+    try:
+        return json.loads(row["data"] or "{}")
+    except ValueError:
+        return None
+
+def save_conv_state(cid: str, data: dict):
+    with _db.writer() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO conv_state(cid, data, updated_at) VALUES (?,?,?)",
+            (cid, json.dumps(data, ensure_ascii=False), time.time())
+        )
+
+def _upsert_qa_rows(conn, q_fr: str, q_zh: str, a_zh: str, source: str, keywords_str: str, now: str):
+    # 去重策略：同 q_zh 且答案相似（这里简化为完全相同）则 hits+1
+    row = conn.execute("SELECT id, a_zh FROM knowledge WHERE q_zh=? LIMIT 1", (q_zh,)).fetchone()
+    if row:
+        if row["a_zh"] == a_zh:
+            conn.execute("UPDATE knowledge SET hits=hits+1, updated_at=? WHERE id=?", (now, row["id"]))
         else:
-            conn.execute(
-                "INSERT INTO knowledge(q_fr, q_zh, a_zh, source, hits, created_at, updated_at) VALUES (?,?,?,?,?,?,?)",
-                (q_fr, q_zh, a_zh, source, 1, now, now)
-            )
-            kid = conn.execute("SELECT last_insert_rowid() AS id").fetchone()["id"]
+            conn.execute("UPDATE knowledge SET a_zh=?, updated_at=? WHERE id=?", (a_zh, now, row["id"]))
+        kid = row["id"]
+        # 同一问题的 FTS 文本沿用首次学习时的 q_fr / 关键词
+        cur = conn.execute("SELECT q_fr, keywords FROM knowledge WHERE id=?", (kid,)).fetchone()
+        q_fr, keywords_str = cur["q_fr"], cur["keywords"]
+    else:
+        conn.execute(
+            "INSERT INTO knowledge(q_fr, q_zh, a_zh, source, hits, created_at, updated_at, keywords) VALUES (?,?,?,?,?,?,?,?)",
+            (q_fr, q_zh, a_zh, source, 1, now, now, keywords_str)
+        )
+        kid = conn.execute("SELECT last_insert_rowid() AS id").fetchone()["id"]
+
+    # 同步 FTS（切词后写入）
+    try:
+        conn.execute("DELETE FROM knowledge_fts WHERE rowid=?", (kid,))
+        conn.execute(
+            "INSERT INTO knowledge_fts(rowid, question_all, answer_zh) VALUES(?,?,?)",
+            (kid, _knowledge_fts_text(q_fr, q_zh, keywords_str), a_zh)
+        )
+    except sqlite3.Error:
+        pass
+    return kid
+
+def _clean_qa(q_fr: str, q_zh: str, a_zh: str):
+    return (q_fr or "").strip()[:500], (q_zh or "").strip()[:500], (a_zh or "").strip()[:2000]
+
+# 知识库变更监听（如内存检索索引）：fn(rows, version)，rows 为变更后的完整行
+_knowledge_listeners: list = []
+
+def add_knowledge_listener(fn):
+    _knowledge_listeners.append(fn)
+
+_KNOWLEDGE_COLUMNS = "id, q_fr, q_zh, a_zh, keywords, hits"
+
+def knowledge_snapshot():
+    """读取全部知识条目与当前版本号：(rows, version)"""
+    with _db.reader() as conn:
+        version = conn.execute("SELECT value FROM kb_meta WHERE key='knowledge_version'").fetchone()
+        rows = conn.execute(f"SELECT {_KNOWLEDGE_COLUMNS} FROM knowledge").fetchall()
+    return [dict(r) for r in rows], (version[0] if version else 0)
+
+def knowledge_version() -> int:
+    with _db.reader() as conn:
+        row = conn.execute("SELECT value FROM kb_meta WHERE key='knowledge_version'").fetchone()
+    return row[0] if row else 0
 
-        # 同步 FTS
+@_timed_op("upsert_qa")
+def upsert_qa_many(items: list):
+    """
+    批量学习：items = [(q_fr, q_zh, a_zh, source), ...]
+    关键词按批提取（nlp.pipe），全部写入在一个事务内完成（知识库版本号同事务 +1）
+    """
+    items = [(*_clean_qa(q_fr, q_zh, a_zh), source) for q_fr, q_zh, a_zh, source in items]
+    if not items:
+        return
+    keywords = keyword_extractor.extract_many([(q_fr, q_zh) for q_fr, q_zh, _, _ in items])
+    now = datetime.now().isoformat(timespec="seconds")
+    with _db.writer() as conn:
+        kids = [_upsert_qa_rows(conn, q_fr, q_zh, a_zh, source, ",".join(kws), now)
+                for (q_fr, q_zh, a_zh, source), kws in zip(items, keywords)]
+        conn.execute("UPDATE kb_meta SET value=value+1 WHERE key='knowledge_version'")
+        version = conn.execute("SELECT value FROM kb_meta WHERE key='knowledge_version'").fetchone()[0]
+        changed = []
+        if _knowledge_listeners:
+            marks = ",".join("?" * len(set(kids)))
+            changed = [dict(r) for r in conn.execute(
+                f"SELECT {_KNOWLEDGE_COLUMNS} FROM knowledge WHERE id IN ({marks})", list(set(kids))).fetchall()]
+    for fn in _knowledge_listeners:
         try:
-            conn.execute(
-                "INSERT OR REPLACE INTO knowledge_fts(rowid, question_all, answer_zh) VALUES(?,?,?)",
-                (kid, f"{q_fr} {q_zh} {keywords_str}", a_zh)
-            )
-        except sqlite3.Error:
-            pass
-        conn.commit()
+            fn(changed, version)
+        except Exception as e:
+            logging.warning("[知识库] 变更通知失败: %s", e)
 
+def upsert_qa(q_fr: str, q_zh: str, a_zh: str, source: str = "agent_auto"):
+    """同步学习一条（关键词提取使用预加载的 jieba / spaCy）"""
+    upsert_qa_many([(q_fr, q_zh, a_zh, source)])
+
+
+class _LearnQueue:
+    """
+    自动学习队列：请求路径只入队，后台线程（gevent 下为 greenlet）攒批调用 upsert_qa_many，
+    关键词提取与 FTS 更新均不在客服消息处理路径上；队列满时丢弃最旧的事件并计数
+    """
+
+    def __init__(self, batch_size: int = 32, max_wait_sec: float = 0.5, max_queue: int = 1000):
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait_sec = float(max_wait_sec)
+        self.max_queue = max(1, int(max_queue))
+        self._cond = threading.Condition()
+        self._items: list = []
+        self._thread = None
+        self._pid = os.getpid()
+        self._counters = {"queued": 0, "learned": 0, "batches": 0, "dropped": 0, "errors": 0}
+
+    def put(self, q_fr: str, q_zh: str, a_zh: str, source: str = "agent_auto"):
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="bot_store-learner", daemon=True)
+                self._thread.start()
+            if len(self._items) >= self.max_queue:
+                self._items.pop(0)
+                self._counters["dropped"] += 1
+            self._items.append((q_fr, q_zh, a_zh, source))
+            self._counters["queued"] += 1
+            if len(self._items) == 1 or len(self._items) >= self.batch_size:
+                self._cond.notify()
+
+    def _take(self) -> list:
+        with self._cond:
+            batch, self._items = self._items[:self.batch_size], self._items[self.batch_size:]
+            return batch
+
+    def drain(self):
+        """处理完当前队列（退出时 / 测试用）"""
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            self._process(batch)
+
+    def _process(self, batch: list):
+        try:
+            upsert_qa_many(batch)
+        except Exception as e:
+            with self._cond:
+                self._counters["errors"] += 1
+            logging.warning("[自动学习] 批量入库失败 n=%s err=%s", len(batch), e)
+            return
+        with self._cond:
+            self._counters["learned"] += len(batch)
+            self._counters["batches"] += 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items:
+                    self._cond.wait()
+                # 稍等片刻以攒批
+                if len(self._items) < self.batch_size:
+                    self._cond.wait(self.max_wait_sec)
+            self.drain()
+
+    def stats(self) -> dict:
+        with self._cond:
+            out = dict(self._counters)
+            out["pending"] = len(self._items)
+        out["keywords"] = keyword_extractor.stats()
+        return out
+
+
+_learn_queue = _LearnQueue(
+    batch_size=int(os.getenv("LEARN_BATCH_SIZE", "32")),
+    max_wait_sec=float(os.getenv("LEARN_BATCH_WAIT_SEC", "0.5")),
+    max_queue=int(os.getenv("LEARN_MAX_QUEUE", "1000")),
+)
+atexit.register(_learn_queue.drain)
+
+def upsert_qa_async(q_fr: str, q_zh: str, a_zh: str, source: str = "agent_auto"):
+    """异步学习：立即返回，由后台批量提取关键词并更新知识库/FTS"""
+    _learn_queue.put(q_fr, q_zh, a_zh, source)
+
+def learn_stats() -> dict:
+    return _learn_queue.stats()
+
+class _HitCounter:
+    """
+    命中计数延迟聚合：retrieve_best 只在内存中累加 {知识条目 id: 次数}，
+    后台线程每 flush_interval_sec 用一条 executemany UPDATE 批量落盘（单事务），
+    退出时也会落盘；hits 与逐次 UPDATE 的结果最终一致（崩溃最多丢失一个间隔内的计数）
+    """
+
+    def __init__(self, flush_interval_sec: float = 5.0):
+        self.flush_interval_sec = float(flush_interval_sec)
+        self._lock = threading.Lock()
+        self._pending: dict = {}
+        self._last_hit: dict = {}
+        self._thread = None
+        self._pid = os.getpid()
+        self._counters = {"hits": 0, "flushes": 0, "rows": 0, "errors": 0}
+
+    def add(self, kid: int, n: int = 1):
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="bot_store-hits", daemon=True)
+                self._thread.start()
+            self._pending[kid] = self._pending.get(kid, 0) + n
+            self._last_hit[kid] = datetime.now().isoformat(timespec="seconds")
+            self._counters["hits"] += n
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            last_hit, self._last_hit = self._last_hit, {}
+        if not pending:
+            return
+        rows = [(n, last_hit[kid], kid) for kid, n in pending.items()]
+        try:
+            with _db.writer() as conn:
+                conn.executemany("UPDATE knowledge SET hits=hits+?, updated_at=? WHERE id=?", rows)
+        except sqlite3.Error as e:
+            # 写入失败：计数放回，下个周期重试
+            with self._lock:
+                for kid, n in pending.items():
+                    self._pending[kid] = self._pending.get(kid, 0) + n
+                    self._last_hit.setdefault(kid, last_hit[kid])
+                self._counters["errors"] += 1
+            logging.warning("[命中计数] 批量落盘失败 rows=%s err=%s", len(rows), e)
+            return
+        with self._lock:
+            self._counters["flushes"] += 1
+            self._counters["rows"] += len(rows)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval_sec)
+            self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            out["pending_ids"] = len(self._pending)
+        out["flush_interval_sec"] = self.flush_interval_sec
+        return out
+
+
+_hit_counter = _HitCounter(flush_interval_sec=float(os.getenv("BOT_HITS_FLUSH_SEC", "5")))
+atexit.register(_hit_counter.flush)
+
+def flush_hits():
+    """立即把累计的命中次数写入数据库"""
+    _hit_counter.flush()
+
+def hits_stats() -> dict:
+    return _hit_counter.stats()
+
+# 可选的内存检索引擎（kb_index.KnowledgeIndex）；就绪时 retrieve_best 不访问数据库
+_search_engine = None
+# 可选的语义检索（kb_semantic.SemanticIndex）；词面检索无结果时兜底
+_semantic_engine = None
+
+def use_search_engine(engine):
+    global _search_engine
+    _search_engine = engine
+
+def use_semantic_engine(engine):
+    global _semantic_engine
+    _semantic_engine = engine
+
+@_timed_op("retrieve_best")
 def retrieve_best(query_fr: str = "", query_zh: str = "", k: int = 3):
     """
-    用 FTS5 检索最相关答案；失败则回退 LIKE。返回 dict 或 None
+    用 FTS5 检索最相关答案（查询与索引同样切词，OR 召回 + bm25 排序 + 重合比例过滤）；
+    FTS 不可用时回退 LIKE；启用内存索引时改走内存检索；词面无结果且启用语义检索时取语义最近邻。
+    返回 dict 或 None
     """
-    with _connect() as conn, _lock:
+    engine = _search_engine
+    if engine is not None and engine.ready:
+        rows = engine.search(query_fr, k) + engine.search(query_zh, k)
+    else:
+        rows = _retrieve_fts(query_fr, query_zh, k)
+    if rows:
+        best = min(rows, key=lambda x: x["score"])
+    else:
+        semantic = _semantic_engine
+        found = semantic.search([query_fr, query_zh]) if (semantic is not None and semantic.ready) else None
+        if not found:
+            return None
+        kid, answer_zh, sim = found
+        best = {"id": kid, "answer_zh": answer_zh, "score": -sim, "semantic": True}
+    # 命中一次 +1 hits（内存累计，定期批量落盘；检索本身只读）
+    if engine is not None and engine.ready:
+        engine.add_hit(best["id"])
+    _hit_counter.add(best["id"])
+    return best
+
+def _retrieve_fts(query_fr: str, query_zh: str, k: int) -> list:
+    with _db.reader() as conn:
         def _search_fts(qraw: str):
-            q = _fts_make_query(qraw)
-            if not q:
+            toks = _fts_query_tokens(qraw)
+            if not toks:
                 return []
             sql = """
             SELECT rowid AS id, question_all, answer_zh, bm25(knowledge_fts) AS score
@@ -128,9 +705,11 @@ def retrieve_best(query_fr: str = "", query_zh: str = "", k: int = 3):
              ORDER BY score LIMIT ?;
             """
             try:
-                return conn.execute(sql, (q, k)).fetchall()
+                rows = conn.execute(sql, (_fts_make_query(toks), k * 4)).fetchall()
             except sqlite3.Error:
                 return _search_like(qraw)
+            rows = [r for r in rows if overlap_ratio(toks, r["question_all"].split()) >= _FTS_MIN_OVERLAP]
+            return rows[:k]
 
         def _search_like(qraw: str):
             pat = f"%{(qraw or '')[:50]}%"
@@ -145,26 +724,13 @@ def retrieve_best(query_fr: str = "", query_zh: str = "", k: int = 3):
             return conn.execute(sql, (pat, pat, k)).fetchall()
 
         rows = _search_fts(query_fr) + _search_fts(query_zh)
-        if not rows:
-            return None
-        cand = [{"id": r["id"], "answer_zh": r["answer_zh"], "score": r["score"]} for r in rows]
-        cand.sort(key=lambda x: x["score"])
-        best = cand[0]
-        # 命中一次 +1 hits
-        conn.execute("UPDATE knowledge SET hits=hits+1, updated_at=? WHERE id=?",
-                     (datetime.now().isoformat(timespec="seconds"), best["id"]))
-        conn.commit()
-        return best
+    return [{"id": r["id"], "answer_zh": r["answer_zh"], "score": r["score"]} for r in rows]
+
+def _fts_query_tokens(qraw: str) -> list:
+    return tokenize(qraw)[:_FTS_MAX_QUERY_TOKENS]
 
-def _fts_make_query(qraw: str) -> str:
+def _fts_make_query(toks: list) -> str:
     """
-    简化版：把文本切词后用 AND 连接，避开引号/特殊字符的 FTS 语法报错
+    检索词逐个加双引号后用 OR 连接（与索引同样切词），避开引号/特殊字符的 FTS 语法报错
     """
-    qraw = (qraw or "").strip()
-    if not qraw:
-        return ""
-    # 去引号及特殊字符
-    cleaned = re.sub(r'["\'`]+', " ", qraw)
-    toks = re.findall(r"[\w\u4e00-\u9fff]+", cleaned)
-    toks = [t for t in toks if len(t) > 1]
-    return " AND ".join(toks[:6])
+    return " OR ".join('"' + t.replace('"', '""') + '"' for t in toks)
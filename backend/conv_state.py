@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+会话状态存储（替代 app.py / llm_bot.py 中各自为政、永不回收的按 cid 字典）：
+- 每个 cid 一条紧凑记录（__slots__）
+- 空闲超时（idle TTL）回收 + 条目上限（LRU）回收
+- 仍有连接（sid）的 cid 视为活跃，不会被回收，行为与原来一致
+- 提供条目数 / 回收次数 / 估算内存等统计
+- 多实例部署（CONV_SHARED_STATE=true）：manual_online / last_client 等需跨进程可见的字段
+  写穿到 bot_store.conv_state 表，记录新建或有新连接时从共享表加载；
+  打字抑制、不活跃计时、LLM 上下文等热状态依靠按 cid 亲和路由留在同一进程
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from .bot_store import load_conv_state, save_conv_state
+except Exception:
+    from bot_store import load_conv_state, save_conv_state  # type: ignore
+
+# 写穿共享存储的字段
+SHARED_FIELDS = ("manual_online", "last_client", "last_client_msg_ts")
+
+
+class ConvRecord:
+    __slots__ = (
+        "manual_online",        # True=人工上线/不介入; False=下线/机器人介入
+        "last_agent_activity",  # 客服上次活动时间（epoch 秒）
+        "last_client",          # {'fr','zh','ts'} 最近一条客户消息，用于自动学习
+        "last_client_msg_ts",   # 最近一条客户消息 token
+        "llm_history",          # LLM 多轮上下文（llm_bot 使用）
+        "connected",            # 当前连接数（>0 不回收）
+        "last_seen",            # 最近访问时间（epoch 秒）
+    )
+
+    def __init__(self):
+        self.manual_online = True
+        self.last_agent_activity = 0.0
+        self.last_client: Optional[dict] = None
+        self.last_client_msg_ts = 0.0
+        self.llm_history: Optional[list] = None
+        self.connected = 0
+        self.last_seen = time.time()
+
+    def approx_bytes(self) -> int:
+        size = sys.getsizeof(self)
+        if self.last_client:
+            size += sys.getsizeof(self.last_client) + sum(sys.getsizeof(v) for v in self.last_client.values())
+        if self.llm_history:
+            size += sys.getsizeof(self.llm_history)
+            for m in self.llm_history:
+                size += sys.getsizeof(m) + sum(sys.getsizeof(v) for v in m.values())
+        return size
+
+
+class ConversationStore:
+    def __init__(self, idle_ttl_sec: float = 86400, max_entries: int = 50000, sweep_interval_sec: float = 60,
+                 shared: bool = False):
+        self.idle_ttl_sec = float(idle_ttl_sec)
+        self.max_entries = max(1, int(max_entries))
+        self.sweep_interval_sec = float(sweep_interval_sec)
+        self._lock = threading.RLock()
+        self._records: "OrderedDict[str, ConvRecord]" = OrderedDict()   # 按最近访问排序（末尾最新）
+        self._sessions: Dict[str, Tuple[str, str]] = {}                 # sid -> (role, cid)
+        self._last_sweep = time.time()
+        self._evicted_idle = 0
+        self._evicted_lru = 0
+        self.shared = shared
+        self._shared_errors = 0
+
+    # ---------- 记录 ----------
+    def get(self, cid: str) -> ConvRecord:
+        """取（必要时新建）cid 的记录，并刷新其最近访问时间"""
+        cid = cid or "default"
+        now = time.time()
+        with self._lock:
+            rec = self._records.get(cid)
+            if rec is None:
+                rec = self._records[cid] = ConvRecord()
+                self._load_shared(cid, rec)
+                self._evict_lru()
+            else:
+                self._records.move_to_end(cid)
+            rec.last_seen = now
+            self._maybe_sweep(now)
+            return rec
+
+    def peek(self, cid: str) -> Optional[ConvRecord]:
+        """只读查看，不新建、不刷新访问时间（用于后台轮询）"""
+        with self._lock:
+            return self._records.get(cid or "default")
+
+    def update(self, cid: str, **fields: Any) -> ConvRecord:
+        """修改记录字段；共享模式下把 SHARED_FIELDS 写穿到共享存储"""
+        rec = self.get(cid)
+        for name, value in fields.items():
+            setattr(rec, name, value)
+        if self.shared and any(name in SHARED_FIELDS for name in fields):
+            try:
+                save_conv_state(cid or "default", {name: getattr(rec, name) for name in SHARED_FIELDS})
+            except Exception as e:
+                self._shared_errors += 1
+                logging.warning("[会话状态] 写入共享存储失败 cid=%s err=%s", cid, e)
+        return rec
+
+    def _load_shared(self, cid: str, rec: ConvRecord):
+        if not self.shared:
+            return
+        try:
+            data = load_conv_state(cid) or {}
+        except Exception as e:
+            self._shared_errors += 1
+            logging.warning("[会话状态] 读取共享存储失败 cid=%s err=%s", cid, e)
+            return
+        for name in SHARED_FIELDS:
+            if name in data:
+                setattr(rec, name, data[name])
+
+    def __contains__(self, cid: str) -> bool:
+        with self._lock:
+            return cid in self._records
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    # ---------- 连接（sid） ----------
+    def bind_session(self, sid: str, role: str, cid: str):
+        with self._lock:
+            self._sessions[sid] = (role, cid)
+            known = cid in self._records
+            rec = self.get(cid)
+            if known and rec.connected == 0:
+                # 首个连接：该 cid 可能期间在其他实例上被修改过（扩缩容/重启后迁移），以共享存储为准
+                self._load_shared(cid, rec)
+            rec.connected += 1
+
+    def session(self, sid: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            return self._sessions.get(sid)
+
+    def unbind_session(self, sid: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            info = self._sessions.pop(sid, None)
+            if info:
+                rec = self._records.get(info[1])
+                if rec is not None:
+                    rec.connected = max(0, rec.connected - 1)
+                    rec.last_seen = time.time()
+                    self._records.move_to_end(info[1])
+            return info
+
+    # ---------- 回收 ----------
+    def _evict_lru(self):
+        """超出上限时从最久未访问端回收；有连接的 cid 跳过（移到末尾）"""
+        skipped = 0
+        while len(self._records) > self.max_entries and skipped < len(self._records):
+            cid, rec = next(iter(self._records.items()))
+            if rec.connected > 0:
+                self._records.move_to_end(cid)
+                skipped += 1
+                continue
+            del self._records[cid]
+            self._evicted_lru += 1
+
+    def _maybe_sweep(self, now: float):
+        if now - self._last_sweep >= self.sweep_interval_sec:
+            self._last_sweep = now
+            self.evict_idle(now)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """回收空闲超过 idle_ttl_sec 且无连接的记录；按访问顺序扫描，遇到未过期的即停止"""
+        now = now or time.time()
+        evicted = 0
+        with self._lock:
+            for cid in list(self._records.keys()):
+                rec = self._records[cid]
+                if now - rec.last_seen < self.idle_ttl_sec:
+                    break
+                if rec.connected > 0:
+                    rec.last_seen = now
+                    self._records.move_to_end(cid)
+                    continue
+                del self._records[cid]
+                evicted += 1
+            self._evicted_idle += evicted
+        return evicted
+
+    def connection_counts(self) -> Tuple[int, int]:
+        """(在线 sid 数, 有连接的 cid 数)；只扫描连接表，供 /metrics 频繁抓取"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return len(sessions), len({cid for _, cid in sessions})
+
+    def stats(self) -> dict:
+        with self._lock:
+            records = list(self._records.values())
+            sessions = len(self._sessions)
+            evicted_idle, evicted_lru = self._evicted_idle, self._evicted_lru
+        return {
+            "entries": len(records),
+            "max_entries": self.max_entries,
+            "idle_ttl_sec": self.idle_ttl_sec,
+            "sessions": sessions,
+            "connected_cids": sum(1 for r in records if r.connected > 0),
+            "evicted_idle": evicted_idle,
+            "evicted_lru": evicted_lru,
+            "approx_bytes": sum(r.approx_bytes() for r in records),
+            "shared": self.shared,
+            "shared_errors": self._shared_errors,
+        }
+
+
+conversations = ConversationStore(
+    idle_ttl_sec=float(os.getenv("CONV_IDLE_TTL_SEC", "86400")),
+    max_entries=int(os.getenv("CONV_MAX_ENTRIES", "50000")),
+    shared=os.getenv("CONV_SHARED_STATE", "false").lower() == "true",
+)
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+LibreTranslate 端点管理（翻译 /translate 与检测 /detect 共用）：
+- 每个主机一个 keep-alive requests.Session（连接池复用）
+- 每个端点滚动记录延迟与错误率，按健康度排序（最健康的先试）
+- 熔断：连续失败达到阈值后跳过该端点一段冷却时间；冷却结束后进入半开，只放行一个请求试探
+  （其余请求继续跳过），试探成功即闭合，失败则重新熔断；试探未被实际发出时下个冷却期后再放行
+- 记住端点接受 JSON 还是表单提交，避免每次 JSON→表单 的双请求
+- 对冲请求（hedging）：主端点超过 p95 延迟仍未返回时，并行向下一个端点发同一请求，
+  先返回有效结果者胜出，其余取消；对冲比例有上限，避免上游流量翻倍
+- 每次请求的耗时与失败按端点计入 /metrics（chatbot_libretranslate_*）
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from . import metrics
+except Exception:
+    import metrics  # type: ignore
+
+
+_FORM_FALLBACK_STATUS = (400, 415, 422)
+
+_REQUEST_SECONDS = metrics.histogram(
+    "chatbot_libretranslate_request_seconds", "LibreTranslate 端点单次请求耗时（/translate 与 /detect，含失败）",
+    ["endpoint"])
+_REQUEST_ERRORS = metrics.counter(
+    "chatbot_libretranslate_errors_total", "LibreTranslate 端点请求失败次数（HTTP 错误、异常、空返回）",
+    ["endpoint"])
+
+
+class Endpoint:
+    def __init__(self, url: str, window: int = 50):
+        self.url = url
+        self.latencies: deque = deque(maxlen=window)  # 最近成功请求的耗时（秒）
+        self.error_rate = 0.0                         # 失败率 EWMA（0~1）
+        self.consecutive_failures = 0
+        self.open_until = 0.0                         # 熔断到期时间（epoch 秒）
+        self.body_format: Optional[str] = None        # None / "json" / "form"
+        self.calls = 0
+        self.failures = 0
+
+    def mean_latency(self) -> float:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    def p95_latency(self) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def score(self, error_penalty_sec: float) -> float:
+        """越小越健康：平均延迟 + 失败率 × 惩罚秒数"""
+        return self.mean_latency() + self.error_rate * error_penalty_sec
+
+
+class EndpointPool:
+    def __init__(self, failure_threshold: int = 3, cooldown_sec: float = 30.0,
+                 error_alpha: float = 0.2, error_penalty_sec: float = 10.0, pool_maxsize: int = 10,
+                 hedge_enabled: bool = True, hedge_delay_sec: float = 0.0, hedge_p95_factor: float = 1.0,
+                 hedge_min_delay_sec: float = 0.3, hedge_default_delay_sec: float = 1.0,
+                 hedge_max_ratio: float = 0.1, hedge_burst: int = 5):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown_sec = float(cooldown_sec)
+        self.error_alpha = float(error_alpha)
+        self.error_penalty_sec = float(error_penalty_sec)
+        self.pool_maxsize = int(pool_maxsize)
+        self.hedge_enabled = hedge_enabled
+        self.hedge_delay_sec = float(hedge_delay_sec)          # >0 固定延迟；0 表示按主端点 p95 自适应
+        self.hedge_p95_factor = float(hedge_p95_factor)
+        self.hedge_min_delay_sec = float(hedge_min_delay_sec)
+        self.hedge_default_delay_sec = float(hedge_default_delay_sec)  # 主端点尚无样本时使用
+        self.hedge_max_ratio = float(hedge_max_ratio)          # 对冲请求数 ≤ ratio × 总请求数 + burst
+        self.hedge_burst = int(hedge_burst)
+        self._hedge_counters = {"requests": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0, "cancelled": 0}
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, Endpoint] = {}
+        self._sessions: Dict[str, requests.Session] = {}
+
+    # ---------- 注册与会话 ----------
+    def get(self, url: str) -> Endpoint:
+        with self._lock:
+            ep = self._endpoints.get(url)
+            if ep is None:
+                ep = self._endpoints[url] = Endpoint(url)
+            return ep
+
+    def session_for(self, url: str) -> requests.Session:
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            sess = self._sessions.get(host)
+            if sess is None:
+                sess = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                sess.mount(host, adapter)
+                self._sessions[host] = sess
+            return sess
+
+    # ---------- 排序与熔断 ----------
+    def ordered(self, urls: Iterable[str]) -> List[str]:
+        """
+        返回可用端点（健康度优先，分数相同保持配置顺序）；处于熔断期的端点被跳过。
+        半开端点只放行给本次调用：放行时把熔断期顺延一个冷却时间作为试探租约，并发请求仍跳过它。
+        """
+        now = time.time()
+        eps = [self.get(u) for u in dict.fromkeys(urls)]
+        live = []
+        with self._lock:
+            for ep in eps:
+                if ep.open_until > now:
+                    continue
+                if ep.consecutive_failures >= self.failure_threshold:
+                    ep.open_until = now + self.cooldown_sec
+                live.append(ep)
+        live.sort(key=lambda ep: ep.score(self.error_penalty_sec))
+        return [ep.url for ep in live]
+
+    def record(self, url: str, ok: bool, elapsed: float):
+        _REQUEST_SECONDS.labels(url).observe(elapsed)
+        if not ok:
+            _REQUEST_ERRORS.labels(url).inc()
+        ep = self.get(url)
+        with self._lock:
+            ep.calls += 1
+            ep.error_rate += self.error_alpha * ((0.0 if ok else 1.0) - ep.error_rate)
+            if ok:
+                ep.latencies.append(elapsed)
+                ep.consecutive_failures = 0
+                ep.open_until = 0.0
+                return
+            ep.failures += 1
+            ep.consecutive_failures += 1
+            if ep.consecutive_failures >= self.failure_threshold:
+                ep.open_until = time.time() + self.cooldown_sec
+                logging.warning("[端点熔断] endpoint=%s 连续失败=%s 冷却=%.0fs",
+                                url, ep.consecutive_failures, self.cooldown_sec)
+
+    def observe_latency(self, url: str, elapsed: float):
+        ep = self.get(url)
+        with self._lock:
+            ep.latencies.append(elapsed)
+
+    # ---------- 请求 ----------
+    def _post(self, ep: Endpoint, payload: dict, timeout: float) -> requests.Response:
+        sess = self.session_for(ep.url)
+        if ep.body_format == "form":
+            return sess.post(ep.url, data=payload, timeout=timeout)
+        resp = sess.post(ep.url, json=payload, timeout=timeout)
+        if resp.ok:
+            ep.body_format = "json"
+            return resp
+        # 若 JSON 返回 400/415/422 等，尝试表单回退，成功则记住
+        if ep.body_format is None and resp.status_code in _FORM_FALLBACK_STATUS:
+            resp2 = sess.post(ep.url, data=payload, timeout=timeout)
+            if resp2.ok:
+                ep.body_format = "form"
+            return resp2
+        return resp
+
+    def call(self, url: str, payload: dict, timeout: float,
+             validate: Callable[[Any], bool], quiet: bool = False) -> Optional[Any]:
+        """
+        POST 到端点并解析 JSON；validate(data) 为真才算成功。
+        成功返回 data，否则返回 None；两种结果都计入端点健康度。
+        """
+        log = logging.info if quiet else logging.warning
+        ep = self.get(url)
+        t0 = time.time()
+        data = None
+        ok = False
+        try:
+            resp = self._post(ep, payload, timeout)
+            if resp.ok:
+                data = resp.json()
+                ok = bool(validate(data))
+                if not ok:
+                    log(f"[端点-空返回] endpoint={url}")
+            else:
+                log(f"[端点失败-HTTP{resp.status_code}] endpoint={url}")
+        except Exception as e:
+            log(f"[端点异常] endpoint={url} err={e}")
+        self.record(url, ok, time.time() - t0)
+        return data if ok else None
+
+    # ---------- 对冲 ----------
+    def hedge_delay(self, url: str) -> float:
+        if self.hedge_delay_sec > 0:
+            return self.hedge_delay_sec
+        ep = self.get(url)
+        if not ep.latencies:
+            return self.hedge_default_delay_sec
+        return max(self.hedge_min_delay_sec, ep.p95_latency() * self.hedge_p95_factor)
+
+    def _take_hedge_budget(self) -> bool:
+        with self._lock:
+            c = self._hedge_counters
+            if c["hedged"] >= c["requests"] * self.hedge_max_ratio + self.hedge_burst:
+                return False
+            c["hedged"] += 1
+            return True
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._hedge_counters[name] += n
+
+    def hedged_call(self, urls: List[str], payload: dict, timeout: float,
+                    validate: Callable[[Any], bool], quiet: bool = False) -> Optional[Any]:
+        """
+        按 urls 顺序（调用方已按健康度排序）请求，首个有效结果胜出：
+        - 主端点超过对冲延迟未返回 → 在新 greenlet 中并行请求下一个端点（受对冲预算限制）
+        - 某个请求失败 → 立即启动下一个端点（与原级联行为一致）
+        - 胜出后取消其余进行中的请求
+        gevent 不可用或未开启对冲时退化为顺序级联。
+        """
+        urls = list(urls)
+        if not urls:
+            return None
+        try:
+            import gevent
+            from gevent.queue import Queue, Empty
+        except Exception:
+            gevent = None
+        if gevent is None or not self.hedge_enabled or len(urls) < 2:
+            for url in urls:
+                data = self.call(url, payload, timeout, validate, quiet=quiet)
+                if data is not None:
+                    return data
+            return None
+
+        self._count("requests")
+        results: Queue = Queue()
+        running: Dict[str, Any] = {}
+        pending = urls[:]
+        primary = pending[0]
+
+        def _run(u: str):
+            results.put((u, self.call(u, payload, timeout, validate, quiet=quiet)))
+
+        started: Dict[str, float] = {}
+
+        def _start(u: str):
+            started[u] = time.time()
+            running[u] = gevent.spawn(_run, u)
+
+        _start(pending.pop(0))
+        hedge_at: Optional[float] = time.time() + self.hedge_delay(primary)
+        try:
+            while running:
+                wait = None
+                if pending and hedge_at is not None:
+                    wait = max(0.0, hedge_at - time.time())
+                try:
+                    url, data = results.get(timeout=wait)
+                except Empty:
+                    # 对冲计时到：每个请求最多追加一次对冲
+                    hedge_at = None
+                    if pending and self._take_hedge_budget():
+                        _start(pending.pop(0))
+                    continue
+                running.pop(url, None)
+                if data is not None:
+                    self._count("primary_wins" if url == primary else "hedge_wins")
+                    return data
+                if pending:
+                    _start(pending.pop(0))
+            return None
+        finally:
+            if running:
+                self._count("cancelled", len(running))
+                gevent.killall(list(running.values()), block=False)
+                # 被取消的慢端点：以已耗时作为延迟下界计入样本，使排序尽快让位
+                now = time.time()
+                for u in running:
+                    self.observe_latency(u, now - started[u])
+
+    def hedge_stats(self) -> dict:
+        with self._lock:
+            out = dict(self._hedge_counters)
+        out["hedge_rate"] = round(out["hedged"] / out["requests"], 4) if out["requests"] else 0.0
+        return out
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            eps = list(self._endpoints.values())
+        return {
+            ep.url: {
+                "calls": ep.calls,
+                "failures": ep.failures,
+                "error_rate": round(ep.error_rate, 4),
+                "mean_latency": round(ep.mean_latency(), 4),
+                "p95_latency": round(ep.p95_latency(), 4),
+                "circuit_open": ep.open_until > now,
+                "body_format": ep.body_format,
+            }
+            for ep in eps
+        }
+
+
+libre_pool = EndpointPool(
+    failure_threshold=int(os.getenv("LIBRE_CB_FAILURES", "3")),
+    cooldown_sec=float(os.getenv("LIBRE_CB_COOLDOWN_SEC", "30")),
+    pool_maxsize=int(os.getenv("LIBRE_POOL_MAXSIZE", "10")),
+    hedge_enabled=os.getenv("LIBRE_HEDGE_ENABLED", "true").lower() != "false",
+    hedge_delay_sec=float(os.getenv("LIBRE_HEDGE_DELAY_SEC", "0")),
+    hedge_p95_factor=float(os.getenv("LIBRE_HEDGE_P95_FACTOR", "1.0")),
+    hedge_max_ratio=float(os.getenv("LIBRE_HEDGE_MAX_RATIO", "0.1")),
+)
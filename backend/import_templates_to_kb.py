@@ -15,10 +15,10 @@ from typing import Dict, Tuple
 
 try:
     # 包内导入
-    from .bot_store import init_db, upsert_qa
+    from .bot_store import init_db, upsert_qa_many
     from .templates_kb import TEMPLATES
 except Exception:  # 兼容脚本路径运行
-    from bot_store import init_db, upsert_qa  # type: ignore
+    from bot_store import init_db, upsert_qa_many  # type: ignore
     from templates_kb import TEMPLATES  # type: ignore
 
 
@@ -50,7 +50,7 @@ TRIGGERS: Dict[str, Tuple[str, str]] = {
 def main() -> None:
     init_db()
 
-    inserted = 0
+    rows = []
     skipped = 0
 
     for key, lang_map in TEMPLATES.items():
@@ -67,10 +67,11 @@ def main() -> None:
         if fr_ans and len(fr_ans) < 200:
             q_fr = f"{q_fr} {fr_ans}"
 
-        upsert_qa(q_fr=q_fr, q_zh=q_zh, a_zh=zh, source="template_seed")
-        inserted += 1
+        rows.append((q_fr, q_zh, zh, "template_seed"))
 
-    print(f"templates imported: {inserted}, skipped(no zh): {skipped}")
+    # 一次批量写入：关键词经 nlp.pipe 批量提取，单事务提交
+    upsert_qa_many(rows)
+    print(f"templates imported: {len(rows)}, skipped(no zh): {skipped}")
 
 
 if __name__ == "__main__":
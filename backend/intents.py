@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+意图匹配引擎（logic 模板 / 规则 / 别名、policy 话题分类共用）：
+- 规则在导入时编译一次：正则 re.compile；纯字面关键词直接进入 Aho-Corasick 自动机
+- 从每条正则中提取“必含字面量”（如 r"提现.*条件" 必含 “提现” 或 “条件”，取更长/更具区分度的一组）
+  也放进同一个自动机；匹配时对文本做一次扫描，得到可能命中的候选规则集合
+- 只对候选正则（以及无法提取字面量的正则）按原优先级顺序执行 search，返回第一个命中的 key，
+  与原来“按 dict 顺序逐条 re.search / in 判断”的结果一致
+- 单条消息的匹配开销主要取决于文本长度与候选数，规则增长到数千条时基本不变（见 benchmarks/bench_intents.py）
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
+
+try:
+    import re._parser as _sre_parse  # Python 3.11+
+    from re._constants import LITERAL, SUBPATTERN, BRANCH
+except ImportError:  # pragma: no cover - 旧版本 Python
+    import sre_parse as _sre_parse  # type: ignore
+    from sre_constants import LITERAL, SUBPATTERN, BRANCH  # type: ignore
+
+
+class AhoCorasick:
+    """多模式字面量匹配：一次扫描文本，返回出现过的模式所关联的全部 payload"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        self._built = True
+
+    def add(self, word: str, payload: int):
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(payload)
+        self._built = False
+
+    def build(self):
+        """BFS 计算失败指针，并把失败链上的输出合并到各节点"""
+        queue = list(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        i = 0
+        while i < len(queue):
+            node = queue[i]
+            i += 1
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                cand = self._goto[f].get(ch, 0)
+                self._fail[nxt] = cand if cand != nxt else 0
+                if self._out[self._fail[nxt]]:
+                    self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def find_all(self, text: str) -> Set[int]:
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        found: Set[int] = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+
+def _literal_runs(items) -> List[Set[str]]:
+    """解析树的一个序列中，每一组“至少出现其一”的必含字面量集合"""
+    groups: List[Set[str]] = []
+    run: List[str] = []
+
+    def _close():
+        if run:
+            groups.append({"".join(run)})
+            run.clear()
+
+    for op, av in items:
+        if op is LITERAL:
+            run.append(chr(av))
+            continue
+        _close()
+        if op is SUBPATTERN:
+            sub = _required_literals(av[-1])
+            if sub:
+                groups.append(sub)
+        elif op is BRANCH:
+            alts = [_required_literals(branch) for branch in av[1]]
+            if all(alts):
+                groups.append(set().union(*alts))
+        # 其他结构（字符类、重复、锚点等）只截断字面量，不贡献必含条件
+    _close()
+    return groups
+
+
+def _required_literals(items) -> Optional[Set[str]]:
+    """取区分度最高的一组必含字面量（组内最短者最长）；提取不到返回 None"""
+    groups = [g for g in _literal_runs(items) if all(g)]
+    if not groups:
+        return None
+    return max(groups, key=lambda g: (min(len(w) for w in g), -len(g)))
+
+
+def required_literals(pattern: str, flags: int = 0) -> Optional[Set[str]]:
+    """正则匹配成功时文本中必然出现的字面量（出现其一即可）；小写返回，供忽略大小写的匹配使用"""
+    try:
+        parsed = _sre_parse.parse(pattern, flags)
+    except re.error:
+        return None
+    lits = _required_literals(list(parsed))
+    return {w.lower() for w in lits} if lits else None
+
+
+class IntentMatcher:
+    """
+    有序规则集：[(key, pattern, is_regex)]，按列表顺序为优先级。
+    match(text) 返回第一个命中规则的 key；文本统一小写后匹配（正则另带 re.I）
+    """
+
+    def __init__(self, rules: Iterable[Tuple[Any, str, bool]], flags: int = re.I, name: str = "intents"):
+        self.name = name
+        self._keys: List[Any] = []
+        self._regex: List[Optional[re.Pattern]] = []   # None 表示纯字面规则（自动机命中即成立）
+        self._always: List[int] = []                   # 提取不到字面量、每次都需执行的正则
+        self._ac = AhoCorasick()
+        skipped = 0
+        for key, pattern, is_regex in rules:
+            if not pattern:
+                continue
+            idx = len(self._keys)
+            if is_regex:
+                try:
+                    compiled = re.compile(pattern, flags)
+                except re.error as e:
+                    skipped += 1
+                    logging.warning("[意图] %s 规则 %r 编译失败，已跳过: %s", name, pattern, e)
+                    continue
+                self._keys.append(key)
+                self._regex.append(compiled)
+                lits = required_literals(pattern, flags)
+                if lits:
+                    for w in lits:
+                        self._ac.add(w, idx)
+                else:
+                    self._always.append(idx)
+            else:
+                self._keys.append(key)
+                self._regex.append(None)
+                self._ac.add(pattern.lower(), idx)
+        self._ac.build()
+        self.skipped = skipped
+
+    @classmethod
+    def from_patterns(cls, patterns: Mapping[Any, Sequence[str]], flags: int = re.I, name: str = "intents"):
+        """{key: [正则, ...]}（dict 顺序即优先级）"""
+        return cls(((k, p, True) for k, pats in patterns.items() for p in pats), flags=flags, name=name)
+
+    def candidates(self, text: str) -> List[int]:
+        found = self._ac.find_all(text)
+        if self._always:
+            found.update(self._always)
+        return sorted(found)
+
+    def match(self, text: str) -> Optional[Any]:
+        t = (text or "").lower()
+        if not t:
+            return None
+        for idx in self.candidates(t):
+            rx = self._regex[idx]
+            if rx is None or rx.search(t):
+                return self._keys[idx]
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(self._keys),
+            "regex": sum(1 for r in self._regex if r is not None),
+            "unfiltered_regex": len(self._always),
+            "automaton_states": len(self._ac),
+            "skipped": self.skipped,
+        }
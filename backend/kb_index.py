@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+知识库内存检索（可选，KB_INDEX_ENABLED=true 启用）：
+- 启动时把 knowledge 全表载入内存：词表 token→id，倒排表为按 token id 索引的紧凑数组（array('I') 存文档 id）
+- 打分：BM25（分词规则与 FTS 一致，见 textseg）+ 命中次数先验 prior_weight × log(1 + hits)，
+  并沿用 FTS 路径的重合比例过滤
+- upsert_qa 写入后经 bot_store 变更通知增量更新；每次写入同事务递增 kb_meta.knowledge_version，
+  后台定期比对版本号，发现其他进程的写入（多实例 / 导入脚本）则全量重载
+- 检索热路径只做内存运算，不访问数据库
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+try:
+    from .bot_store import (knowledge_snapshot, knowledge_version, add_knowledge_listener,
+                            use_search_engine, _knowledge_fts_text, _FTS_MIN_OVERLAP, _FTS_MAX_QUERY_TOKENS)
+    from .textseg import tokenize, overlap_ratio
+except Exception:
+    from bot_store import (knowledge_snapshot, knowledge_version, add_knowledge_listener,  # type: ignore
+                           use_search_engine, _knowledge_fts_text, _FTS_MIN_OVERLAP, _FTS_MAX_QUERY_TOKENS)
+    from textseg import tokenize, overlap_ratio  # type: ignore
+
+
+class _Doc:
+    __slots__ = ("tokens", "answer_zh", "hits")
+
+    def __init__(self, tokens: array, answer_zh: str, hits: int):
+        self.tokens = tokens        # 去重后的 token id
+        self.answer_zh = answer_zh
+        self.hits = hits
+
+
+class KnowledgeIndex:
+    def __init__(self, k1: float = 1.2, b: float = 0.75, prior_weight: float = 0.3,
+                 refresh_interval_sec: float = 5.0):
+        self.k1 = float(k1)
+        self.b = float(b)
+        self.prior_weight = float(prior_weight)
+        self.refresh_interval_sec = float(refresh_interval_sec)
+        self._lock = threading.RLock()
+        self._vocab: Dict[str, int] = {}
+        self._id2tok: List[str] = []
+        self._postings: List[array] = []     # token id -> array('I') 文档 id
+        self._docs: Dict[int, _Doc] = {}
+        self._total_len = 0
+        self.version = -1
+        self.ready = False
+        self._thread = None
+        self._counters = {"searches": 0, "reloads": 0, "incremental": 0, "search_time_total": 0.0}
+
+    # ---------- 构建 ----------
+    def _token_id(self, tok: str) -> int:
+        tid = self._vocab.get(tok)
+        if tid is None:
+            tid = self._vocab[tok] = len(self._id2tok)
+            self._id2tok.append(tok)
+            self._postings.append(array("I"))
+        return tid
+
+    def _remove(self, kid: int):
+        doc = self._docs.pop(kid, None)
+        if doc is None:
+            return
+        for tid in doc.tokens:
+            self._postings[tid].remove(kid)
+        self._total_len -= len(doc.tokens)
+
+    def _put(self, row: dict):
+        kid = int(row["id"])
+        self._remove(kid)
+        text = _knowledge_fts_text(row.get("q_fr") or "", row.get("q_zh") or "", row.get("keywords") or "")
+        tids = array("I", (self._token_id(t) for t in text.split()))
+        for tid in tids:
+            self._postings[tid].append(kid)
+        self._docs[kid] = _Doc(tids, row.get("a_zh") or "", int(row.get("hits") or 0))
+        self._total_len += len(tids)
+
+    def load(self):
+        """全量载入（启动时 / 检测到其他进程写入时）"""
+        t0 = time.time()
+        rows, version = knowledge_snapshot()
+        fresh = KnowledgeIndex(self.k1, self.b, self.prior_weight, self.refresh_interval_sec)
+        for row in rows:
+            fresh._put(row)
+        with self._lock:
+            self._vocab, self._id2tok, self._postings = fresh._vocab, fresh._id2tok, fresh._postings
+            self._docs, self._total_len = fresh._docs, fresh._total_len
+            self.version = version
+            self.ready = True
+            self._counters["reloads"] += 1
+        logging.info("[知识库索引] 载入 %s 条，词表 %s，版本 %s，耗时 %.3fs",
+                     len(rows), len(self._id2tok), version, time.time() - t0)
+
+    def on_change(self, rows: List[dict], version: int):
+        """bot_store 写入后的增量通知；版本号不连续说明期间有其他进程写入，改为全量重载"""
+        with self._lock:
+            if not self.ready:
+                return
+            if version != self.version + 1:
+                stale = True
+            else:
+                stale = False
+                for row in rows:
+                    self._put(row)
+                self.version = version
+                self._counters["incremental"] += 1
+        if stale:
+            self.load()
+
+    def add_hit(self, kid: int):
+        with self._lock:
+            doc = self._docs.get(kid)
+            if doc is not None:
+                doc.hits += 1
+
+    # ---------- 后台版本比对 ----------
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval_sec)
+            try:
+                if knowledge_version() != self.version:
+                    self.load()
+            except Exception as e:
+                logging.warning("[知识库索引] 版本比对失败: %s", e)
+
+    def start(self):
+        """载入、注册到 bot_store（retrieve_best 改走内存检索）并启动后台版本比对"""
+        self.load()
+        add_knowledge_listener(self.on_change)
+        use_search_engine(self)
+        if self._thread is None and self.refresh_interval_sec > 0:
+            self._thread = threading.Thread(target=self._refresh_loop, name="kb-index-refresh", daemon=True)
+            self._thread.start()
+
+    # ---------- 检索 ----------
+    def search(self, qraw: str, k: int = 3) -> List[dict]:
+        """返回 [{"id","answer_zh","score"}]，score 越小越相关（与 FTS bm25 同向）"""
+        toks = tokenize(qraw)[:_FTS_MAX_QUERY_TOKENS]
+        if not toks:
+            return []
+        t0 = time.perf_counter()
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return []
+            avgdl = self._total_len / n_docs
+            k1, b = self.k1, self.b
+            scores: Dict[int, float] = {}
+            for tok in toks:
+                tid = self._vocab.get(tok)
+                if tid is None:
+                    continue
+                plist = self._postings[tid]
+                df = len(plist)
+                if not df:
+                    continue
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for kid in plist:
+                    dl = len(self._docs[kid].tokens)
+                    # 索引文本已去重，词频恒为 1
+                    scores[kid] = scores.get(kid, 0.0) + idf * (k1 + 1) / (1 + k1 * (1 - b + b * dl / avgdl))
+            if not scores:
+                return []
+            for kid in scores:
+                scores[kid] += self.prior_weight * math.log1p(self._docs[kid].hits)
+            top = heapq.nlargest(k * 4, scores.items(), key=lambda kv: kv[1])
+            out = []
+            for kid, score in top:
+                doc = self._docs[kid]
+                if overlap_ratio(toks, (self._id2tok[t] for t in doc.tokens)) < _FTS_MIN_OVERLAP:
+                    continue
+                out.append({"id": kid, "answer_zh": doc.answer_zh, "score": -score})
+                if len(out) >= k:
+                    break
+            self._counters["searches"] += 1
+            self._counters["search_time_total"] += time.perf_counter() - t0
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self._counters)
+            out = {
+                "ready": self.ready,
+                "version": self.version,
+                "docs": len(self._docs),
+                "vocab": len(self._id2tok),
+                "postings": sum(len(p) for p in self._postings),
+            }
+        out.update(searches=c["searches"], reloads=c["reloads"], incremental=c["incremental"],
+                   search_avg_us=round(c["search_time_total"] / c["searches"] * 1e6, 1) if c["searches"] else 0.0)
+        return out
+
+
+KB_INDEX_ENABLED = os.getenv("KB_INDEX_ENABLED", "false").lower() == "true"
+
+kb_index = KnowledgeIndex(
+    prior_weight=float(os.getenv("KB_INDEX_PRIOR_WEIGHT", "0.3")),
+    refresh_interval_sec=float(os.getenv("KB_INDEX_REFRESH_SEC", "5")),
+)
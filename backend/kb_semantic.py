@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+知识库语义检索（可选，KB_SEMANTIC_ENABLED=true 启用；纯 CPU、离线）：
+- 向量：哈希字符 n-gram TF-IDF（法语等按词加边界取 3~4-gram，中文取单字 + 二元组），
+  特征经 crc32 哈希到 dim 维，log(1+tf) × idf 后 L2 归一化
+- 存储：连续 float32 矩阵写入 <BOT_DB_PATH 去扩展名>.vectors.f32，np.memmap 映射；
+  元数据（id 顺序、容量、版本号）在 .vectors.json，idf 在 .vectors.idf.npy
+- 检索：所有查询向量与矩阵一次批量 matmul 求余弦，取最高者；相似度低于 min_sim 视为未命中
+- upsert_qa 新增条目经 bot_store 变更通知追加到矩阵末尾（容量不足时按倍数扩容文件）；
+  版本号不连续或数据库版本与元数据不一致时全量重建（idf 随之更新）
+- 仅在词面检索（FTS / 内存倒排）无结果时作为兜底，减少落到 LLM 的请求
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy 未安装时语义检索不可用
+    np = None  # type: ignore
+
+try:
+    from .bot_store import (knowledge_snapshot, knowledge_version, add_knowledge_listener,
+                            use_semantic_engine, _DB_PATH)
+except Exception:
+    from bot_store import (knowledge_snapshot, knowledge_version, add_knowledge_listener,  # type: ignore
+                           use_semantic_engine, _DB_PATH)
+
+_CJK = "㐀-䶿一-鿿豈-﫿"
+_RUN_RE = re.compile(f"([{_CJK}]+)|([^\\W_{_CJK}]+)")
+
+
+def features(text: str) -> Dict[str, int]:
+    """字符 n-gram 计数（词面变体、拼写差异、部分重合都能贡献相似度）"""
+    text = unicodedata.normalize("NFKD", unicodedata.normalize("NFKC", text or "").lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    grams: Dict[str, int] = {}
+    for m in _RUN_RE.finditer(text):
+        cjk, word = m.group(1), m.group(2)
+        if cjk:
+            items = list(cjk) + [cjk[i:i + 2] for i in range(len(cjk) - 1)]
+        else:
+            padded = f" {word} "
+            items = [padded[i:i + n] for n in (3, 4) for i in range(len(padded) - n + 1)]
+        for g in items:
+            grams[g] = grams.get(g, 0) + 1
+    return grams
+
+
+class SemanticIndex:
+    def __init__(self, path_prefix: str, dim: int = 1024, min_sim: float = 0.25):
+        self.path_prefix = path_prefix
+        self.dim = int(dim)
+        self.min_sim = float(min_sim)
+        self._lock = threading.RLock()
+        self._matrix = None            # np.memmap (capacity × dim)，前 count 行有效
+        self._idf = None               # (dim,) float32
+        self._ids: List[int] = []
+        self._pos: Dict[int, int] = {}
+        self._answers: Dict[int, str] = {}
+        self._capacity = 0
+        self.version = -1
+        self.ready = False
+        self._counters = {"searches": 0, "hits": 0, "appends": 0, "rebuilds": 0, "search_time_total": 0.0}
+
+    # ---------- 文件 ----------
+    @property
+    def _matrix_path(self) -> str:
+        return self.path_prefix + ".f32"
+
+    @property
+    def _meta_path(self) -> str:
+        return self.path_prefix + ".json"
+
+    @property
+    def _idf_path(self) -> str:
+        return self.path_prefix + ".idf.npy"
+
+    @staticmethod
+    def _tmp_path(path: str) -> str:
+        # 多实例部署时各进程可能同时重建，临时文件按进程区分，互不覆盖 / 抢先替换
+        return f"{path}.{os.getpid()}.tmp"
+
+    def _write_meta(self):
+        meta = {"dim": self.dim, "count": len(self._ids), "capacity": self._capacity,
+                "ids": self._ids, "version": self.version}
+        tmp = self._tmp_path(self._meta_path)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, separators=(",", ":"))
+        os.replace(tmp, self._meta_path)
+
+    def _open_matrix(self, capacity: int, mode: str):
+        return np.memmap(self._matrix_path, dtype=np.float32, mode=mode, shape=(max(1, capacity), self.dim))
+
+    # ---------- 向量化 ----------
+    def _hashed_tf(self, texts: Sequence[str]):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for g, c in features(t).items():
+                out[i, zlib.crc32(g.encode("utf-8")) % self.dim] += c
+        return np.log1p(out, out=out)
+
+    def embed(self, texts: Sequence[str]):
+        vecs = self._hashed_tf(texts)
+        if self._idf is not None:
+            vecs *= self._idf
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vecs / norms
+
+    @staticmethod
+    def _doc_text(row: dict) -> str:
+        return " ".join(filter(None, [row.get("q_fr"), row.get("q_zh"), (row.get("keywords") or "").replace(",", " ")]))
+
+    # ---------- 构建 ----------
+    def rebuild(self, rows: List[dict], version: int):
+        """全量重建：重算 idf 并写出矩阵文件（先写临时文件再原子替换）"""
+        t0 = time.time()
+        tf = self._hashed_tf([self._doc_text(r) for r in rows])
+        df = (tf > 0).sum(axis=0).astype(np.float32)
+        idf = (np.log((1 + len(rows)) / (1 + df)) + 1).astype(np.float32)
+        capacity = max(64, 1 << math.ceil(math.log2(max(1, len(rows)) * 1.5)))
+        tmp = self._tmp_path(self._matrix_path)
+        idf_tmp = self._tmp_path(self._idf_path)
+        try:
+            mat = np.memmap(tmp, dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+            if rows:
+                vecs = tf * idf
+                norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                mat[:len(rows)] = vecs / norms
+            mat.flush()
+            del mat
+            with open(idf_tmp, "wb") as f:
+                np.save(f, idf)
+            os.replace(tmp, self._matrix_path)
+            os.replace(idf_tmp, self._idf_path)
+        finally:
+            for path in (tmp, idf_tmp):
+                if os.path.exists(path):
+                    os.unlink(path)
+        with self._lock:
+            self._idf = idf
+            self._capacity = capacity
+            self._matrix = self._open_matrix(capacity, "r+")
+            self._ids = [int(r["id"]) for r in rows]
+            self._pos = {kid: i for i, kid in enumerate(self._ids)}
+            self._answers = {int(r["id"]): r.get("a_zh") or "" for r in rows}
+            self.version = version
+            self._write_meta()
+            self.ready = True
+            self._counters["rebuilds"] += 1
+        logging.info("[语义检索] 重建 %s 条 dim=%s 耗时 %.3fs", len(rows), self.dim, time.time() - t0)
+
+    def load(self):
+        """优先映射磁盘上的矩阵（元数据与数据库版本一致时），否则全量重建"""
+        rows, version = knowledge_snapshot()
+        try:
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            ids = [int(r["id"]) for r in rows]
+            if meta.get("version") == version and meta.get("dim") == self.dim and sorted(meta["ids"]) == sorted(ids):
+                with self._lock:
+                    self._idf = np.load(self._idf_path)
+                    self._capacity = int(meta["capacity"])
+                    self._matrix = self._open_matrix(self._capacity, "r+")
+                    self._ids = [int(i) for i in meta["ids"]]
+                    self._pos = {kid: i for i, kid in enumerate(self._ids)}
+                    self._answers = {int(r["id"]): r.get("a_zh") or "" for r in rows}
+                    self.version = version
+                    self.ready = True
+                logging.info("[语义检索] 映射已有矩阵 %s 条", len(self._ids))
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        self.rebuild(rows, version)
+
+    def _append(self, rows: List[dict]):
+        vecs = self.embed([self._doc_text(r) for r in rows])
+        for row, vec in zip(rows, vecs):
+            kid = int(row["id"])
+            self._answers[kid] = row.get("a_zh") or ""
+            pos = self._pos.get(kid)
+            if pos is None:
+                if len(self._ids) >= self._capacity:
+                    # 扩容：文件加长后重新映射
+                    self._matrix.flush()
+                    self._capacity *= 2
+                    with open(self._matrix_path, "r+b") as f:
+                        f.truncate(self._capacity * self.dim * 4)
+                    self._matrix = self._open_matrix(self._capacity, "r+")
+                pos = len(self._ids)
+                self._ids.append(kid)
+                self._pos[kid] = pos
+                self._counters["appends"] += 1
+            self._matrix[pos] = vec
+        self._matrix.flush()
+
+    def on_change(self, rows: List[dict], version: int):
+        with self._lock:
+            if not self.ready:
+                return
+            stale = version != self.version + 1
+            if not stale:
+                self._append(rows)
+                self.version = version
+                self._write_meta()
+        if stale:
+            self.load()
+
+    def start(self, refresh_interval_sec: float = 0):
+        """载入 / 重建索引并注册为兜底检索；失败时记录日志并关闭语义检索，不影响服务启动"""
+        try:
+            self.load()
+        except Exception as e:
+            logging.warning("[语义检索] 初始化失败，语义检索已关闭: %s", e)
+            return
+        add_knowledge_listener(self.on_change)
+        use_semantic_engine(self)
+        if refresh_interval_sec > 0:
+            def _loop():
+                while True:
+                    time.sleep(refresh_interval_sec)
+                    try:
+                        if knowledge_version() != self.version:
+                            self.load()
+                    except Exception as e:
+                        logging.warning("[语义检索] 版本比对失败: %s", e)
+            threading.Thread(target=_loop, name="kb-semantic-refresh", daemon=True).start()
+
+    # ---------- 检索 ----------
+    def search(self, queries: Sequence[str]) -> Optional[Tuple[int, str, float]]:
+        """所有非空查询一次 matmul；返回 (id, answer_zh, 相似度) 或 None"""
+        queries = [q for q in queries if q and q.strip()]
+        if not queries:
+            return None
+        t0 = time.perf_counter()
+        with self._lock:
+            n = len(self._ids)
+            if not n:
+                return None
+            q = self.embed(queries)
+            sims = q @ self._matrix[:n].T          # (查询数 × 文档数) 余弦相似度
+            flat = int(np.argmax(sims))
+            best_pos = flat % n
+            sim = float(sims.flat[flat])
+            kid = self._ids[best_pos]
+            self._counters["searches"] += 1
+            self._counters["search_time_total"] += time.perf_counter() - t0
+            if sim < self.min_sim:
+                return None
+            self._counters["hits"] += 1
+            return kid, self._answers.get(kid, ""), sim
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self._counters)
+            out = {"ready": self.ready, "version": self.version, "docs": len(self._ids),
+                   "capacity": self._capacity, "dim": self.dim, "min_sim": self.min_sim}
+        out.update(searches=c["searches"], hits=c["hits"], appends=c["appends"], rebuilds=c["rebuilds"],
+                   search_avg_us=round(c["search_time_total"] / c["searches"] * 1e6, 1) if c["searches"] else 0.0)
+        return out
+
+
+KB_SEMANTIC_ENABLED = os.getenv("KB_SEMANTIC_ENABLED", "false").lower() == "true" and np is not None
+
+kb_semantic = SemanticIndex(
+    path_prefix=os.getenv("KB_SEMANTIC_PATH", "").strip() or os.path.splitext(_DB_PATH)[0] + ".vectors",
+    dim=int(os.getenv("KB_SEMANTIC_DIM", "1024")),
+    min_sim=float(os.getenv("KB_SEMANTIC_MIN_SIM", "0.25")),
+)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+知识库关键词提取服务（upsert_qa 使用）：
+- jieba 词典与精简 spaCy 管线（只保留 NER）全进程只加载一次，启动时后台预热
+- 批量接口 extract_many 用 nlp.pipe 一次处理多条法语问题
+- gevent 下 CPU 密集的分词/NER 放到 hub 线程池执行，不阻塞事件循环
+- jieba / spaCy / 法语模型缺失时对应部分返回空关键词（不影响入库）
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Callable, List, Sequence, Tuple, TypeVar
+
+SPACY_MODEL = os.getenv("KEYWORDS_SPACY_MODEL", "fr_core_news_sm")
+# NER 之外的组件全部排除（不存在的组件名会被忽略）
+_SPACY_EXCLUDE = ["tagger", "morphologizer", "parser", "attribute_ruler", "lemmatizer", "senter"]
+
+MAX_ZH_KEYWORDS = 10
+MAX_FR_ENTITIES = 5
+MAX_KEYWORDS = 15
+
+T = TypeVar("T")
+
+try:
+    # 提取在线程池的真实线程中执行，需用未被 gevent 替换的原生锁
+    from gevent.monkey import get_original
+    _NativeLock = get_original("threading", "Lock")
+except Exception:
+    _NativeLock = threading.Lock
+
+
+def run_off_loop(fn: Callable[..., T], *args) -> T:
+    """gevent 已打补丁时在 hub 线程池（真实线程）中执行 fn，否则直接调用"""
+    try:
+        from gevent import monkey, get_hub
+        if monkey.is_module_patched("threading"):
+            return get_hub().threadpool.apply(fn, args)
+    except Exception:
+        pass
+    return fn(*args)
+
+
+class KeywordExtractor:
+    def __init__(self, spacy_model: str = SPACY_MODEL, batch_size: int = 32):
+        self.spacy_model = spacy_model
+        self.batch_size = max(1, int(batch_size))
+        self._lock = _NativeLock()   # 串行化加载与提取（jieba / spaCy 管线不做并发调用）
+        self._jieba = None
+        self._nlp = None
+        self._jieba_failed = False
+        self._spacy_failed = False
+
+    # ---------- 加载（调用方持有 self._lock） ----------
+    def _get_jieba(self):
+        if self._jieba is None and not self._jieba_failed:
+            try:
+                import jieba
+                jieba.setLogLevel(logging.WARNING)
+                jieba.initialize()
+                self._jieba = jieba
+            except Exception as e:
+                self._jieba_failed = True
+                logging.warning("[关键词] jieba 不可用，跳过中文关键词: %s", e)
+        return self._jieba
+
+    def _get_nlp(self):
+        if self._nlp is None and not self._spacy_failed:
+            try:
+                import spacy
+                self._nlp = spacy.load(self.spacy_model, exclude=_SPACY_EXCLUDE)
+                logging.info("[关键词] spaCy 管线已加载: %s %s", self.spacy_model, self._nlp.pipe_names)
+            except Exception as e:
+                self._spacy_failed = True
+                logging.warning("[关键词] spaCy 模型 %s 不可用，跳过法语实体: %s", self.spacy_model, e)
+        return self._nlp
+
+    def warmup(self):
+        """加载 jieba 词典与 spaCy 管线，并各跑一次（启动时后台调用）"""
+        def _warm():
+            self._extract_batch([("retrait du compte à Paris", "提现条件是什么")])
+        try:
+            run_off_loop(_warm)
+        except Exception as e:
+            logging.warning("[关键词] 预热失败: %s", e)
+
+    # ---------- 提取 ----------
+    def _extract_batch(self, pairs: Sequence[Tuple[str, str]]) -> List[List[str]]:
+        with self._lock:
+            return self._extract_locked(pairs)
+
+    def _extract_locked(self, pairs: Sequence[Tuple[str, str]]) -> List[List[str]]:
+        jieba = self._get_jieba()
+        out: List[List[str]] = []
+        for _, q_zh in pairs:
+            out.append(jieba.lcut(q_zh)[:MAX_ZH_KEYWORDS] if (q_zh and jieba) else [])
+
+        fr_idx = [i for i, (q_fr, _) in enumerate(pairs) if q_fr]
+        nlp = self._get_nlp() if fr_idx else None
+        if nlp is not None:
+            docs = nlp.pipe((pairs[i][0] for i in fr_idx), batch_size=self.batch_size)
+            for i, doc in zip(fr_idx, docs):
+                out[i] += [ent.text.lower() for ent in doc.ents[:MAX_FR_ENTITIES]]
+
+        # 去重（保持顺序）并限制数量
+        return [list(dict.fromkeys(k for k in kws if k.strip()))[:MAX_KEYWORDS] for kws in out]
+
+    def extract_many(self, pairs: Sequence[Tuple[str, str]]) -> List[List[str]]:
+        """pairs = [(q_fr, q_zh), ...]，返回每条对应的关键词列表"""
+        if not pairs:
+            return []
+        return run_off_loop(self._extract_batch, list(pairs))
+
+    def extract(self, q_fr: str, q_zh: str) -> List[str]:
+        return self.extract_many([(q_fr, q_zh)])[0]
+
+    def stats(self) -> dict:
+        return {
+            "jieba_loaded": self._jieba is not None,
+            "spacy_loaded": self._nlp is not None,
+            "spacy_model": self.spacy_model,
+            "spacy_pipes": list(self._nlp.pipe_names) if self._nlp is not None else [],
+        }
+
+
+keyword_extractor = KeywordExtractor(batch_size=int(os.getenv("KEYWORDS_BATCH_SIZE", "32")))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+离线语种检测（进程内，无网络）：
+- 覆盖线上实际出现的语种：fr / en / sw / ha / zh
+- zh 按 CJK 字符占比直接判定；其余语种用字符 1~3-gram 对数概率画像（朴素贝叶斯）
+- 画像数据为 data/lang_profiles.json，由 data/lang_corpus/*.txt 生成：
+    python backend/lang_detect.py
+- 结果带置信度并做记忆化；置信度低时由上层（policy.detect_lang）再走远端 /detect
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+PROFILE_PATH = os.getenv("LANG_PROFILE_PATH", os.path.join(_DATA_DIR, "lang_profiles.json"))
+CORPUS_DIR = os.path.join(_DATA_DIR, "lang_corpus")
+
+NGRAM_ORDERS = (1, 2, 3)
+TOP_K = 600              # 每个语种保留的 n-gram 数量（控制数据文件体积）
+MIN_GRAMS_FULL_CONF = 12  # 少于该 n-gram 数的短文本按比例降低置信度
+
+_CJK_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]")
+_NON_LETTER_RE = re.compile(r"[^\w'’]+|[\d_]+")
+
+
+def _normalize(text: str) -> str:
+    t = unicodedata.normalize("NFC", text or "").lower()
+    t = t.replace("’", "'")
+    return " ".join(_NON_LETTER_RE.sub(" ", t).split())
+
+
+def extract_ngrams(text: str) -> List[str]:
+    """按词加边界空格后切 1~3-gram（训练与检测共用）"""
+    grams: List[str] = []
+    for word in _normalize(text).split():
+        padded = f" {word} "
+        for n in NGRAM_ORDERS:
+            for i in range(len(padded) - n + 1):
+                g = padded[i:i + n]
+                if g.strip():
+                    grams.append(g)
+    return grams
+
+
+# ---------- 画像构建 ----------
+def build_profiles(corpus_dir: str = CORPUS_DIR, top_k: int = TOP_K) -> dict:
+    langs: Dict[str, dict] = {}
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.endswith(".txt"):
+            continue
+        lang = name[:-4]
+        with open(os.path.join(corpus_dir, name), encoding="utf-8") as f:
+            counts = Counter(extract_ngrams(f.read()))
+        top = counts.most_common(top_k)
+        total = sum(c for _, c in top)
+        # 加一平滑；未出现 n-gram 统一记为 floor
+        denom = total + len(top) + 1
+        langs[lang] = {
+            "floor": round(math.log(1 / denom), 4),
+            "ngrams": {g: round(math.log((c + 1) / denom), 4) for g, c in top},
+        }
+    return {"version": 1, "orders": list(NGRAM_ORDERS), "langs": langs}
+
+
+# ---------- 检测 ----------
+_profiles: Dict[str, Tuple[Dict[str, float], float]] = {}
+
+
+def _load_profiles() -> Dict[str, Tuple[Dict[str, float], float]]:
+    if not _profiles:
+        with open(PROFILE_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        for lang, p in data.get("langs", {}).items():
+            _profiles[lang] = (p["ngrams"], float(p["floor"]))
+    return _profiles
+
+
+def _cjk_ratio(text: str) -> float:
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return 0.0
+    return sum(1 for ch in letters if _CJK_RE.match(ch)) / len(letters)
+
+
+@lru_cache(maxsize=int(os.getenv("LANG_DETECT_CACHE_SIZE", "4096")))
+def _detect_cached(text: str) -> Tuple[str, float]:
+    if _cjk_ratio(text) >= 0.3:
+        return "zh", 1.0
+    grams = extract_ngrams(text)
+    if not grams:
+        return "", 0.0
+    profiles = _load_profiles()
+    scores = {}
+    for lang, (table, floor) in profiles.items():
+        scores[lang] = sum(table.get(g, floor) for g in grams)
+    # 对数似然 → 后验（softmax），再按文本长度折减
+    best = max(scores, key=lambda k: scores[k])
+    top = scores[best]
+    z = sum(math.exp(s - top) for s in scores.values())
+    conf = (1.0 / z) * min(1.0, len(grams) / MIN_GRAMS_FULL_CONF)
+    return best, round(conf, 4)
+
+
+def detect_local(text: str) -> Tuple[str, float]:
+    """
+    返回 (语种代码, 置信度 0~1)；无法判断返回 ("", 0.0)。
+    画像文件缺失时同样返回 ("", 0.0)，由调用方回退远端检测。
+    """
+    text = (text or "").strip()
+    if not text:
+        return "", 0.0
+    try:
+        return _detect_cached(text[:300])
+    except (OSError, ValueError, KeyError):
+        return "", 0.0
+
+
+def main() -> None:
+    data = build_profiles()
+    os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+    with open(PROFILE_PATH, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    print(f"profiles written: {PROFILE_PATH} langs={sorted(data['langs'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,30 +2,21 @@
 """
 基于 OpenAI 兼容接口的 LLM 机器人适配层：
 - 为每个会话（cid）维护独立的多轮上下文
+- 上下文前缀保持稳定（只追加、超预算时大步压缩），便于 llama.cpp 复用 KV 缓存
 - 返回中文回复，便于上层统一做多语言翻译
 """
 
 from __future__ import annotations
 
-from typing import Dict, List
-from openai import OpenAI
-import os, logging, time
+from typing import Callable, Dict, List, Optional
+import os, re, logging, time
 
-# 可通过环境变量或直接在此处配置网关（默认对齐本机/标准别名）
-BASE_URL = os.getenv("LLM_BASE_URL", "http://127.0.0.1:8080/v1")
-API_KEY = os.getenv("LLM_API_KEY", "sk-noauth")
-MODEL = os.getenv("LLM_MODEL", "qwen2.5-3b-instruct-q5_k_m")
-
-# 关闭重试（默认 0），避免 500 时重复重打
 try:
-    _MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "0"))
+    from .llm_gateway import gateway, MODEL, PRIORITY_BOT, PRIORITY_BACKGROUND
+    from .conv_state import conversations
 except Exception:
-    _MAX_RETRIES = 0
-
-client = OpenAI(base_url=BASE_URL, api_key=API_KEY, max_retries=_MAX_RETRIES)
-logging.getLogger(__name__).info(
-    "[LLM] base_url=%s model=%s (set via env LLM_BASE_URL/LLM_MODEL)", BASE_URL, MODEL
-)
+    from llm_gateway import gateway, MODEL, PRIORITY_BOT, PRIORITY_BACKGROUND
+    from conv_state import conversations
 
 SYSTEM_PROMPT = (
     "你是一名在线博彩游戏客服，名字叫「Leo」，24小时在线，精通法语、英语、斯瓦希里语。\n"
@@ -49,48 +40,160 @@ def _extract_message(raw: str) -> str:
     return raw.strip()
 
 
-# 每个会话独立上下文
-_messages_by_cid: Dict[str, List[Dict[str, str]]] = {}
-
-
-def reply_zh(cid: str, user_text_zh: str, max_tokens: int = 256, temperature: float = 0.7) -> str:
+# 每个会话独立上下文：存放在会话状态记录的 llm_history 中（随会话一起按空闲超时/上限回收）
+
+# ---------- 上下文管理（前缀稳定） ----------
+# llama.cpp 按最长公共前缀复用 KV 缓存：平时只在末尾追加；估算 token 超出预算时一次性
+# 压缩到预算的一部分，被移出的旧轮次折叠成一段简短摘要（紧跟在 system prompt 之后）。
+HISTORY_TOKEN_BUDGET = int(os.getenv("LLM_HISTORY_TOKEN_BUDGET", "1536"))
+HISTORY_COMPACT_TO = float(os.getenv("LLM_HISTORY_COMPACT_TO", "0.5"))
+SUMMARY_MAX_CHARS = int(os.getenv("LLM_SUMMARY_MAX_CHARS", "300"))
+SUMMARY_PREFIX = "此前对话摘要：\n"
+
+# 请求 llama.cpp 复用同前缀的 KV 缓存
+_CACHE_BODY = {"cache_prompt": True}
+
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算：中文约 1 字 1 token，其余约 4 字符 1 token"""
+    text = text or ""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def _history_tokens(history: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(m.get("content", "")) + 4 for m in history)
+
+
+def _fold_summary(old_summary: str, dropped: List[Dict[str, str]]) -> str:
+    lines = [ln for ln in old_summary[len(SUMMARY_PREFIX):].splitlines() if ln.strip()] if old_summary else []
+    for m in dropped:
+        content = " ".join((m.get("content") or "").split())
+        if not content:
+            continue
+        who = "用户" if m.get("role") == "user" else "客服"
+        lines.append(f"{who}：{content[:40]}")
+    body = "\n".join(lines)
+    if len(body) > SUMMARY_MAX_CHARS:
+        # 保留最近的部分，从完整行开始
+        body = body[-SUMMARY_MAX_CHARS:]
+        body = body[body.find("\n") + 1:] if "\n" in body else body
+    return SUMMARY_PREFIX + body
+
+
+def _split(history: List[Dict[str, str]]):
+    """拆为 (system, 摘要或空串, 对话轮次)"""
+    head, rest = history[:1], history[1:]
+    summary = ""
+    if rest and rest[0].get("role") == "system" and rest[0].get("content", "").startswith(SUMMARY_PREFIX):
+        summary = rest[0]["content"]
+        rest = rest[1:]
+    return head, summary, rest
+
+
+def _compact(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    对话轮次（不含 system 与摘要）未超预算时原样返回（前缀不变）；
+    超预算时移出最早的若干轮，压到预算的 HISTORY_COMPACT_TO，并折叠进摘要。
+    """
+    head, old_summary, rest = _split(history)
+    if _history_tokens(rest) <= HISTORY_TOKEN_BUDGET:
+        return history
+    target = HISTORY_TOKEN_BUDGET * HISTORY_COMPACT_TO
+    dropped: List[Dict[str, str]] = []
+    # 至少保留最近一问一答；保证剩余轮次从 user 开始
+    while len(rest) > 2 and (_history_tokens(rest) > target or rest[0].get("role") != "user"):
+        dropped.append(rest.pop(0))
+    while len(rest) > 1 and rest[0].get("role") != "user":
+        dropped.append(rest.pop(0))
+    summary = _fold_summary(old_summary, dropped)
+    return head + [{"role": "system", "content": summary}] + rest
+
+
+def warm_prefix() -> None:
+    """
+    启动时把 system prompt 预热进 llama.cpp 的 KV 缓存（后台优先级，只生成 1 个 token），
+    使第一位客户的请求也能命中缓存前缀。
+    """
+    if os.getenv("LLM_BOT_ENABLED", "true").lower() == "false":
+        return
+    if os.getenv("LLM_WARMUP", "true").lower() == "false":
+        return
+    usage: Dict[str, int] = {}
+    t0 = time.time()
+    try:
+        gateway.chat(
+            [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": "你好"}],
+            priority=PRIORITY_BACKGROUND, max_tokens=1, temperature=0.0,
+            usage_out=usage, extra_body=dict(_CACHE_BODY),
+        )
+        logging.info("[LLM] warmup ok elapsed=%.2fs prompt_tokens=%s cached_tokens=%s",
+                     time.time() - t0, usage.get("prompt_tokens"), usage.get("cached_tokens"))
+    except Exception as e:
+        logging.info("[LLM] warmup skipped: %s", e)
+
+
+# 流式模式：逐 token 回调 on_delta(增量, 当前可见全文)，让上层边生成边推送
+STREAM_ENABLED = os.getenv("LLM_STREAM_ENABLED", "true").lower() != "false"
+
+
+def _stream_completion(history: List[Dict[str, str]], max_tokens: int, temperature: float,
+                       on_delta: Callable[[str, str], None], usage: Dict[str, int]) -> str:
+    raw = ""
+    shown = ""
+    for piece in gateway.stream_chat(history, priority=PRIORITY_BOT, max_tokens=max_tokens, temperature=temperature,
+                                     usage_out=usage, extra_body=dict(_CACHE_BODY)):
+        raw += piece
+        visible = _extract_message(raw)
+        if visible == shown:
+            continue
+        # 出现 <|message|> 锚点时可见文本会被重置，此时增量为整段可见文本
+        delta = visible[len(shown):] if visible.startswith(shown) else visible
+        shown = visible
+        try:
+            on_delta(delta, visible)
+        except Exception as e:
+            logging.warning("[LLM] on_delta failed: %s", e)
+    return _extract_message(raw)
+
+
+def reply_zh(cid: str, user_text_zh: str, max_tokens: int = 256, temperature: float = 0.7,
+             on_delta: Optional[Callable[[str, str], None]] = None) -> str:
     # 允许通过环境变量禁用机器人兜底（与翻译兜底独立开关）
     if os.getenv("LLM_BOT_ENABLED", "true").lower() == "false":
         return ""
     cid = cid or "default"
-    if cid not in _messages_by_cid:
-        _messages_by_cid[cid] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    rec = conversations.get(cid)
+    if rec.llm_history is None:
+        rec.llm_history = [{"role": "system", "content": SYSTEM_PROMPT}]
     if not user_text_zh:
         return ""
 
-    history = _messages_by_cid[cid]
+    history = rec.llm_history
     history.append({"role": "user", "content": user_text_zh})
 
+    stream = on_delta is not None and STREAM_ENABLED
     t0 = time.time()
-    logging.info("[LLM] call -> model=%s cid=%s tokens=%s temp=%.2f", MODEL, cid, max_tokens, temperature)
-    # llama.cpp OpenAI server 需要正确的 chat 模板；支持 LLM_CHAT_FORMAT 或按模型名推断
-    chat_format = (os.getenv("LLM_CHAT_FORMAT", "").strip() or "")
-    if not chat_format and "qwen" in (MODEL or "").lower():
-        chat_format = "qwen"
-
+    logging.info("[LLM] call -> model=%s cid=%s tokens=%s temp=%.2f stream=%s", MODEL, cid, max_tokens, temperature, stream)
+    usage: Dict[str, int] = {}
     try:
-        extra_body = {"chat_format": chat_format} if chat_format else None
-        resp = client.chat.completions.create(
-            model=MODEL,
-            messages=history,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            **({"extra_body": extra_body} if extra_body else {}),
-        )
-        raw = resp.choices[0].message.content or ""
-        out = _extract_message(raw)
-        logging.info("[LLM] ok <- cid=%s elapsed=%.2fs len=%s", cid, time.time()-t0, len(out))
+        # 经网关排队（机器人回复优先级最高），共享连接池与并发上限
+        if stream:
+            out = _stream_completion(history, max_tokens, temperature, on_delta, usage)
+        else:
+            resp = gateway.chat(history, priority=PRIORITY_BOT, max_tokens=max_tokens, temperature=temperature,
+                                usage_out=usage, extra_body=dict(_CACHE_BODY))
+            raw = resp.choices[0].message.content or ""
+            out = _extract_message(raw)
+        logging.info("[LLM] ok <- cid=%s elapsed=%.2fs len=%s prompt_tokens=%s cached_tokens=%s",
+                     cid, time.time()-t0, len(out), usage.get("prompt_tokens"), usage.get("cached_tokens"))
     except Exception as e:
         logging.error("[LLM] fail <- cid=%s err=%s", cid, e)
         out = ""
     history.append({"role": "assistant", "content": out})
 
-    # 历史裁剪：保留 system + 最近 12 轮（24 条）
-    if len(history) > 25:
-        _messages_by_cid[cid] = [history[0]] + history[-24:]
+    # 超出 token 预算时一次性大步压缩（旧轮次折叠为摘要），平时保持前缀不变
+    rec.llm_history = _compact(history)
     return out
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 网关（llama.cpp OpenAI 兼容服务的唯一出口）：
+- 全进程共用一个 OpenAI 客户端（底层 HTTP 连接池复用）
+- 并发上限可配置（LLM_MAX_CONCURRENCY，建议与 llama.cpp --parallel 一致）
+- 优先级队列：在线机器人回复 > 翻译兜底 > 后台任务
+- 暴露排队深度与等待时间统计，以及每次调用的 prompt token / 命中 KV 缓存 token 数
+- 按优先级记录调用耗时 / 排队耗时 / 失败次数直方图与计数（/metrics 的 chatbot_llm_*）
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    from . import metrics
+except Exception:
+    import metrics  # type: ignore
+
+PRIORITY_BOT = 0          # 面向客户的实时机器人回复
+PRIORITY_TRANSLATE = 1    # 翻译兜底
+PRIORITY_BACKGROUND = 2   # 后台任务（预热、摘要等）
+
+_PRIORITY_NAMES = {PRIORITY_BOT: "bot", PRIORITY_TRANSLATE: "translate", PRIORITY_BACKGROUND: "background"}
+
+# priority 标签区分机器人回复 / 翻译兜底 / 后台任务；kind：error 调用异常，queue_timeout 排队超时
+_CALL_SECONDS = metrics.histogram(
+    "chatbot_llm_request_seconds", "LLM 调用耗时（获得槽位后到响应结束，流式为整段生成）",
+    ["priority"], buckets=metrics.LLM_BUCKETS)
+_FIRST_TOKEN_SECONDS = metrics.histogram(
+    "chatbot_llm_first_token_seconds", "流式 LLM 调用首段文本耗时（获得槽位后）",
+    ["priority"], buckets=metrics.LLM_BUCKETS)
+_QUEUE_SECONDS = metrics.histogram(
+    "chatbot_llm_queue_wait_seconds", "LLM 并发槽位排队等待耗时", ["priority"], buckets=metrics.LLM_BUCKETS)
+_CALL_ERRORS = metrics.counter(
+    "chatbot_llm_errors_total", "LLM 调用失败次数", ["priority", "kind"])
+
+BASE_URL = os.getenv("LLM_BASE_URL", "http://127.0.0.1:8080/v1")
+API_KEY = os.getenv("LLM_API_KEY", "sk-noauth")
+MODEL = os.getenv("LLM_MODEL", "qwen2.5-3b-instruct-q5_k_m")
+
+# 流式时请求服务端在最后一个 chunk 附带 usage（llama.cpp server 支持 stream_options）
+STREAM_INCLUDE_USAGE = os.getenv("LLM_STREAM_INCLUDE_USAGE", "true").lower() != "false"
+
+# 关闭重试（默认 0），避免 500 时重复重打
+try:
+    _MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "0"))
+except Exception:
+    _MAX_RETRIES = 0
+
+
+def chat_format() -> str:
+    """llama.cpp OpenAI server 需要正确的 chat 模板；支持 LLM_CHAT_FORMAT 或按模型名推断（qwen2* -> qwen）"""
+    fmt = (os.getenv("LLM_CHAT_FORMAT", "").strip() or "")
+    if not fmt and "qwen" in (MODEL or "").lower():
+        fmt = "qwen"
+    return fmt
+
+
+def _field(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    val = getattr(obj, name, None)
+    if val is None:
+        extra = getattr(obj, "model_extra", None) or {}
+        val = extra.get(name)
+    return val
+
+
+def usage_of(obj: Any) -> Optional[Dict[str, int]]:
+    """
+    从响应/流式 chunk 中取 token 用量：
+    - OpenAI 规范：usage.prompt_tokens + usage.prompt_tokens_details.cached_tokens
+    - llama.cpp：timings.prompt_n 为实际处理的 prompt token，其余即命中 KV 缓存（或 timings.cache_n）
+    """
+    usage = _field(obj, "usage")
+    timings = _field(obj, "timings")
+    if usage is None and timings is None:
+        return None
+    prompt = _field(usage, "prompt_tokens")
+    cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    if timings is not None:
+        cache_n = _field(timings, "cache_n")
+        prompt_n = _field(timings, "prompt_n")
+        if cached is None and cache_n is not None:
+            cached = cache_n
+        if prompt is None and prompt_n is not None:
+            prompt = int(prompt_n) + int(cache_n or 0)
+        if cached is None and prompt is not None and prompt_n is not None:
+            cached = max(0, int(prompt) - int(prompt_n))
+    if prompt is None:
+        return None
+    return {
+        "prompt_tokens": int(prompt),
+        "cached_tokens": int(cached or 0),
+        "completion_tokens": int(_field(usage, "completion_tokens") or 0),
+    }
+
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int = 2, queue_timeout_sec: float = 60.0):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.queue_timeout_sec = float(queue_timeout_sec)
+        self._lock = threading.Lock()
+        self._client = None
+        self._in_flight = 0
+        self._heap: List[tuple] = []          # (priority, seq, waiter)
+        self._seq = itertools.count()
+        self._stats: Dict[int, Dict[str, float]] = {
+            p: {"calls": 0, "errors": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0,
+                "prompt_tokens": 0, "cached_tokens": 0}
+            for p in _PRIORITY_NAMES
+        }
+
+    # ---------- 客户端 ----------
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            with self._lock:
+                if self._client is None:
+                    self._client = OpenAI(base_url=BASE_URL, api_key=API_KEY, max_retries=_MAX_RETRIES)
+                    logging.getLogger(__name__).info(
+                        "[LLM] base_url=%s model=%s (set via env LLM_BASE_URL/LLM_MODEL)", BASE_URL, MODEL
+                    )
+        return self._client
+
+    # ---------- 并发槽位 ----------
+    def _acquire(self, priority: int) -> float:
+        t0 = time.time()
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._heap:
+                self._in_flight += 1
+                return 0.0
+            waiter = _Waiter()
+            heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+        waiter.event.wait(self.queue_timeout_sec)
+        with self._lock:
+            if not waiter.granted:
+                # 超时：从队列移除自己
+                self._heap = [item for item in self._heap if item[2] is not waiter]
+                heapq.heapify(self._heap)
+                self._stats[priority]["timeouts"] += 1
+                _CALL_ERRORS.labels(_PRIORITY_NAMES[priority], "queue_timeout").inc()
+                raise TimeoutError(f"LLM queue wait exceeded {self.queue_timeout_sec:.0f}s")
+        return time.time() - t0
+
+    def _release(self):
+        with self._lock:
+            if self._heap:
+                # 槽位直接移交给优先级最高的等待者
+                _, _, waiter = heapq.heappop(self._heap)
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                self._in_flight -= 1
+
+    def _account(self, priority: int, wait: float, elapsed: float, error: bool = False):
+        name = _PRIORITY_NAMES[priority]
+        _QUEUE_SECONDS.labels(name).observe(wait)
+        _CALL_SECONDS.labels(name).observe(elapsed)
+        if error:
+            _CALL_ERRORS.labels(name, "error").inc()
+        with self._lock:
+            st = self._stats[priority]
+            st["calls"] += 1
+            st["errors"] += 1 if error else 0
+            st["wait_total"] += wait
+            st["wait_max"] = max(st["wait_max"], wait)
+
+    def _record_usage(self, priority: int, usage: Optional[Dict[str, int]], usage_out: Optional[dict]):
+        if not usage:
+            return
+        with self._lock:
+            st = self._stats[priority]
+            st["prompt_tokens"] += usage["prompt_tokens"]
+            st["cached_tokens"] += usage["cached_tokens"]
+        if usage_out is not None:
+            usage_out.update(usage)
+
+    @staticmethod
+    def _completion_args(messages, max_tokens: int, temperature: float, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        args = dict(kwargs)
+        extra_body = dict(args.pop("extra_body", None) or {})
+        fmt = chat_format()
+        if fmt:
+            extra_body.setdefault("chat_format", fmt)
+        if extra_body:
+            args["extra_body"] = extra_body
+        args.update(model=MODEL, messages=messages, max_tokens=max_tokens, temperature=temperature)
+        return args
+
+    # ---------- 对外 ----------
+    def chat(self, messages: List[Dict[str, str]], priority: int = PRIORITY_BACKGROUND,
+             max_tokens: int = 256, temperature: float = 0.7,
+             usage_out: Optional[dict] = None, **kwargs: Any):
+        """
+        排队获得并发槽位后调用 chat.completions.create，返回原始响应；异常向上抛出。
+        usage_out 非空时填入本次 prompt_tokens / cached_tokens / completion_tokens。
+        """
+        priority = priority if priority in _PRIORITY_NAMES else PRIORITY_BACKGROUND
+        wait = self._acquire(priority)
+        error = False
+        t0 = time.perf_counter()
+        try:
+            resp = self.client.chat.completions.create(
+                **self._completion_args(messages, max_tokens, temperature, kwargs)
+            )
+            self._record_usage(priority, usage_of(resp), usage_out)
+            return resp
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._account(priority, wait, time.perf_counter() - t0, error=error)
+            self._release()
+
+    def stream_chat(self, messages: List[Dict[str, str]], priority: int = PRIORITY_BACKGROUND,
+                    max_tokens: int = 256, temperature: float = 0.7,
+                    usage_out: Optional[dict] = None, **kwargs: Any) -> Iterator[str]:
+        """
+        流式版本：逐段产出增量文本（delta.content）。槽位在生成器结束或被关闭时释放。
+        """
+        priority = priority if priority in _PRIORITY_NAMES else PRIORITY_BACKGROUND
+        wait = self._acquire(priority)
+        error = False
+        t0 = time.perf_counter()
+        first = True
+        if STREAM_INCLUDE_USAGE:
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        try:
+            stream = self.client.chat.completions.create(
+                stream=True, **self._completion_args(messages, max_tokens, temperature, kwargs)
+            )
+            recorded = False
+            for chunk in stream:
+                # usage/timings 只出现在末尾 chunk；同一次调用只计一次
+                usage = None if recorded else usage_of(chunk)
+                if usage:
+                    self._record_usage(priority, usage, usage_out)
+                    recorded = True
+                if not chunk.choices:
+                    continue
+                piece = getattr(chunk.choices[0].delta, "content", None)
+                if piece:
+                    if first:
+                        first = False
+                        _FIRST_TOKEN_SECONDS.labels(_PRIORITY_NAMES[priority]).observe(time.perf_counter() - t0)
+                    yield piece
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._account(priority, wait, time.perf_counter() - t0, error=error)
+            self._release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth = {name: 0 for name in _PRIORITY_NAMES.values()}
+            for prio, _, _ in self._heap:
+                depth[_PRIORITY_NAMES[prio]] += 1
+            by_priority = {}
+            for prio, st in self._stats.items():
+                calls = st["calls"]
+                by_priority[_PRIORITY_NAMES[prio]] = {
+                    "calls": int(calls),
+                    "errors": int(st["errors"]),
+                    "timeouts": int(st["timeouts"]),
+                    "wait_avg": round(st["wait_total"] / calls, 4) if calls else 0.0,
+                    "wait_max": round(st["wait_max"], 4),
+                    "prompt_tokens": int(st["prompt_tokens"]),
+                    "cached_tokens": int(st["cached_tokens"]),
+                    "cache_ratio": round(st["cached_tokens"] / st["prompt_tokens"], 4) if st["prompt_tokens"] else 0.0,
+                }
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "queue_depth": sum(depth.values()),
+                "queue_depth_by_priority": depth,
+                "by_priority": by_priority,
+            }
+
+
+gateway = LLMGateway(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "2")),
+    queue_timeout_sec=float(os.getenv("LLM_QUEUE_TIMEOUT_SEC", "60")),
+)
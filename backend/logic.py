@@ -5,15 +5,16 @@
 你可以按需扩展 rules。
 """
 
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 import logging
-import re
 
 # 可选模板渲染
 try:
     from .templates_kb import render_template
+    from .intents import IntentMatcher
 except Exception:
     from templates_kb import render_template
+    from intents import IntentMatcher
 
 _RULES: Dict[str, str] = {
     # 关键字（小写）: 中文回答
@@ -61,21 +62,24 @@ TEMPLATE_PATTERNS: Dict[str, List[str]] = {
     "describe_issue_detail": [r"(不明白|看不懂|怎么回事|出问题了|有问题)", r"帮忙.*(看看|处理)"]
 }
 
+# 导入时编译一次（模板正则；规则关键词在前、别名在后，与原逐条判断的优先级一致）
+_TEMPLATE_MATCHER = IntentMatcher.from_patterns(TEMPLATE_PATTERNS, name="templates")
+_KEYWORD_MATCHER = IntentMatcher(
+    [(key, key, False) for key in _RULES]
+    + [(canonical, w, False) for canonical, words in _ALIASES.items() for w in words],
+    name="keywords",
+)
+
+
 def _match_template_key(text_zh: str) -> Optional[str]:
-    t = (text_zh or "").strip().lower()
-    if not t:
-        return None
-    for key, pats in TEMPLATE_PATTERNS.items():
-        for pat in pats:
-            try:
-                if re.search(pat, t, flags=re.I):
-                    return key
-            except re.error:
-                continue
-    return None
+    return _TEMPLATE_MATCHER.match((text_zh or "").strip())
 
 
-def get_bot_reply(text_zh: str, conv_id: Optional[str] = None) -> str:
+def get_bot_reply(text_zh: str, conv_id: Optional[str] = None,
+                  on_delta: Optional[Callable[[str, str], None]] = None) -> str:
+    """
+    模板 → 规则 → 别名 → LLM 兜底。on_delta 仅在走到 LLM 时生效（流式增量回调）。
+    """
     if not text_zh:
         return ""
     q = text_zh.strip().lower()
@@ -88,14 +92,10 @@ def get_bot_reply(text_zh: str, conv_id: Optional[str] = None) -> str:
                 return out
         except Exception:
             pass
-    # 直接命中
-    for key, ans in _RULES.items():
-        if key in q:
-            return ans
-    # 别名命中
-    for canonical, words in _ALIASES.items():
-        if any(w in q for w in words):
-            return _RULES.get(canonical, "")
+    # 规则关键词 / 别名命中
+    canonical = _KEYWORD_MATCHER.match(q)
+    if canonical:
+        return _RULES.get(canonical, "")
     # 未命中：调用 LLM 机器人做兜底（中文回复）
     try:
         try:
@@ -103,6 +103,6 @@ def get_bot_reply(text_zh: str, conv_id: Optional[str] = None) -> str:
         except Exception:
             from llm_bot import reply_zh   # 兼容脚本方式运行
         logging.info("[BOT] fallback to LLM for reply (conv_id=%s)", conv_id)
-        return reply_zh(conv_id or "default", text_zh)
+        return reply_zh(conv_id or "default", text_zh, on_delta=on_delta)
     except Exception:
         return ""  # 若模型不可用，则仍由上层继续兜底
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+图片存储（内容寻址），替代经 Socket.IO 传递 base64 data URL：
+- 上传：HTTP 流式写入临时文件，边写边算 sha256，超过 MEDIA_MAX_BYTES 立即中止；
+  按文件头识别 PNG / JPEG / GIF / WebP，其余类型拒绝
+- 去重：文件名即内容哈希（<root>/<哈希前两位>/<哈希>.<扩展名>），相同内容只存一份
+- 缩略图：Pillow 在独立线程池中生成（<root>/thumbs/...），未安装 Pillow 时缩略图地址回退原图
+- 读取：URL 带内容哈希、内容不可变，GET 由 app.py 以 ETag=哈希 + Range + 长期缓存返回
+- Socket 事件只携带 {"media_id","image","thumb"} 这样的小引用；旧客户端发来的 data URL 在服务端转存后同样只转发引用
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from typing import BinaryIO, Dict, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 未安装时不生成缩略图
+    Image = None  # type: ignore
+    ImageOps = None  # type: ignore
+
+try:
+    # 缩略图在线程池的真实线程中生成，计数与去重集合需用未被 gevent 替换的原生锁
+    from gevent.monkey import get_original
+    _NativeLock = get_original("threading", "Lock")
+except Exception:
+    _NativeLock = threading.Lock
+
+URL_PREFIX = "/api/v1/media/"
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_MEDIA_URL_RE = re.compile(r"^" + re.escape(URL_PREFIX) + r"([0-9a-f]{64})(?:/thumb)?$")
+
+# (文件头, 偏移, MIME, 扩展名)
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png", "png"),
+    (b"\xff\xd8\xff", 0, "image/jpeg", "jpg"),
+    (b"GIF87a", 0, "image/gif", "gif"),
+    (b"GIF89a", 0, "image/gif", "gif"),
+    (b"WEBP", 8, "image/webp", "webp"),
+)
+_EXT_MIME = {ext: mime for _, _, mime, ext in _SIGNATURES}
+
+
+class MediaError(ValueError):
+    status = 400
+
+
+class MediaTooLarge(MediaError):
+    status = 413
+
+
+class UnsupportedMedia(MediaError):
+    status = 415
+
+
+def sniff(head: bytes) -> Optional[Tuple[str, str]]:
+    """按文件头识别图片类型，返回 (MIME, 扩展名)"""
+    for magic, offset, mime, ext in _SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            if ext == "webp" and not head.startswith(b"RIFF"):
+                continue
+            return mime, ext
+    return None
+
+
+def _make_pool(workers: int):
+    """gevent 已打补丁时用 gevent 线程池（真实线程），否则用标准线程池；返回 submit(fn, *args)"""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            from gevent.threadpool import ThreadPool
+            pool = ThreadPool(workers)
+            return pool.spawn
+    except Exception:
+        pass
+    from concurrent.futures import ThreadPoolExecutor
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="media-thumb")
+    return pool.submit
+
+
+class MediaStore:
+    def __init__(self, root: str, max_bytes: int = 10 * 1024 * 1024, thumb_px: int = 320,
+                 workers: int = 2, chunk_size: int = 64 * 1024):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.thumb_px = int(thumb_px)
+        self.chunk_size = int(chunk_size)
+        self.workers = max(1, int(workers))
+        self._submit = None
+        self._lock = _NativeLock()
+        self._pending: set = set()        # 正在生成缩略图的哈希
+        self._counters = {"uploads": 0, "dedup": 0, "bytes_stored": 0, "rejected": 0,
+                          "thumbs": 0, "thumb_errors": 0}
+
+    # ---------- 路径 ----------
+    def _path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.{ext}")
+
+    def _thumb_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, "thumbs", digest[:2], f"{digest}.{ext}")
+
+    def locate(self, digest: str) -> Optional[Tuple[str, str]]:
+        """原图 (路径, MIME)；不存在返回 None"""
+        if not DIGEST_RE.match(digest or ""):
+            return None
+        for ext, mime in _EXT_MIME.items():
+            path = self._path(digest, ext)
+            if os.path.exists(path):
+                return path, mime
+        return None
+
+    def locate_thumb(self, digest: str) -> Optional[Tuple[str, str]]:
+        """缩略图 (路径, MIME)；尚未生成时补交生成任务并返回 None（调用方回退原图）"""
+        if not DIGEST_RE.match(digest or ""):
+            return None
+        for ext, mime in (("jpg", "image/jpeg"), ("png", "image/png")):
+            path = self._thumb_path(digest, ext)
+            if os.path.exists(path):
+                return path, mime
+        found = self.locate(digest)
+        if found:
+            self._schedule_thumb(digest, found[0])
+        return None
+
+    # ---------- 写入 ----------
+    def save_stream(self, stream: BinaryIO) -> Dict[str, object]:
+        """流式写入：边读边算哈希并落临时文件，完成后按哈希原子改名（已存在则丢弃临时文件）"""
+        os.makedirs(self.root, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        head = b""
+        fd, tmp = tempfile.mkstemp(prefix=".upload-", dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise MediaTooLarge(f"图片超过 {self.max_bytes} 字节")
+                    if len(head) < 16:
+                        head += chunk[:16 - len(head)]
+                    hasher.update(chunk)
+                    out.write(chunk)
+            kind = sniff(head)
+            if kind is None:
+                raise UnsupportedMedia("仅支持 PNG / JPEG / GIF / WebP 图片")
+            mime, ext = kind
+            digest = hasher.hexdigest()
+            path = self._path(digest, ext)
+            dedup = os.path.exists(path)
+            if dedup:
+                os.unlink(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+        except BaseException as e:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            if isinstance(e, MediaError):
+                with self._lock:
+                    self._counters["rejected"] += 1
+            raise
+        with self._lock:
+            self._counters["uploads"] += 1
+            if dedup:
+                self._counters["dedup"] += 1
+            else:
+                self._counters["bytes_stored"] += size
+        self._schedule_thumb(digest, path)
+        return {"id": digest, "mime": mime, "size": size, "dedup": dedup}
+
+    def save_data_url(self, data_url: str) -> Dict[str, object]:
+        """兼容旧客户端：data:image/...;base64,xxx 解码后按同样规则入库"""
+        header, _, payload = (data_url or "").partition(",")
+        if not header.startswith("data:") or ";base64" not in header:
+            raise UnsupportedMedia("不是 base64 data URL")
+        if len(payload) * 3 // 4 > self.max_bytes:
+            raise MediaTooLarge(f"图片超过 {self.max_bytes} 字节")
+        try:
+            raw = base64.b64decode(payload, validate=False)
+        except (binascii.Error, ValueError) as e:
+            raise MediaError(f"base64 解码失败: {e}")
+        return self.save_stream(io.BytesIO(raw))
+
+    # ---------- 缩略图 ----------
+    def _schedule_thumb(self, digest: str, path: str):
+        if Image is None or self.thumb_px <= 0:
+            return
+        with self._lock:
+            if digest in self._pending:
+                return
+            self._pending.add(digest)
+            if self._submit is None:
+                self._submit = _make_pool(self.workers)
+        try:
+            self._submit(self._make_thumb, digest, path)
+        except Exception as e:
+            with self._lock:
+                self._pending.discard(digest)
+            logging.warning("[图片] 缩略图任务提交失败: %s", e)
+
+    def _make_thumb(self, digest: str, path: str):
+        try:
+            if any(os.path.exists(self._thumb_path(digest, e)) for e in ("jpg", "png")):
+                return
+            with Image.open(path) as img:
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((self.thumb_px, self.thumb_px))
+                has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+                ext = "png" if has_alpha else "jpg"
+                out = self._thumb_path(digest, ext)
+                os.makedirs(os.path.dirname(out), exist_ok=True)
+                # 多实例共享 MEDIA_ROOT：临时文件名唯一，避免同时生成同一缩略图时互相覆盖 / 抢先改名
+                fd, tmp = tempfile.mkstemp(prefix=".thumb-", dir=os.path.dirname(out))
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        if has_alpha:
+                            img.convert("RGBA").save(f, format="PNG", optimize=True)
+                        else:
+                            img.convert("RGB").save(f, format="JPEG", quality=82, optimize=True)
+                    os.replace(tmp, out)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.unlink(tmp)
+                    raise
+            with self._lock:
+                self._counters["thumbs"] += 1
+        except Exception as e:
+            with self._lock:
+                self._counters["thumb_errors"] += 1
+            logging.warning("[图片] 缩略图生成失败 %s: %s", digest[:12], e)
+        finally:
+            with self._lock:
+                self._pending.discard(digest)
+
+    # ---------- 引用 ----------
+    @staticmethod
+    def reference(digest: str) -> Dict[str, str]:
+        """Socket 事件里携带的图片引用（相对地址，前端按 API_BASE_URL 拼接）"""
+        return {"media_id": digest, "image": f"{URL_PREFIX}{digest}", "thumb": f"{URL_PREFIX}{digest}/thumb"}
+
+    def resolve(self, image) -> Optional[Dict[str, str]]:
+        """
+        把消息里的 image 字段转为引用：
+        - 本服务的媒体地址 / {"media_id": ...}：校验存在后返回引用
+        - data URL（旧客户端）：转存后返回引用
+        - 其他（外部链接等）：拒绝，返回 None
+        """
+        digest = None
+        if isinstance(image, dict):
+            digest = str(image.get("media_id") or image.get("id") or "")
+        elif isinstance(image, str):
+            if image.startswith("data:"):
+                return self.reference(str(self.save_data_url(image)["id"]))
+            m = _MEDIA_URL_RE.match(image.split("?", 1)[0])
+            digest = m.group(1) if m else None
+        if digest and self.locate(digest):
+            return self.reference(digest)
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            out["thumb_pending"] = len(self._pending)
+        out.update(root=self.root, max_bytes=self.max_bytes, thumbnails=Image is not None)
+        return out
+
+
+media_store = MediaStore(
+    root=os.getenv("MEDIA_ROOT", "media"),
+    max_bytes=int(os.getenv("MEDIA_MAX_BYTES", str(10 * 1024 * 1024))),
+    thumb_px=int(os.getenv("MEDIA_THUMB_PX", "320")),
+    workers=int(os.getenv("MEDIA_THUMB_WORKERS", "2")),
+)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+进程内指标（Prometheus 文本格式，app.py 在 /metrics 暴露；不依赖 prometheus_client）：
+- Counter / Histogram：每个标签组合一个子指标，子指标按“真实线程”分片存放计数（list），
+  inc / observe 只写当前线程自己的分片，无锁；导出时把各分片相加
+  （gevent 下所有 greenlet 同在一个线程，一次 += 之间不会切换；线程池等真实线程各用各的分片）
+- 只有首次出现新的标签组合 / 新线程时才创建分片（加锁或 setdefault），热路径不加锁
+- Gauge 为回调式：导出时调用函数取当前值（连接数、待代答数等），平时零开销
+- 多实例部署时每个进程各自暴露，由 Prometheus 分别抓取后按实例聚合
+"""
+
+from __future__ import annotations
+
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    # gevent 打补丁后 threading.get_ident 返回 greenlet 标识，会为每个 greenlet 建分片；分片须按真实线程划分
+    from gevent.monkey import get_original
+    _thread_ident = get_original("_thread", "get_ident")
+except Exception:
+    _thread_ident = threading.get_ident
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认延迟分桶（秒）：外部 HTTP 调用（翻译 / 检测）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 本地存储（SQLite / 内存检索）
+STORAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+# LLM 生成
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, int) or float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Sharded:
+    """按线程分片的一组计数（每个分片是长度固定的 list）"""
+
+    __slots__ = ("_size", "_shards")
+
+    def __init__(self, size: int):
+        self._size = size
+        self._shards: Dict[int, List[float]] = {}
+
+    def cell(self) -> List[float]:
+        ident = _thread_ident()
+        cell = self._shards.get(ident)
+        if cell is None:
+            cell = self._shards.setdefault(ident, [0] * self._size)
+        return cell
+
+    def totals(self) -> List[float]:
+        out = [0] * self._size
+        for cell in list(self._shards.values()):
+            for i, v in enumerate(cell):
+                out[i] += v
+        return out
+
+
+class _CounterChild:
+    __slots__ = ("_data",)
+
+    def __init__(self):
+        self._data = _Sharded(1)
+
+    def inc(self, n: float = 1):
+        self._data.cell()[0] += n
+
+    def value(self) -> float:
+        return self._data.totals()[0]
+
+
+class _HistogramChild:
+    __slots__ = ("_bounds", "_data")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        self._data = _Sharded(len(bounds) + 2)     # 各桶（非累计，末位为 +Inf）+ 总和
+
+    def observe(self, value: float):
+        cell = self._data.cell()
+        cell[bisect.bisect_left(self._bounds, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self) -> Tuple[List[float], float, float]:
+        """(累计桶计数, 总和, 总数)"""
+        totals = self._data.totals()
+        buckets, running = [], 0
+        for n in totals[:-1]:
+            running += n
+            buckets.append(running)
+        return buckets, totals[-1], running
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: Any):
+        """取（或创建）标签组合对应的子指标；热路径可在模块加载时预先取好"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际 {key}")
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, n: float = 1):
+        self.labels().inc(n)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, child in sorted(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value())}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != float("inf")))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        bounds = self.buckets + (float("inf"),)
+        for key, child in sorted(self._children.items()):
+            buckets, total, count = child.snapshot()
+            for le, n in zip(bounds, buckets):
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(le)}"')
+                lines.append(f"{self.name}_bucket{labels} {_format_value(n)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {_format_value(count)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """回调式仪表：fn() 返回数值，或 {标签值元组: 数值}（有 labelnames 时）"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Union[float, Dict[Tuple[str, ...], float]]],
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._fn = fn
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        value = self._fn()
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        for key, v in items:
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.labelnames, [str(k) for k in key])} {_format_value(v)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # 同名重复注册（如模块被重新加载）时复用已有指标
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"指标 {metric.name} 已以不同类型或标签注册")
+                if isinstance(metric, Gauge):
+                    existing._fn = metric._fn   # type: ignore[attr-defined]
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, fn, labelnames))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # 单个回调出错不影响其余指标
+                lines.append(f"# {metric.name} 导出失败: {type(e).__name__}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+gauge = registry.gauge
+render = registry.render
+
+
+@contextmanager
+def track(latency: _HistogramChild, errors: Optional[_CounterChild] = None) -> Iterator[None]:
+    """记录代码块耗时；抛出异常时错误计数 +1 并继续抛出"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.inc()
+        raise
+    finally:
+        latency.observe(time.perf_counter() - t0)
+
+
+def timed(latency: _HistogramChild, errors: Optional[_CounterChild] = None):
+    """装饰器版 track：记录函数每次调用的耗时与异常次数"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - t0)
+        return wrapper
+    return deco
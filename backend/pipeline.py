@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+客户消息处理管线：一条消息对应一个 MessageContext，各阶段结果记忆化在上下文上
+- 阶段：normalize → detect → intent → translate → retrieve → decide → reply → translate_back
+- intent（快速通道）：在客户原文上做话题分类（policy.classify_topic），该语种有现成模板时
+  直接用模板作答，回复不再经过“中文→客户语种”的回译；知识库（客服教过的答案）优先于模板，
+  检索仍需客户原文的中文译文
+- 每个阶段对同一条消息最多计算一次；即时路径（机器人离线直接代答 / 给客服的建议答案）
+  与延迟代答路径（客服超时未回复）共用同一个上下文，不再重复检测语种、翻译与检索
+- 每个阶段记录自身耗时（上下文 timings，毫秒；嵌套触发的上游阶段耗时计入各自阶段），并汇总到管线统计（/api/v1/stats 的 pipeline）
+- 翻译 / 检索 / 回复生成等实现由 app.py 注入，本模块不依赖 Flask / Socket.IO
+- 同一上下文同一时刻只由一个 greenlet 使用（即时路径处理完后才交给延迟代答任务）
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import unicodedata
+import uuid
+from typing import Any, Callable, Dict, Optional, Sequence
+
+STAGES = ("normalize", "detect", "intent", "translate", "retrieve", "decide", "reply", "translate_back")
+
+_MISSING = object()
+
+
+class MessageContext:
+    """单条客户消息的处理上下文（阶段结果 + 耗时）"""
+
+    __slots__ = ("cid", "raw", "target_lang", "token", "message_id", "_values", "timings", "_pipeline", "_nested")
+
+    def __init__(self, pipeline: "MessagePipeline", cid: str, raw: str, target_lang: str):
+        self.cid = cid
+        self.raw = raw or ""
+        self.target_lang = target_lang
+        self.token = time.time()          # 同时作为“是否被更新消息取代”的判定标记
+        self.message_id = uuid.uuid4().hex[:12]   # 渐进式投递时 message_update 按此 id 修补同一条消息
+        self._values: Dict[str, Any] = {}
+        self.timings: Dict[str, float] = {}
+        self._pipeline = pipeline
+        self._nested = 0.0                # 当前阶段内嵌套计算的上游阶段耗时（记录时扣除）
+
+    def memo(self, stage: str, compute: Callable[[], Any]) -> Any:
+        """阶段结果已计算过则直接返回，否则计算、计时并记录（只计本阶段自身耗时）"""
+        value = self._values.get(stage, _MISSING)
+        if value is not _MISSING:
+            return value
+        outer, self._nested = self._nested, 0.0
+        t0 = time.perf_counter()
+        try:
+            value = compute()
+        finally:
+            elapsed = time.perf_counter() - t0
+            own = max(0.0, elapsed - self._nested)
+            self._nested = outer + elapsed
+        self._values[stage] = value
+        self.timings[stage] = round(own * 1000, 2)
+        self._pipeline._record(stage, own)
+        return value
+
+    def done(self, stage: str) -> bool:
+        return stage in self._values
+
+    # ---------- 阶段快捷访问 ----------
+    @property
+    def text(self) -> str:
+        return self._pipeline.normalize(self)
+
+    @property
+    def lang(self) -> str:
+        return self._pipeline.detect(self)
+
+    @property
+    def intent(self) -> Optional[dict]:
+        return self._pipeline.intent(self)
+
+    @property
+    def text_zh(self) -> str:
+        return self._pipeline.translate(self)
+
+    @property
+    def kb(self) -> Optional[dict]:
+        return self._pipeline.retrieve(self)
+
+
+class MessagePipeline:
+    def __init__(self,
+                 detect: Callable[[str], str],
+                 translate: Callable[..., str],
+                 retrieve: Callable[..., Optional[dict]],
+                 generate: Callable[..., str],
+                 classify: Optional[Callable[[str], str]] = None,
+                 render: Optional[Callable[..., Optional[str]]] = None,
+                 intent_topics: Optional[Sequence[str]] = None):
+        self._detect = detect            # detect_lang(text) -> 语种代码
+        self._translate = translate      # safe_translate_with_fallback(text, target=, source=)
+        self._retrieve = retrieve        # retrieve_best(query_fr=, query_zh=)
+        self._generate = generate        # get_bot_reply(text_zh, cid, on_delta=)
+        self._classify = classify        # classify_topic(text) -> 话题（"other" 为未命中）；None 关闭快速通道
+        self._render = render            # render_template(topic, lang, fallback=False)
+        self._intent_topics = set(intent_topics) if intent_topics else None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, list] = {s: [0, 0.0, 0.0] for s in STAGES}   # 次数 / 总耗时 / 最大耗时
+        self._messages = 0
+
+    def new_context(self, cid: str, raw: str, target_lang: str) -> MessageContext:
+        with self._lock:
+            self._messages += 1
+        return MessageContext(self, cid, raw, target_lang)
+
+    # ---------- 阶段 ----------
+    def normalize(self, ctx: MessageContext) -> str:
+        return ctx.memo("normalize", lambda: unicodedata.normalize("NFC", ctx.raw).strip())
+
+    def detect(self, ctx: MessageContext) -> str:
+        def _detect():
+            try:
+                return (self._detect(ctx.text) or "auto").lower()
+            except Exception as e:
+                logging.info("[管线] 语种检测失败: %s", e)
+                return "auto"
+        return ctx.memo("detect", _detect)
+
+    def intent(self, ctx: MessageContext) -> Optional[dict]:
+        """原文话题分类 + 客户语种模板；返回 {"topic","lang","text"} 或 None（不需要中文译文）"""
+        def _intent():
+            if self._classify is None or self._render is None or not ctx.text:
+                return None
+            lang = ctx.lang
+            if lang in ("auto", "zh"):
+                return None
+            topic = self._classify(ctx.text)
+            if not topic or topic == "other" or (self._intent_topics is not None and topic not in self._intent_topics):
+                return None
+            text = self._render(topic, lang, fallback=False)
+            return {"topic": topic, "lang": lang, "text": text} if text else None
+        return ctx.memo("intent", _intent)
+
+    def translate(self, ctx: MessageContext) -> str:
+        """客户原文 → 中文；检测到的语种作为翻译源语种传入，翻译层不再重复检测"""
+        def _translate():
+            if not ctx.text or ctx.lang.startswith("zh"):
+                return ctx.text
+            return self._translate(ctx.text, target="zh", source=ctx.lang)
+        return ctx.memo("translate", _translate)
+
+    def retrieve(self, ctx: MessageContext) -> Optional[dict]:
+        return ctx.memo("retrieve", lambda: self._retrieve(query_fr=ctx.text, query_zh=ctx.text_zh))
+
+    def decide(self, ctx: MessageContext) -> str:
+        """回复来源：'kb' 知识库答案（优先）/ 'intent' 客户语种模板 / 'generate' 模板·规则·LLM 生成"""
+        def _decide():
+            if ctx.kb:
+                return "kb"
+            return "intent" if ctx.intent else "generate"
+        return ctx.memo("decide", _decide)
+
+    def reply(self, ctx: MessageContext, on_delta: Optional[Callable[[str, str], None]] = None) -> str:
+        """中文回复（intent 路径为模板的中文译文，仅供客服视图）；on_delta 只在首次计算且走到 LLM 时生效"""
+        def _reply():
+            route = self.decide(ctx)
+            if route == "intent":
+                return self._translate(ctx.intent["text"], target="zh", source=ctx.intent["lang"])
+            if route == "kb":
+                return ctx.kb["answer_zh"]
+            return self._generate(ctx.text_zh, ctx.cid, on_delta=on_delta) or ctx.text_zh
+        return ctx.memo("reply", _reply)
+
+    def translate_back(self, ctx: MessageContext, finish: Optional[Callable[[str], str]] = None) -> str:
+        """中文回复 → 客户语种；finish 为流式推送的收尾函数（返回与客户端已见内容一致的译文）"""
+        def _back():
+            if self.decide(ctx) == "intent":
+                return ctx.intent["text"]
+            reply_zh = self.reply(ctx)
+            if finish is not None:
+                return finish(reply_zh)
+            return self._translate(reply_zh, target=ctx.target_lang, source="zh")
+        return ctx.memo("translate_back", _back)
+
+    # ---------- 统计 ----------
+    def _record(self, stage: str, elapsed: float):
+        with self._lock:
+            s = self._stats.setdefault(stage, [0, 0.0, 0.0])
+            s[0] += 1
+            s[1] += elapsed
+            s[2] = max(s[2], elapsed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {"count": n, "avg_ms": round(total / n * 1000, 2) if n else 0.0, "max_ms": round(peak * 1000, 2)}
+                for name, (n, total, peak) in self._stats.items()
+            }
+            return {"messages": self._messages, "stages": stages}
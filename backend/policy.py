@@ -1,7 +1,23 @@
 # policy.py
-import os, re, requests, logging
+import os, re, logging, time
 from typing import Optional
 
+try:
+    from .lang_detect import detect_local
+    from .endpoints import libre_pool
+    from .intents import IntentMatcher
+    from . import metrics
+except Exception:
+    from lang_detect import detect_local
+    from endpoints import libre_pool
+    from intents import IntentMatcher
+    import metrics
+
+# 本地检测置信度达到阈值即直接采用；否则才请求远端 /detect
+LANG_DETECT_LOCAL = os.getenv("LANG_DETECT_LOCAL", "true").lower() != "false"
+LANG_DETECT_MIN_CONF = float(os.getenv("LANG_DETECT_MIN_CONF", "0.8"))
+LANG_DETECT_REMOTE = os.getenv("LANG_DETECT_REMOTE", "true").lower() != "false"
+
 ALLOWED_TOPICS = [
     "registration", "login", "deposit", "withdraw", "promo", "rules", "security"
 ]
@@ -45,39 +61,55 @@ def _detect_endpoints() -> list:
     return eps
 
 
+# source：结果来源（local 本地高置信 / remote 远端 / local_fallback 远端失败后用本地低置信结果 / heuristic 启发式）
+_DETECT_SECONDS = metrics.histogram(
+    "chatbot_detect_lang_seconds", "detect_lang 整体耗时（按结果来源）", ["source"])
+_DETECT_ERRORS = metrics.counter(
+    "chatbot_detect_lang_errors_total", "detect_lang 需要远端检测但所有 /detect 端点均失败的次数")
+
 def detect_lang(text: str) -> str:
+    t0 = time.perf_counter()
+    code, source = _detect_lang(text)
+    _DETECT_SECONDS.labels(source).observe(time.perf_counter() - t0)
+    return code
+
+def _detect_lang(text: str):
+    """返回 (语种代码, 结果来源)"""
     text = (text or "").strip()
     if not text:
-        return "en"
-    # 先尝试可配置/本地的 detect 端点，再回退公共端点
-    for url in _detect_endpoints():
-        try:
-            r = requests.post(url, json={"q": text}, timeout=3)
-            if r.ok:
-                data = r.json()
-                if data and isinstance(data, list):
-                    code = (data[0].get("language") or "en").lower()
-                    return code[:2]
-                else:
-                    logging.info(f"detect_lang empty response from {url}")
-            else:
-                logging.info(f"detect_lang HTTP{r.status_code} from {url}")
-        except Exception as e:
-            logging.info(f"detect_lang fallback on {url}: {e}")
+        return "en", "heuristic"
+    # 先用进程内离线检测（微秒级，带记忆化）；置信度足够则不发网络请求
+    local_code, local_conf = detect_local(text) if LANG_DETECT_LOCAL else ("", 0.0)
+    if local_code and local_conf >= LANG_DETECT_MIN_CONF:
+        return local_code, "local"
+    # 置信度低：尝试可配置/本地的 detect 端点，再回退公共端点
+    # 与翻译共用连接池与健康度/熔断状态
+    if LANG_DETECT_REMOTE:
+        for url in libre_pool.ordered(_detect_endpoints()):
+            data = libre_pool.call(
+                url, {"q": text}, timeout=3,
+                validate=lambda d: isinstance(d, list) and bool(d) and isinstance(d[0], dict),
+                quiet=True,
+            )
+            if data:
+                code = (data[0].get("language") or "en").lower()
+                return code[:2], "remote"
+        _DETECT_ERRORS.inc()
+
+    # 远端不可用时，低置信度的本地结果仍优于启发式
+    if local_code:
+        return local_code, "local_fallback"
 
     # 启发式：法语简单标记
     fr_markers = [" le ", " la ", " de ", " je ", "vous", "avoir", "être", "pour", " s'"]
-    if any(m in text.lower() for m in fr_markers): return "fr"
-    if re.search(r"[áéíóúñçàèùâêîôûëïüœ]", text.lower()): return "fr"
-    return "en"
+    if any(m in text.lower() for m in fr_markers): return "fr", "heuristic"
+    if re.search(r"[áéíóúñçàèùâêîôûëïüœ]", text.lower()): return "fr", "heuristic"
+    return "en", "heuristic"
+
+_TOPIC_MATCHER = IntentMatcher.from_patterns(KEYS, name="topics")
 
 def classify_topic(text: str) -> str:
-    t = (text or "").lower()
-    for topic, patterns in KEYS.items():
-        for pat in patterns:
-            if re.search(pat, t, flags=re.I):
-                return topic
-    return "other"
+    return _TOPIC_MATCHER.match(text) or "other"
 
 def out_of_scope_reply(lang: str) -> str:
     lang = (lang or "en")[:2]
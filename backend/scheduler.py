@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+按 key 的截止时间调度器（替代每条消息一个、每 0.3~0.5 秒轮询一次的后台 greenlet）：
+- 最小堆存 (截止时间, 序号, key)；每个 key 只保留一个有效条目，重新调度 / 取消只更新字典，
+  堆中旧条目在弹出时按序号识别并丢弃（惰性删除，积压过多时整体重建）
+- 单个调度循环等待“最早截止时间或有新的更早条目”，到期条目先出堆再触发，保证只触发一次
+- 触发的回调经 spawn 交给后台任务执行（LLM 回复可能较慢，不阻塞调度循环）
+- spawn / make_event 由调用方注入（app.py 传 Socket.IO 的后台任务与事件，gevent 下不占用真实线程）
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class DeadlineScheduler:
+    def __init__(self, spawn: Optional[Callable[..., Any]] = None,
+                 make_event: Optional[Callable[[], Any]] = None,
+                 name: str = "deadline-scheduler"):
+        self.name = name
+        self._spawn = spawn
+        self._event = make_event() if make_event else threading.Event()
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._entries: Dict[Any, Tuple[int, float, Callable[..., Any], tuple]] = {}
+        self._seq = itertools.count()
+        self._started = False
+        self._counters = {"scheduled": 0, "rescheduled": 0, "cancelled": 0, "fired": 0, "errors": 0}
+        self._max_lag = 0.0
+
+    # ---------- 调度 ----------
+    def schedule(self, key: Any, when: float, fn: Callable[..., Any], *args) -> None:
+        """为 key 设定（或替换）截止时间 when（epoch 秒），到期调用 fn(*args)"""
+        with self._lock:
+            seq = next(self._seq)
+            if key in self._entries:
+                self._counters["rescheduled"] += 1
+            else:
+                self._counters["scheduled"] += 1
+            self._entries[key] = (seq, when, fn, args)
+            earliest = not self._heap or when < self._heap[0][0]
+            heapq.heappush(self._heap, (when, seq, key))
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._compact()
+        if earliest:
+            self._event.set()
+
+    def cancel(self, key: Any) -> bool:
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return False
+            self._counters["cancelled"] += 1
+            return True
+
+    def _compact(self):
+        self._heap = [(when, seq, key) for key, (seq, when, _, _) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    # ---------- 循环 ----------
+    def _pop_due(self, now: float) -> Tuple[List[Tuple[float, Callable[..., Any], tuple]], Optional[float]]:
+        """弹出所有到期的有效条目；返回 (到期列表, 下一个截止时间)"""
+        due = []
+        with self._lock:
+            while self._heap:
+                when, seq, key = self._heap[0]
+                entry = self._entries.get(key)
+                if entry is None or entry[0] != seq:
+                    heapq.heappop(self._heap)   # 已取消 / 已被重新调度的旧条目
+                    continue
+                if when > now:
+                    return due, when
+                heapq.heappop(self._heap)
+                del self._entries[key]
+                due.append((when, entry[2], entry[3]))
+            return due, None
+
+    def _fire(self, when: float, fn: Callable[..., Any], args: tuple):
+        lag = time.time() - when
+        with self._lock:
+            self._counters["fired"] += 1
+            self._max_lag = max(self._max_lag, lag)
+        try:
+            if self._spawn is not None:
+                self._spawn(fn, *args)
+            else:
+                fn(*args)
+        except Exception as e:
+            with self._lock:
+                self._counters["errors"] += 1
+            logging.warning("[调度] %s 回调失败: %s", self.name, e)
+
+    def run(self):
+        while True:
+            self._event.clear()
+            due, next_at = self._pop_due(time.time())
+            for when, fn, args in due:
+                self._fire(when, fn, args)
+            if due:
+                continue
+            timeout = None if next_at is None else max(0.0, next_at - time.time())
+            self._event.wait(timeout)
+
+    def start(self, start_background_task: Optional[Callable[..., Any]] = None):
+        """启动调度循环（默认守护线程；可传入 socketio.start_background_task）"""
+        if self._started:
+            return
+        self._started = True
+        if start_background_task is not None:
+            start_background_task(self.run)
+        else:
+            threading.Thread(target=self.run, name=self.name, daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = {"pending": len(self._entries), "heap": len(self._heap),
+                   "max_lag_ms": round(self._max_lag * 1000, 1)}
+            out.update(self._counters)
+        return out
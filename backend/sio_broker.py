@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Socket.IO 跨进程消息队列（多 worker / 多实例横向扩展）：
+- SOCKETIO_MESSAGE_QUEUE 为空：单进程模式（默认，与原来一致）
+- redis:// / amqp:// 等：交给 Flask-SocketIO 内置的 RedisManager / KombuManager
+- sqlite:///path/to/sio_queue.db：本机多进程的轻量替代（无需额外服务，便于测试/单机部署），
+  各进程把 emit / 进出房间等消息写入同一 SQLite 表，并轮询读取其他进程写入的新消息
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Any, Dict, Optional
+
+import socketio
+
+
+class SQLiteManager(socketio.PubSubManager):
+    """基于 SQLite 表的 PubSub 管理器（单机多进程）"""
+    name = "sqlite"
+
+    def __init__(self, url: str = "sqlite:///sio_queue.db", channel: str = "flask-socketio",
+                 write_only: bool = False, logger=None, json=None,
+                 poll_interval: float = 0.05, retain_sec: float = 60.0):
+        self.path = url[len("sqlite://"):] if url.startswith("sqlite://") else url
+        if self.path.startswith("/") and not self.path.startswith("//"):
+            self.path = self.path[1:] or "sio_queue.db"   # sqlite:///rel.db → rel.db
+        elif self.path.startswith("//"):
+            self.path = self.path[1:]                     # sqlite:////abs/path.db → /abs/path.db
+        self.poll_interval = float(poll_interval)
+        self.retain_sec = float(retain_sec)
+        self._last_purge = 0.0
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        conn = self._connect()
+        with closing(conn), conn:
+            conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS sio_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT,
+                payload TEXT,
+                created_at REAL
+            );
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _publish(self, data: Dict[str, Any]):
+        payload = self.json.dumps(data)
+        now = time.time()
+        conn = self._connect()
+        with closing(conn), conn:
+            conn.execute("INSERT INTO sio_queue(channel, payload, created_at) VALUES (?,?,?)",
+                         (self.channel, payload, now))
+            # 顺带清理过期消息（各进程都会做，间隔 retain_sec）
+            if now - self._last_purge > self.retain_sec:
+                self._last_purge = now
+                conn.execute("DELETE FROM sio_queue WHERE created_at < ?", (now - self.retain_sec,))
+
+    def _sleep(self, seconds: float):
+        if self.server is not None:
+            self.server.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
+    def _listen(self):
+        conn = self._connect()
+        with closing(conn):
+            last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sio_queue").fetchone()[0]
+        conn = self._connect()
+        try:
+            while True:
+                try:
+                    rows = conn.execute(
+                        "SELECT id, payload FROM sio_queue WHERE id > ? AND channel = ? ORDER BY id",
+                        (last_id, self.channel),
+                    ).fetchall()
+                except sqlite3.Error as e:
+                    logging.warning("[消息队列] 读取失败: %s", e)
+                    rows = []
+                for row_id, payload in rows:
+                    last_id = row_id
+                    yield payload
+                if not rows:
+                    self._sleep(self.poll_interval)
+        finally:
+            conn.close()
+
+
+def message_queue_options(url: Optional[str] = None, write_only: bool = False) -> Dict[str, Any]:
+    """
+    按 SOCKETIO_MESSAGE_QUEUE 生成传给 SocketIO(...) 的参数：
+    - 空：{}（单进程）
+    - sqlite://：{"client_manager": SQLiteManager(...)}
+    - 其他：{"message_queue": url}（由 Flask-SocketIO 选择 Redis/Kombu 等实现）
+    """
+    url = (url if url is not None else os.getenv("SOCKETIO_MESSAGE_QUEUE", "")).strip()
+    channel = os.getenv("SOCKETIO_CHANNEL", "flask-socketio")
+    if not url:
+        return {}
+    if url.startswith("sqlite://"):
+        manager = SQLiteManager(
+            url, channel=channel, write_only=write_only,
+            poll_interval=float(os.getenv("SOCKETIO_SQLITE_POLL_SEC", "0.05")),
+            retain_sec=float(os.getenv("SOCKETIO_SQLITE_RETAIN_SEC", "60")),
+        )
+        return {"client_manager": manager}
+    return {"message_queue": url, "channel": channel}
@@ -128,13 +128,14 @@ DEFAULT_SLOTS = {
     "eta": "10–30 minutes",
 }
 
-def render_template(topic: str, lang: str, slots: dict = None) -> Optional[str]:
+def render_template(topic: str, lang: str, slots: dict = None, fallback: bool = True) -> Optional[str]:
+    """fallback=False 时只返回该语种自身的模板（不回退英文）"""
     topic = (topic or "").lower()
     lang = (lang or "en")[:2]
     data = TEMPLATES.get(topic)
     if not data:
         return None
-    text = data.get(lang) or data.get("en")
+    text = data.get(lang) or (data.get("en") if fallback else None)
     if not text:
         return None
     merged = dict(DEFAULT_SLOTS)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+检索用分词（建索引与查询共用同一套规则）：
+- 中文（CJK）连续片段切成重叠二元组（bigram）："提现条件" → 提现 现条 条件；单字片段保留单字
+- 其他文字按字母/数字切词，小写并去除变音符号（é → e），丢弃单字符词
+- segment() 以空格连接，写入 FTS5（unicode61 分词器把每个二元组视为一个词）
+"""
+
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import Iterable, List
+
+_CJK = "㐀-䶿一-鿿豈-﫿"
+_TOKEN_RE = re.compile(f"([{_CJK}]+)|([^\\W_{_CJK}]+)")
+
+
+def _strip_diacritics(word: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", word)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    """切成检索词（去重，保持出现顺序）"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    out: List[str] = []
+    for m in _TOKEN_RE.finditer(text):
+        cjk, word = m.group(1), m.group(2)
+        if cjk:
+            if len(cjk) == 1:
+                out.append(cjk)
+            else:
+                out.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            word = _strip_diacritics(word)
+            if len(word) > 1:
+                out.append(word)
+    return list(dict.fromkeys(out))
+
+
+def segment(*texts: str) -> str:
+    """多段文本切词后以空格连接（写入 FTS 的 question_all 列）"""
+    tokens: List[str] = []
+    for t in texts:
+        tokens.extend(tokenize(t))
+    return " ".join(dict.fromkeys(tokens))
+
+
+_CJK_CHAR_RE = re.compile(f"[{_CJK}]")
+
+
+def is_cjk_token(token: str) -> bool:
+    return bool(_CJK_CHAR_RE.match(token))
+
+
+def overlap_ratio(query_tokens: Iterable[str], doc_tokens: Iterable[str]) -> float:
+    """
+    共有词数 / 较短一方的词数；用于过滤 OR 查询召回的弱相关结果。
+    文档侧只统计与查询同类（中文二元组 / 其他词）的词，避免中文查询被文档中的法语词稀释
+    """
+    q = set(query_tokens)
+    if not q:
+        return 0.0
+    kinds = {is_cjk_token(t) for t in q}
+    d = {t for t in doc_tokens if is_cjk_token(t) in kinds}
+    if not d:
+        return 0.0
+    return len(q & d) / min(len(q), len(d))
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+翻译缓存（两级 + single-flight）：
+- L1：进程内 LRU，带 TTL
+- L2：bot_store 中的 SQLite 持久表 translation_cache（重启后仍可命中）
+- single-flight：同一 key 的并发翻译只发起一次上游调用，其余请求等待并共享结果
+- L2 过期行由 start() 在启动时及之后定期清理（读取时只判断是否过期，不删除）
+缓存 key = (规范化原文, source, target)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    from .bot_store import get_translation, put_translation, purge_translations
+except Exception:
+    from bot_store import get_translation, put_translation, purge_translations  # type: ignore
+
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """NFKC + 合并空白 + 去首尾空白（不改大小写，避免译文大小写失真）"""
+    return _WS_RE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def make_key(text: str, source: str, target: str) -> str:
+    src = (source or "auto").strip().lower()
+    tgt = (target or "").strip().lower()[:2]
+    raw = f"{src}|{tgt}|{normalize_text(text)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """一次进行中的上游翻译；跟随者等待 event 后读取 result"""
+    __slots__ = ("event", "result")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[str] = None
+
+
+class TranslationCache:
+    def __init__(self, max_size: int = 5000, ttl_sec: float = 3600,
+                 db_ttl_sec: float = 30 * 86400, persist: bool = True, enabled: bool = True):
+        self.max_size = max(1, int(max_size))
+        self.ttl_sec = float(ttl_sec)
+        self.db_ttl_sec = float(db_ttl_sec)
+        self.persist = persist
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # key -> (译文, 过期时间)
+        self._inflight: Dict[str, _Flight] = {}
+        self._counters = {
+            "l1_hits": 0, "l2_hits": 0, "misses": 0,
+            "coalesced": 0, "stores": 0, "evictions": 0, "purged": 0,
+        }
+        self._started = False
+
+    # ---------- L1 ----------
+    def _l1_get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            item = self._lru.get(key)
+            if item is None:
+                return None
+            value, expire_at = item
+            if expire_at < now:
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return value
+
+    def _l1_put(self, key: str, value: str):
+        with self._lock:
+            self._lru[key] = (value, time.time() + self.ttl_sec)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def _incr(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    # ---------- 对外 ----------
+    def get_or_compute(self, text: str, source: str, target: str,
+                       compute: Callable[[], str],
+                       cacheable: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        命中缓存直接返回；否则由第一个请求（leader）执行 compute，
+        同 key 的并发请求等待 leader 的结果。cacheable(out) 为 False 时不落缓存（如翻译失败回退原文）。
+        """
+        if not self.enabled:
+            return compute()
+
+        key = make_key(text, source, target)
+        hit = self._l1_get(key)
+        if hit is not None:
+            self._incr("l1_hits")
+            return hit
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+        assert flight is not None
+
+        if not leader:
+            self._incr("coalesced")
+            flight.event.wait()
+            if flight.result is not None:
+                return flight.result
+            return compute()  # leader 异常时各自重试
+
+        try:
+            out = None
+            if self.persist:
+                try:
+                    out = get_translation(key, max_age_sec=self.db_ttl_sec)
+                except Exception as e:
+                    logging.info("[翻译缓存] 读取持久层失败: %s", e)
+            if out is not None:
+                self._incr("l2_hits")
+                self._l1_put(key, out)
+            else:
+                self._incr("misses")
+                out = compute()
+                if cacheable is None or cacheable(out):
+                    self._l1_put(key, out)
+                    self._incr("stores")
+                    if self.persist:
+                        try:
+                            put_translation(key, (source or "auto").lower(), (target or "").lower()[:2],
+                                            normalize_text(text), out)
+                        except Exception as e:
+                            logging.info("[翻译缓存] 写入持久层失败: %s", e)
+            flight.result = out
+            return out
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    # ---------- L2 清理 ----------
+    def purge_expired(self) -> int:
+        """删除 L2 中超过 db_ttl_sec 的行，返回删除行数"""
+        if not self.persist or self.db_ttl_sec <= 0:
+            return 0
+        try:
+            n = purge_translations(self.db_ttl_sec)
+        except Exception as e:
+            logging.info("[翻译缓存] 清理持久层失败: %s", e)
+            return 0
+        with self._lock:
+            self._counters["purged"] += n
+        if n:
+            logging.info("[翻译缓存] 清理过期持久缓存 %s 条", n)
+        return n
+
+    def start(self, purge_interval_sec: float = 0):
+        """启动时清理一次 L2 过期行；purge_interval_sec>0 时后台定期清理"""
+        if self._started or not self.enabled or not self.persist:
+            return
+        self._started = True
+        self.purge_expired()
+        if purge_interval_sec > 0:
+            def _loop():
+                while True:
+                    time.sleep(purge_interval_sec)
+                    self.purge_expired()
+            threading.Thread(target=_loop, name="translation-cache-purge", daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            out["size"] = len(self._lru)
+            out["inflight"] = len(self._inflight)
+        lookups = out["l1_hits"] + out["l2_hits"] + out["misses"]
+        out["hit_ratio"] = round((out["l1_hits"] + out["l2_hits"]) / lookups, 4) if lookups else 0.0
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+
+translation_cache = TranslationCache(
+    max_size=int(os.getenv("TRANSLATION_CACHE_SIZE", "5000")),
+    ttl_sec=float(os.getenv("TRANSLATION_CACHE_TTL_SEC", "3600")),
+    db_ttl_sec=float(os.getenv("TRANSLATION_CACHE_DB_TTL_SEC", str(30 * 86400))),
+    persist=os.getenv("TRANSLATION_CACHE_PERSIST", "true").lower() != "false",
+    enabled=os.getenv("TRANSLATION_CACHE_ENABLED", "true").lower() != "false",
+)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+意图匹配开销基准：单条消息的匹配耗时随规则数增长的变化
+- 旧实现：按 dict 顺序逐条 re.search(pat, text, flags=re.I)（不预编译，依赖 re 模块内部缓存，
+  规则数超过缓存上限 512 后每次都要重新编译）
+- 预编译逐条：同样逐条 search，但正则事先编译好（仅作参照）
+- IntentMatcher：字面量自动机一次扫描筛出候选，只对候选正则按优先级执行 search
+
+规则 = 随机生成的 N 条模板式正则（"词A.*词B"、"(词A|词B).*词C"、"词A(失败|不行|异常)"）
+      + logic.TEMPLATE_PATTERNS 原有规则（排在最后，即最低优先级，模拟模板库扩充后的最坏情况）
+
+用法（项目根目录）：
+    python benchmarks/bench_intents.py --patterns 100,1000,3000,5000 --messages 300
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from intents import IntentMatcher  # noqa: E402
+from logic import TEMPLATE_PATTERNS  # noqa: E402
+
+_MESSAGES = [
+    "我无法提现，提现一直失败", "充值不到账怎么办", "你好，我想问一下游戏账号", "提现需要满足什么条件",
+    "我的订单什么时候发货", "怎么参加平台活动", "交易延迟要多久到账", "登录不了，一直提示密码错误",
+    "请问客服在吗", "这个怎么回事，出问题了", "我想修改绑定的手机号", "提现界面在哪里",
+]
+
+
+def _synthetic_patterns(n: int, rnd: random.Random) -> dict:
+    words = ["".join(chr(rnd.randint(0x4E00, 0x9FA5)) for _ in range(2)) for _ in range(max(50, n // 2))]
+    pats = {}
+    for i in range(n):
+        a, b, c = rnd.sample(words, 3)
+        form = i % 3
+        if form == 0:
+            p = f"{a}.*{b}"
+        elif form == 1:
+            p = f"({a}|{b}).*{c}"
+        else:
+            p = f"{a}(失败|不行|异常)"
+        pats.setdefault(f"synthetic_{i // 2}", []).append(p)
+    pats.update(TEMPLATE_PATTERNS)
+    return pats
+
+
+def _old_match(patterns: dict, text: str):
+    t = text.strip().lower()
+    for key, pats in patterns.items():
+        for pat in pats:
+            if re.search(pat, t, flags=re.I):
+                return key
+    return None
+
+
+def _compiled_match(compiled: list, text: str):
+    t = text.strip().lower()
+    for key, rx in compiled:
+        if rx.search(t):
+            return key
+    return None
+
+
+def _time_per_msg(fn, messages, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for m in messages:
+            fn(m)
+    return (time.perf_counter() - t0) / (repeat * len(messages)) * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--patterns", default="100,1000,3000,5000", help="合成规则数（逗号分隔）")
+    ap.add_argument("--messages", type=int, default=300, help="每轮匹配的消息数")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    rnd = random.Random(42)
+    messages = [rnd.choice(_MESSAGES) for _ in range(args.messages)]
+
+    print(f"{'rules':>7} {'old µs/msg':>12} {'compiled µs/msg':>16} {'matcher µs/msg':>15} {'build ms':>9} {'speedup':>8}")
+    for n in (int(x) for x in args.patterns.split(",") if x.strip()):
+        patterns = _synthetic_patterns(n, rnd)
+        total_rules = sum(len(v) for v in patterns.values())
+        t0 = time.perf_counter()
+        matcher = IntentMatcher.from_patterns(patterns, name="bench")
+        build_ms = (time.perf_counter() - t0) * 1000
+        compiled = [(k, re.compile(p, re.I)) for k, ps in patterns.items() for p in ps]
+
+        for m in set(messages):
+            expect = _old_match(patterns, m)
+            got = matcher.match(m.strip())
+            assert got == expect, (m, got, expect)
+
+        old = _time_per_msg(lambda m: _old_match(patterns, m), messages, args.repeat)
+        comp = _time_per_msg(lambda m: _compiled_match(compiled, m), messages, args.repeat)
+        new = _time_per_msg(lambda m: matcher.match(m.strip()), messages, args.repeat)
+        print(f"{total_rules:>7} {old:>12.1f} {comp:>16.1f} {new:>15.1f} {build_ms:>9.1f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
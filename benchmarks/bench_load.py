@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+"""
+端到端压测：单个后端进程能承载多少并发会话（完全离线）
+- 启动本地替身（benchmarks/loadtest_stubs.py：LibreTranslate /translate、/detect 与 llama.cpp
+  /v1/chat/completions，延迟 / 错误分布可配置）和一个 backend.app 进程（临时数据库与图片目录，
+  翻译 / 检测 / LLM 地址全部指向替身）
+- 每档并发 N 个会话：每个会话一个客户 Socket.IO 连接，按 --agent-ratio 比例另有一个客服连接
+- 会话按权重回放消息组合：客户文本（法语，含命中话题模板的问题）、客户图片（HTTP 上传后发引用）、
+  客服打字 + 中文回复、客服上线 / 下线切换；无客服的会话走超时代答
+- 消息带唯一标记，按标记 / 消息 id 把 new_message / message_update / bot_reply_delta 对应回发送时刻
+
+报告（毫秒，p50 / p95 / p99 / max）：
+    client_delivered    客户发送 → 客服端（无客服时为客户端回显）收到 new_message
+    client_translated   客户发送 → 客服端拿到中文译文（new_message 或 message_update 的 client_zh）
+    bot_first_delta     客服离线时客户发送 → 客户端收到首个流式增量
+    bot_reply           客服离线时客户发送 → 客户端收到机器人完整回复（reply_fr）
+    delayed_reply       无客服会话客户发送 → 超时代答送达（含 --inactivity-sec 等待）
+    agent_delivered     客服发送 → 客户端收到 new_message
+    agent_translated    客服发送 → 客户端拿到译文
+    image_upload        POST /api/v1/media 耗时
+    image_delivered     图片引用发送 → 对端收到 new_message
+    status_broadcast    客服切换在线状态 → 客户端收到 agent_status
+以及每档的消息吞吐（msgs/s）与超时数；吞吐上限 = 各档中 client_delivered p95 不超过 --slo-ms
+且超时率不超过 1% 时的最大吞吐（最高一档仍达标时标注为“未触顶”）。
+
+用法（项目根目录）：
+    python benchmarks/bench_load.py --levels 10,25,50,100 --duration 30
+    python benchmarks/bench_load.py --levels 50 --translate median=200,sigma=0.8,error=0.05 --json load.json
+    python benchmarks/bench_load.py --backend-url http://127.0.0.1:5000 --levels 20   # 压已运行的实例（不启动替身）
+
+驱动端用 gevent 协程模拟连接；装有 websocket-client 时走 WebSocket，否则走长轮询（驱动自身开销更大，
+与后端同机运行时接近上限的档位可能先受限于驱动进程的 CPU，可用 --backend-url 把驱动放到另一台机器）。
+"""
+
+from __future__ import annotations
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import os  # noqa: E402
+import random  # noqa: E402
+import re  # noqa: E402
+import socket  # noqa: E402
+import struct  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+import uuid  # noqa: E402
+import zlib  # noqa: E402
+from typing import Dict, List, Optional, Tuple  # noqa: E402
+
+import gevent  # noqa: E402
+import requests  # noqa: E402
+import socketio  # noqa: E402
+from gevent.event import Event  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(ROOT, "benchmarks", "loadtest_stubs.py")
+
+# 后端进程：与 start.sh 的 gevent-websocket 部署方式一致（单进程），监听指定端口
+_BACKEND_LAUNCHER = """
+import logging, sys
+from gevent import monkey
+monkey.patch_all()
+sys.path.insert(0, sys.argv[1])
+logging.basicConfig(level=logging.WARNING)
+from app import app
+from gevent import pywsgi
+from geventwebsocket.handler import WebSocketHandler
+pywsgi.WSGIServer(("127.0.0.1", int(sys.argv[2])), app, handler_class=WebSocketHandler, log=None).serve_forever()
+"""
+
+METRICS = ("client_delivered", "client_translated", "bot_first_delta", "bot_reply", "delayed_reply",
+           "agent_delivered", "agent_translated", "image_upload", "image_delivered", "status_broadcast")
+
+_CLIENT_PHRASES = [
+    "Bonjour, je n'arrive pas à retirer mon argent",        # withdraw
+    "Comment faire un dépôt sur mon compte ?",              # deposit
+    "J'ai oublié mon mot de passe, je ne peux pas me connecter",  # login
+    "Est-ce qu'il y a un bonus pour les nouveaux joueurs ?",  # promo
+    "Bonjour, j'ai une question sur ma commande",
+    "Le site est très lent aujourd'hui, c'est normal ?",
+    "Merci pour votre aide",
+    "Pourquoi mon compte est bloqué depuis hier ?",
+]
+_AGENT_PHRASES = [
+    "您好，请稍等，我帮您查询一下",
+    "请提供一下您的账号，我们马上处理",
+    "提现一般二十四小时内到账",
+    "已经帮您处理好了，请刷新页面查看",
+]
+_TAG_RE = re.compile(r"#([0-9a-f]{8})\b")
+
+
+# ---------- 工具 ----------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _png(width: int, height: int, rnd: random.Random) -> bytes:
+    """随机像素的 RGB PNG（每次内容不同，不依赖 Pillow）"""
+    def _chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    raw = b"".join(b"\x00" + bytes(rnd.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + _chunk(b"IHDR", header) + _chunk(b"IDAT", zlib.compress(raw)) + _chunk(b"IEND", b"")
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))]
+
+
+def _summary(samples: List[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50": round(_percentile(ordered, 0.50) * 1000, 1),
+        "p95": round(_percentile(ordered, 0.95) * 1000, 1),
+        "p99": round(_percentile(ordered, 0.99) * 1000, 1),
+        "max": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+    }
+
+
+def _wait_http(url: str, timeout: float, proc: Optional[subprocess.Popen] = None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"进程已退出（code={proc.returncode}）：{url}")
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"等待 {url} 超时")
+
+
+# ---------- 单条消息的时间线 ----------
+class Probe:
+    __slots__ = ("kind", "t0", "marks", "_events")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.t0 = time.perf_counter()
+        self.marks: Dict[str, float] = {}
+        self._events: Dict[str, Event] = {}
+
+    def _event(self, name: str) -> Event:
+        ev = self._events.get(name)
+        if ev is None:
+            ev = self._events[name] = Event()
+        return ev
+
+    def mark(self, name: str):
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.t0
+            self._event(name).set()
+
+    def wait(self, name: str, timeout: float) -> Optional[float]:
+        """等待某个节点；返回相对发送时刻的耗时（秒），超时返回 None"""
+        if name not in self.marks:
+            self._event(name).wait(timeout)
+        return self.marks.get(name)
+
+
+# ---------- 一档压测 ----------
+class LoadRun:
+    def __init__(self, args, url: str, conversations: int, level_idx: int):
+        self.args = args
+        self.url = url
+        self.n = conversations
+        self.prefix = f"load{level_idx}-{uuid.uuid4().hex[:6]}"
+        self.stop = Event()
+        self.measuring = False
+        self.samples: Dict[str, List[float]] = {m: [] for m in METRICS}
+        self.samples["connect"] = []
+        self.timeouts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.messages = 0              # 测量窗口内送达的消息数（客户文本 / 客服文本 / 图片）
+        self.mix = [(k, float(v)) for k, v in (p.split("=") for p in args.mix.split(",") if "=" in p)]
+
+    def record(self, metric: str, value: Optional[float]):
+        if not self.measuring:
+            return
+        if value is None:
+            self.timeouts[metric] = self.timeouts.get(metric, 0) + 1
+        else:
+            self.samples[metric].append(value)
+            if metric in ("client_delivered", "agent_delivered", "image_delivered"):
+                self.messages += 1
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def run(self) -> dict:
+        rnd = random.Random(self.args.seed + self.n)
+        convs = [Conversation(self, i, rnd.random() < self.args.agent_ratio, random.Random(rnd.random()))
+                 for i in range(self.n)]
+        ramp = self.args.ramp / max(1, self.n)
+        greenlets = []
+        for conv in convs:
+            greenlets.append(gevent.spawn(conv.main))
+            gevent.sleep(ramp)
+        gevent.sleep(self.args.warmup)
+        self.measuring = True
+        t0 = time.perf_counter()
+        gevent.sleep(self.args.duration)
+        self.measuring = False
+        elapsed = time.perf_counter() - t0
+        self.stop.set()
+        gevent.joinall(greenlets, timeout=self.args.timeout + 5)
+        gevent.killall([g for g in greenlets if not g.dead], block=False)
+        gevent.joinall([gevent.spawn(conv.close) for conv in convs], timeout=10)
+
+        sent = sum(len(self.samples[m]) for m in METRICS)
+        timeouts = sum(self.timeouts.values())
+        delivered = self.samples["client_delivered"]
+        return {
+            "conversations": self.n,
+            "agents": sum(1 for c in convs if c.has_agent),
+            "seconds": round(elapsed, 2),
+            "throughput_msgs_per_sec": round(self.messages / elapsed, 2) if elapsed else 0.0,
+            "timeout_rate": round(timeouts / (sent + timeouts), 4) if sent + timeouts else 0.0,
+            "latency_ms": {m: _summary(v) for m, v in self.samples.items() if v},
+            "timeouts": dict(self.timeouts),
+            "errors": dict(self.errors),
+            "meets_slo": bool(delivered) and _summary(delivered)["p95"] <= self.args.slo_ms
+                         and (timeouts / (sent + timeouts) if sent + timeouts else 0.0) <= 0.01,
+        }
+
+
+class Conversation:
+    def __init__(self, run: LoadRun, idx: int, has_agent: bool, rnd: random.Random):
+        self.run = run
+        self.cid = f"{run.prefix}-{idx}"
+        self.has_agent = has_agent
+        self.rnd = rnd
+        self.online = True                  # 客服手动在线（后端默认值）
+        self.client: Optional[socketio.Client] = None
+        self.agent: Optional[socketio.Client] = None
+        self.probes: Dict[str, Probe] = {}  # 标记 → 时间线
+        self.ids: Dict[str, str] = {}       # 消息 id → 标记
+        self.bot_probe: Optional[Probe] = None
+        self.status_probe: Optional[Probe] = None
+        self.http = requests.Session()
+
+    # ---------- 连接 ----------
+    def _connect(self, role: str) -> Optional[socketio.Client]:
+        sio = socketio.Client(reconnection=False)
+        sio.on("new_message", lambda p: self._on_payload(role, p))
+        sio.on("message_update", lambda p: self._on_payload(role, p))
+        if role == "client":
+            sio.on("bot_reply_delta", self._on_delta)
+            sio.on("agent_status", self._on_status)
+        t0 = time.perf_counter()
+        try:
+            sio.connect(f"{self.run.url}?cid={self.cid}&role={role}",
+                        transports=self.run.args.transports, wait_timeout=self.run.args.timeout)
+        except Exception:
+            self.run.error(f"connect_{role}")
+            return None
+        self.run.samples["connect"].append(time.perf_counter() - t0)
+        return sio
+
+    def close(self):
+        for sio in (self.client, self.agent):
+            if sio is not None:
+                try:
+                    sio.disconnect()
+                except Exception:
+                    pass
+
+    # ---------- 事件 ----------
+    def _probe(self, kind: str) -> Tuple[str, Probe]:
+        tag = uuid.uuid4().hex[:8]
+        probe = self.probes[tag] = Probe(kind)
+        return tag, probe
+
+    def _on_payload(self, role: str, p: dict):
+        if not isinstance(p, dict):
+            return
+        m = _TAG_RE.search(str(p.get("original") or ""))
+        tag = m.group(1) if m else None
+        mid = p.get("id")
+        if mid and tag:
+            self.ids[mid] = tag
+        elif mid:
+            tag = self.ids.get(mid)
+        if tag is None and p.get("media_id"):
+            tag = "img:" + p["media_id"]
+        probe = self.probes.get(tag) if tag else None
+        if probe is None:
+            return
+        observer = (role == "agent") == self.has_agent   # 有客服时以客服端为准，否则以客户端回显为准
+        if probe.kind in ("client_text", "image"):
+            if observer and (p.get("original") or p.get("media_id")):
+                probe.mark("delivered")
+            if role == "agent" and p.get("client_zh"):
+                probe.mark("translated")
+            if role == "client" and p.get("reply_fr") and not p.get("agent_view"):
+                probe.mark("reply")
+        elif probe.kind == "agent_text" and role == "client":
+            if p.get("original"):
+                probe.mark("delivered")
+            if p.get("translated"):
+                probe.mark("translated")
+
+    def _on_delta(self, p: dict):
+        if self.bot_probe is not None and isinstance(p, dict) and p.get("side") == "client":
+            self.bot_probe.mark("first_delta")
+
+    def _on_status(self, p: dict):
+        probe = self.status_probe
+        if probe is not None and isinstance(p, dict) and bool(p.get("online")) == self.online:
+            probe.mark("status")
+
+    # ---------- 行为 ----------
+    def main(self):
+        self.client = self._connect("client")
+        if self.has_agent:
+            self.agent = self._connect("agent")
+        if self.client is None or (self.has_agent and self.agent is None):
+            return
+        steps = [k for k, _ in self.run.mix if k != "toggle" or self.has_agent]
+        weights = [w for k, w in self.run.mix if k != "toggle" or self.has_agent]
+        while not self.run.stop.is_set():
+            step = self.rnd.choices(steps, weights)[0]
+            try:
+                getattr(self, f"step_{step}")()
+            except Exception as e:
+                self.run.error(f"{step}:{type(e).__name__}")
+            think = self.rnd.expovariate(1000.0 / self.run.args.think_ms) if self.run.args.think_ms > 0 else 0
+            if self.run.stop.wait(think):
+                break
+
+    def step_text(self):
+        args, run = self.run.args, self.run
+        tag, probe = self._probe("client_text")
+        bot = not self.has_agent or not self.online
+        if bot:
+            self.bot_probe = probe
+        self.client.emit("client_message", {"message": f"{self.rnd.choice(_CLIENT_PHRASES)} #{tag}"})
+        run.record("client_delivered", probe.wait("delivered", args.timeout))
+        if self.has_agent:
+            run.record("client_translated", probe.wait("translated", args.timeout))
+        if not self.has_agent:
+            run.record("delayed_reply", probe.wait("reply", args.timeout + args.inactivity_sec))
+        elif not self.online:
+            run.record("bot_reply", probe.wait("reply", args.timeout))
+            if "first_delta" in probe.marks:
+                run.record("bot_first_delta", probe.marks["first_delta"])
+        elif self.rnd.random() < args.agent_reply:
+            self.agent.emit("agent_typing", {})
+            gevent.sleep(self.rnd.uniform(0.3, 1.5))
+            self._agent_text()
+        self.bot_probe = None
+
+    def _agent_text(self):
+        args, run = self.run.args, self.run
+        tag, probe = self._probe("agent_text")
+        self.agent.emit("agent_message", {"message": f"{self.rnd.choice(_AGENT_PHRASES)} #{tag}", "target_lang": "fr"})
+        run.record("agent_delivered", probe.wait("delivered", args.timeout))
+        run.record("agent_translated", probe.wait("translated", args.timeout))
+
+    def step_image(self):
+        args, run = self.run.args, self.run
+        data = _png(args.image_px, args.image_px, self.rnd)
+        t0 = time.perf_counter()
+        resp = self.http.post(f"{run.url}/api/v1/media", data=data,
+                              headers={"Content-Type": "image/png"}, timeout=args.timeout)
+        if not resp.ok:
+            run.error(f"upload_http{resp.status_code}")
+            return
+        run.record("image_upload", time.perf_counter() - t0)
+        media_id = resp.json()["media_id"]
+        probe = self.probes["img:" + media_id] = Probe("image")
+        self.client.emit("client_message", {"image": {"media_id": media_id}})
+        run.record("image_delivered", probe.wait("delivered", args.timeout))
+
+    def step_toggle(self):
+        self.online = not self.online
+        self.status_probe = Probe("status")
+        self.agent.emit("agent_set_status", {"online": self.online})
+        self.run.record("status_broadcast", self.status_probe.wait("status", self.run.args.timeout))
+        self.status_probe = None
+
+
+# ---------- 进程编排 ----------
+def _start_stack(args, workdir: str):
+    """启动替身与后端进程，返回 (后端地址, 替身地址, 进程列表)"""
+    procs = []
+    stub_port, backend_port = _free_port(), _free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    stub_log = open(os.path.join(workdir, "stubs.log"), "w")
+    procs.append(subprocess.Popen(
+        [sys.executable, STUBS, "--port", str(stub_port), "--seed", str(args.seed),
+         "--translate", args.translate, "--detect", args.detect, "--llm", args.llm],
+        stdout=stub_log, stderr=subprocess.STDOUT))
+    _wait_http(f"{stub_url}/stats", args.startup_timeout, procs[-1])
+
+    env = dict(os.environ)
+    env.update({
+        "FLASK_ENV": "production",
+        "BOT_DB_PATH": os.path.join(workdir, "bot_store.db"),
+        "MEDIA_ROOT": os.path.join(workdir, "media"),
+        "LIBRE_ENDPOINTS": f"{stub_url}/translate",
+        "LIBRE_DETECT_ENDPOINTS": f"{stub_url}/detect",
+        "LLM_BASE_URL": f"{stub_url}/v1",
+        "BOT_INACTIVITY_SEC": str(args.inactivity_sec),
+        "SOCKETIO_MESSAGE_QUEUE": "",
+        "CONV_SHARED_STATE": "false",
+    })
+    for item in args.backend_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    backend_log = open(os.path.join(workdir, "backend.log"), "w")
+    procs.append(subprocess.Popen(
+        [sys.executable, "-c", _BACKEND_LAUNCHER, os.path.join(ROOT, "backend"), str(backend_port)],
+        cwd=workdir, env=env, stdout=backend_log, stderr=subprocess.STDOUT))
+    backend_url = f"http://127.0.0.1:{backend_port}"
+    _wait_http(f"{backend_url}/api/v1/config", args.startup_timeout, procs[-1])
+    return backend_url, stub_url, procs
+
+
+def _ceiling(levels: List[dict]) -> dict:
+    ok = [lv for lv in levels if lv["meets_slo"]]
+    if not ok:
+        return {"msgs_per_sec": 0.0, "conversations": 0, "saturated": True}
+    best = max(ok, key=lambda lv: lv["throughput_msgs_per_sec"])
+    return {"msgs_per_sec": best["throughput_msgs_per_sec"], "conversations": best["conversations"],
+            "saturated": not levels[-1]["meets_slo"]}
+
+
+def _print_level(lv: dict):
+    print(f"\n== {lv['conversations']} conversations ({lv['agents']} with agent) "
+          f"| {lv['throughput_msgs_per_sec']} msgs/s | timeout rate {lv['timeout_rate']:.2%} "
+          f"| SLO {'ok' if lv['meets_slo'] else 'MISSED'}")
+    print(f"{'metric':>18} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'timeouts':>8}")
+    for metric in ("connect",) + METRICS:
+        s = lv["latency_ms"].get(metric)
+        t = lv["timeouts"].get(metric, 0)
+        if s is None and not t:
+            continue
+        s = s or {"count": 0, "p50": 0, "p95": 0, "p99": 0, "max": 0}
+        print(f"{metric:>18} {s['count']:>6} {s['p50']:>8} {s['p95']:>8} {s['p99']:>8} {s['max']:>8} {t:>8}")
+    if lv["errors"]:
+        print("errors:", lv["errors"])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--levels", default="10,25,50,100", help="逐档并发会话数（逗号分隔）")
+    ap.add_argument("--duration", type=float, default=30.0, help="每档测量时长（秒）")
+    ap.add_argument("--ramp", type=float, default=5.0, help="每档建立全部连接所用时间（秒）")
+    ap.add_argument("--warmup", type=float, default=3.0, help="连接建立后、开始统计前的预热时长（秒）")
+    ap.add_argument("--think-ms", type=float, default=2000.0, help="会话内两步之间的平均间隔（指数分布）")
+    ap.add_argument("--agent-ratio", type=float, default=0.7, help="有客服连接的会话比例")
+    ap.add_argument("--agent-reply", type=float, default=0.8, help="在线客服回复客户消息的概率")
+    ap.add_argument("--mix", default="text=8,image=1,toggle=1", help="行为权重")
+    ap.add_argument("--image-px", type=int, default=96, help="上传图片边长（随机像素 PNG）")
+    ap.add_argument("--inactivity-sec", type=int, default=3, help="后端 BOT_INACTIVITY_SEC（超时代答）")
+    ap.add_argument("--timeout", type=float, default=20.0, help="单个事件的等待上限（秒）")
+    ap.add_argument("--slo-ms", type=float, default=1000.0, help="client_delivered p95 目标（毫秒）")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--transport", choices=("auto", "websocket", "polling"), default="auto")
+    ap.add_argument("--backend-url", default="", help="压测已运行的后端（不启动替身与后端进程）")
+    ap.add_argument("--backend-env", action="append", default=[], metavar="KEY=VALUE",
+                    help="传给后端进程的额外环境变量（可重复）")
+    ap.add_argument("--startup-timeout", type=float, default=90.0)
+    ap.add_argument("--json", default="", help="把完整报告写入该文件")
+    from loadtest_stubs import DEFAULT_SPECS
+    for name, spec in DEFAULT_SPECS.items():
+        ap.add_argument(f"--{name}", default=spec, help=f"替身 {name} 的延迟 / 错误分布（见 loadtest_stubs.py）")
+    args = ap.parse_args()
+
+    if args.transport == "auto":
+        try:
+            import websocket  # noqa: F401  websocket-client
+            args.transports = ["websocket"]
+        except ImportError:
+            args.transports = ["polling"]
+    else:
+        args.transports = [args.transport]
+    logging.basicConfig(level=logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    procs = []
+    try:
+        if args.backend_url:
+            url, stub_url = args.backend_url.rstrip("/"), ""
+        else:
+            url, stub_url, procs = _start_stack(args, workdir)
+        print(f"backend={url} stubs={stub_url or '-'} transport={args.transports[0]} workdir={workdir}")
+
+        levels = []
+        for idx, n in enumerate(int(x) for x in args.levels.split(",") if x.strip()):
+            result = LoadRun(args, url, n, idx).run()
+            _print_level(result)
+            levels.append(result)
+
+        ceiling = _ceiling(levels)
+        print(f"\nthroughput ceiling: {ceiling['msgs_per_sec']} msgs/s at {ceiling['conversations']} conversations"
+              f"{'' if ceiling['saturated'] else ' (not saturated: raise --levels)'}")
+
+        report = {
+            "config": {k: v for k, v in vars(args).items() if k not in ("json",)},
+            "levels": levels,
+            "ceiling": ceiling,
+        }
+        try:
+            report["backend_stats"] = requests.get(f"{url}/api/v1/stats", timeout=5).json()
+            if stub_url:
+                report["stub_stats"] = requests.get(f"{stub_url}/stats", timeout=5).json()
+        except (requests.RequestException, ValueError) as e:
+            report["stats_error"] = str(e)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"report written to {args.json}")
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
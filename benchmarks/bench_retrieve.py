@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+retrieve_best 并发吞吐基准：旧实现（每次新建连接 + 全局锁 + 同步 UPDATE hits）
+vs 当前实现（只读连接池 + 命中计数延迟聚合），两者检索逻辑相同
+
+用法（项目根目录）：
+    python benchmarks/bench_retrieve.py --rows 2000 --threads 1,4,8 --seconds 3
+
+使用临时数据库，不影响 bot_store.db。
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_FR_WORDS = ("commande livraison paiement retour remboursement compte mot de passe colis adresse "
+             "facture garantie produit taille couleur stock promotion code annulation délai").split()
+_ZH_WORDS = ("订单 物流 付款 退货 退款 账户 密码 包裹 地址 发票 保修 商品 尺码 颜色 库存 优惠 取消 时效").split()
+
+
+def _seed(path: str, rows: int):
+    os.environ["BOT_DB_PATH"] = path
+    sys.path.insert(0, os.path.join(ROOT, "backend"))
+    import bot_store
+    bot_store.init_db()
+    rnd = random.Random(42)
+    now = datetime.now().isoformat(timespec="seconds")
+    conn = sqlite3.connect(path)
+    for i in range(rows):
+        q_fr = " ".join(rnd.sample(_FR_WORDS, 4))
+        q_zh = "".join(rnd.sample(_ZH_WORDS, 3))
+        a_zh = f"答案{i}：" + "".join(rnd.sample(_ZH_WORDS, 5))
+        cur = conn.execute(
+            "INSERT INTO knowledge(q_fr, q_zh, a_zh, source, hits, created_at, updated_at) VALUES (?,?,?,?,?,?,?)",
+            (q_fr, q_zh, a_zh, "bench", 0, now, now))
+        conn.execute("INSERT INTO knowledge_fts(rowid, question_all, answer_zh) VALUES(?,?,?)",
+                     (cur.lastrowid, bot_store._knowledge_fts_text(q_fr, q_zh, ""), a_zh))
+    conn.commit()
+    conn.close()
+    return bot_store
+
+
+# ---------- 旧实现（基线：检索逻辑与当前一致，但每次新建连接 + 全局锁 + 同步 UPDATE hits） ----------
+_legacy_lock = threading.Lock()
+
+
+def legacy_retrieve_best(bot_store, query_fr: str = "", query_zh: str = "", k: int = 3):
+    with bot_store._connect() as conn, _legacy_lock:
+        def _search_fts(qraw: str):
+            toks = bot_store._fts_query_tokens(qraw)
+            if not toks:
+                return []
+            sql = """
+            SELECT rowid AS id, question_all, answer_zh, bm25(knowledge_fts) AS score
+              FROM knowledge_fts
+             WHERE knowledge_fts MATCH ?
+             ORDER BY score LIMIT ?;
+            """
+            rows = conn.execute(sql, (bot_store._fts_make_query(toks), k * 4)).fetchall()
+            rows = [r for r in rows
+                    if bot_store.overlap_ratio(toks, r["question_all"].split()) >= bot_store._FTS_MIN_OVERLAP]
+            return rows[:k]
+
+        rows = _search_fts(query_fr) + _search_fts(query_zh)
+        if not rows:
+            return None
+        cand = [{"id": r["id"], "answer_zh": r["answer_zh"], "score": r["score"]} for r in rows]
+        cand.sort(key=lambda x: x["score"])
+        best = cand[0]
+        conn.execute("UPDATE knowledge SET hits=hits+1, updated_at=? WHERE id=?",
+                     (datetime.now().isoformat(timespec="seconds"), best["id"]))
+        conn.commit()
+        return best
+
+
+def _queries(n: int):
+    rnd = random.Random(7)
+    return [(" ".join(rnd.sample(_FR_WORDS, 2)), "".join(rnd.sample(_ZH_WORDS, 1))) for _ in range(n)]
+
+
+def run(fn, threads: int, seconds: float, queries) -> float:
+    stop = time.time() + seconds
+    counts = [0] * threads
+
+    def _worker(idx: int):
+        i = idx
+        while time.time() < stop:
+            q_fr, q_zh = queries[i % len(queries)]
+            fn(query_fr=q_fr, query_zh=q_zh)
+            counts[idx] += 1
+            i += threads
+
+    ts = [threading.Thread(target=_worker, args=(i,)) for i in range(threads)]
+    t0 = time.time()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return sum(counts) / (time.time() - t0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--threads", default="1,4,8")
+    ap.add_argument("--seconds", type=float, default=3.0)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_retrieve_")
+    bot_store = _seed(os.path.join(tmp, "bench.db"), args.rows)
+    queries = _queries(500)
+
+    print(f"rows={args.rows} seconds={args.seconds} db={tmp}")
+    print(f"{'threads':>7} | {'legacy ops/s':>12} | {'pooled ops/s':>12} | {'speedup':>7}")
+    for n in [int(x) for x in args.threads.split(",") if x.strip()]:
+        legacy = run(lambda **kw: legacy_retrieve_best(bot_store, **kw), n, args.seconds, queries)
+        pooled = run(bot_store.retrieve_best, n, args.seconds, queries)
+        print(f"{n:>7} | {legacy:>12.0f} | {pooled:>12.0f} | {pooled / legacy:>6.2f}x")
+    print("db stats:", bot_store.db_stats())
+
+
+if __name__ == "__main__":
+    main()
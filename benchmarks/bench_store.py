@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+bot_store 知识库微基准（按规模），输出可在版本间对比的 JSON 报告
+- 语料：合成的法语 / 中文双语问答（词频服从 Zipf 分布，法语词带变音符，中文为二字词），
+  默认 1k / 100k / 1M 行；直接批量写入 knowledge 与 knowledge_fts（切词规则与 bot_store 相同，不提取关键词）
+- 每个规模依次测：
+    init_db          空库建表、已迁移库的重启（取中位数）、旧库（user_version=0）升级时的 FTS 全量重建
+    retrieve_best    FTS 命中（用已有问题作查询）/ FTS 未命中（词表外的词）/ LIKE 回退（删除 knowledge_fts 后）
+    upsert_qa        逐条学习（每条一个事务）与按学习队列批量（upsert_qa_many）的吞吐，含关键词提取
+- 与知识库规模无关、单独测一次：
+    log_message      N 个并发写线程的吞吐：写后批量（默认）与逐条同步写（BOT_LOG_SYNC=true 的路径）
+
+报告结构：{"schema", "meta"（版本 / 环境）, "params", "results"}；--compare 旧报告时逐项打印变化比例
+（*_ms / *_sec 越小越好，*_per_sec 越大越好）。
+
+用法（项目根目录；使用临时数据库，不影响 bot_store.db）：
+    python benchmarks/bench_store.py --rows 1000,100000,1000000 --out bench_store.json
+    python benchmarks/bench_store.py --rows 1000,100000 --compare bench_store.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA = 1
+
+_FR_SYLLABLES = ("ba be bi bo bu ca ce ci co cu da de di do du fa fe fi fo fu ga ge gi go la le li lo lu "
+                 "ma me mi mo mu na ne ni no nu pa pe pi po pu ra re ri ro ru sa se si so su ta te ti to tu "
+                 "va ve vi vo vu é è ê à ç ou oi an en on").split()
+_FR_COMMON = ("bonjour compte retrait dépôt mot de passe connexion bonus commande paiement remboursement "
+              "vérification délai argent carte banque problème aide pourquoi comment quand").split()
+
+
+# ---------- 语料 ----------
+class Corpus:
+    """确定性的合成双语语料：词表 + Zipf 抽样"""
+
+    def __init__(self, seed: int, fr_vocab: int = 6000, zh_vocab: int = 4000):
+        rnd = random.Random(seed)
+        fr = list(_FR_COMMON)
+        seen = set(fr)
+        while len(fr) < fr_vocab:
+            w = "".join(rnd.choice(_FR_SYLLABLES) for _ in range(rnd.randint(2, 4)))
+            if w not in seen:
+                seen.add(w)
+                fr.append(w)
+        zh, seen = [], set()
+        while len(zh) < zh_vocab:
+            # 词表内的汉字取 U+4E00–U+8FFF；未命中查询用 U+9000 以后的字，保证不在索引中
+            w = chr(rnd.randint(0x4E00, 0x8FFF)) + chr(rnd.randint(0x4E00, 0x8FFF))
+            if w not in seen:
+                seen.add(w)
+                zh.append(w)
+        self.fr, self.zh = fr, zh
+        self._fr_cum = self._zipf_cum(len(fr))
+        self._zh_cum = self._zipf_cum(len(zh))
+        self.rnd = rnd
+
+    @staticmethod
+    def _zipf_cum(n: int, s: float = 1.05) -> list:
+        total, out = 0.0, []
+        for rank in range(1, n + 1):
+            total += 1.0 / rank ** s
+            out.append(total)
+        return out
+
+    def _words(self, vocab, cum, k: int) -> list:
+        return self.rnd.choices(vocab, cum_weights=cum, k=k)
+
+    def row(self, i: int):
+        q_fr = " ".join(self._words(self.fr, self._fr_cum, self.rnd.randint(4, 9)))
+        q_zh = "".join(self._words(self.zh, self._zh_cum, self.rnd.randint(2, 4)))
+        a_zh = f"答案{i}：" + "，".join(self._words(self.zh, self._zh_cum, self.rnd.randint(4, 10)))
+        return q_fr, q_zh, a_zh
+
+    def miss_query(self):
+        fr = " ".join("zq" + "".join(self.rnd.choice("xkwy") for _ in range(5)) for _ in range(5))
+        zh = "".join(chr(self.rnd.randint(0x9000, 0x9FA5)) for _ in range(6))
+        return fr, zh
+
+
+# ---------- 计时 ----------
+def _percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))]
+
+
+def _latency(samples: list, found: int) -> dict:
+    ordered = sorted(samples)
+    ms = lambda v: round(v * 1000, 3)  # noqa: E731
+    return {
+        "count": len(ordered),
+        "found_rate": round(found / len(ordered), 4) if ordered else 0.0,
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "p50_ms": ms(_percentile(ordered, 0.50)),
+        "p95_ms": ms(_percentile(ordered, 0.95)),
+        "p99_ms": ms(_percentile(ordered, 0.99)),
+        "max_ms": ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+def _time_queries(bot_store, queries) -> dict:
+    samples, found = [], 0
+    for q_fr, q_zh in queries:
+        t0 = time.perf_counter()
+        best = bot_store.retrieve_best(query_fr=q_fr, query_zh=q_zh)
+        samples.append(time.perf_counter() - t0)
+        found += best is not None
+    return _latency(samples, found)
+
+
+# ---------- 数据库 ----------
+def _load_bot_store(path: str):
+    os.environ["BOT_DB_PATH"] = path
+    sys.path.insert(0, os.path.join(ROOT, "backend"))
+    import bot_store
+    return bot_store
+
+
+def _use_db(bot_store, path: str):
+    """切换 bot_store 到新的数据库文件（先落盘延迟写入，再关闭旧连接）"""
+    bot_store.flush_hits()
+    bot_store.flush_messages()
+    bot_store._db.close_all()
+    bot_store._DB_PATH = path
+
+
+def _seed(bot_store, path: str, rows: int, corpus: Corpus, batch: int = 20000) -> list:
+    """批量写入 rows 行，返回抽样的已有问题（用作命中查询）"""
+    now = datetime.now().isoformat(timespec="seconds")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    sample_every = max(1, rows // 5000)
+    samples = []
+    for start in range(0, rows, batch):
+        chunk = [corpus.row(i) for i in range(start, min(rows, start + batch))]
+        cur = conn.execute("SELECT COALESCE(MAX(id), 0) FROM knowledge").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO knowledge(q_fr, q_zh, a_zh, source, hits, created_at, updated_at, keywords) "
+            "VALUES (?,?,?,?,?,?,?,?)",
+            [(q_fr, q_zh, a_zh, "bench", 0, now, now, "") for q_fr, q_zh, a_zh in chunk])
+        conn.executemany(
+            "INSERT INTO knowledge_fts(rowid, question_all, answer_zh) VALUES(?,?,?)",
+            [(cur + 1 + j, bot_store._knowledge_fts_text(q_fr, q_zh, ""), a_zh)
+             for j, (q_fr, q_zh, a_zh) in enumerate(chunk)])
+        conn.commit()
+        samples.extend((q_fr, q_zh) for i, (q_fr, q_zh, _) in enumerate(chunk, start) if i % sample_every == 0)
+    conn.close()
+    return samples
+
+
+def _init_db_time(bot_store) -> float:
+    bot_store._db.close_all()
+    t0 = time.perf_counter()
+    bot_store.init_db()
+    return time.perf_counter() - t0
+
+
+# ---------- 单个规模 ----------
+def bench_scale(bot_store, workdir: str, rows: int, args) -> dict:
+    path = os.path.join(workdir, f"kb_{rows}.db")
+    _use_db(bot_store, path)
+    corpus = Corpus(args.seed)
+    out: dict = {"rows": rows, "init_db": {}, "retrieve_best": {}, "upsert_qa": {}}
+
+    out["init_db"]["empty_sec"] = round(_init_db_time(bot_store), 4)
+    t0 = time.perf_counter()
+    known = _seed(bot_store, path, rows, corpus)
+    out["seed_sec"] = round(time.perf_counter() - t0, 2)
+    out["db_mb"] = round(os.path.getsize(path) / 1e6, 1)
+    restarts = sorted(_init_db_time(bot_store) for _ in range(args.init_repeat))
+    out["init_db"]["restart_sec"] = round(restarts[len(restarts) // 2], 4)
+    print(f"[{rows}] seeded in {out['seed_sec']}s ({out['db_mb']} MB), init_db restart {out['init_db']['restart_sec']}s",
+          flush=True)
+
+    rnd = random.Random(args.seed + 1)
+    hits = [rnd.choice(known) for _ in range(args.queries)]
+    misses = [corpus.miss_query() for _ in range(args.queries)]
+    _time_queries(bot_store, hits[:20])   # 预热读连接与页缓存
+    out["retrieve_best"]["fts_hit"] = _time_queries(bot_store, hits)
+    out["retrieve_best"]["fts_miss"] = _time_queries(bot_store, misses)
+
+    # 学习：新问题逐条写入，再按学习队列的批大小批量写入
+    fresh = [corpus.row(rows + i) for i in range(args.upserts * 2)]
+    bot_store.upsert_qa("préchauffage du modèle", "预热关键词", "预热")   # 加载 jieba 等，不计时
+    t0 = time.perf_counter()
+    for q_fr, q_zh, a_zh in fresh[:args.upserts]:
+        bot_store.upsert_qa(q_fr, q_zh, a_zh, source="bench")
+    single = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    rest = fresh[args.upserts:]
+    for i in range(0, len(rest), args.batch):
+        bot_store.upsert_qa_many([(q_fr, q_zh, a_zh, "bench") for q_fr, q_zh, a_zh in rest[i:i + args.batch]])
+    batched = time.perf_counter() - t0
+    out["upsert_qa"] = {
+        "single_ops_per_sec": round(args.upserts / single, 1),
+        "single_mean_ms": round(single / args.upserts * 1000, 3),
+        "batch_size": args.batch,
+        "batch_rows_per_sec": round(len(rest) / batched, 1),
+    }
+    print(f"[{rows}] retrieve hit p95 {out['retrieve_best']['fts_hit']['p95_ms']}ms, "
+          f"miss p95 {out['retrieve_best']['fts_miss']['p95_ms']}ms, "
+          f"upsert {out['upsert_qa']['single_ops_per_sec']}/s single, "
+          f"{out['upsert_qa']['batch_rows_per_sec']}/s batched", flush=True)
+
+    # 旧库升级：user_version 归零后 init_db 会重新执行全部迁移（含 FTS 全量重建）
+    if not args.no_migrate:
+        bot_store.flush_hits()
+        bot_store._db.close_all()
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA user_version=0")
+        out["init_db"]["migrate_sec"] = round(_init_db_time(bot_store), 3)
+        print(f"[{rows}] init_db migrate (FTS rebuild) {out['init_db']['migrate_sec']}s", flush=True)
+
+    # LIKE 回退：FTS 表不可用时的全表扫描路径
+    bot_store.flush_hits()
+    bot_store._db.close_all()
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE knowledge_fts")
+    like_hits = [q for q in hits[:args.like_queries]]
+    out["retrieve_best"]["like_hit"] = _time_queries(bot_store, like_hits)
+    out["retrieve_best"]["like_miss"] = _time_queries(bot_store, misses[:args.like_queries])
+    print(f"[{rows}] LIKE fallback hit p95 {out['retrieve_best']['like_hit']['p95_ms']}ms, "
+          f"miss p95 {out['retrieve_best']['like_miss']['p95_ms']}ms", flush=True)
+
+    _use_db(bot_store, os.path.join(workdir, "idle.db"))
+    if not args.keep:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+    return out
+
+
+# ---------- 消息日志 ----------
+def _log_run(append, writers: int, per_writer: int, flush) -> dict:
+    start = threading.Barrier(writers + 1)
+
+    def _worker(idx: int):
+        start.wait()
+        for i in range(per_writer):
+            append(("bench-%d" % idx, "client", "fr", f"message {i} du client {idx}", "2024-01-01T00:00:00"))
+
+    threads = [threading.Thread(target=_worker, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    enqueued = time.perf_counter() - t0
+    flush()
+    durable = time.perf_counter() - t0
+    total = writers * per_writer
+    return {
+        "writers": writers,
+        "rows": total,
+        "enqueue_rows_per_sec": round(total / enqueued, 1),
+        "durable_rows_per_sec": round(total / durable, 1),
+    }
+
+
+def bench_log(bot_store, workdir: str, args) -> dict:
+    path = os.path.join(workdir, "log.db")
+    _use_db(bot_store, path)
+    bot_store.init_db()
+    writer = bot_store._log_writer
+    sync_writer = bot_store._MessageLogWriter(sync=True)
+    out: dict = {"write_behind": [], "sync": []}
+    for n in args.writers:
+        out["write_behind"].append(_log_run(writer.append, n, args.log_rows, writer.flush))
+        out["sync"].append(_log_run(sync_writer.append, n, max(1, args.log_rows // 10), lambda: None))
+        print(f"[log_message] writers={n} write-behind {out['write_behind'][-1]['durable_rows_per_sec']}/s, "
+              f"sync {out['sync'][-1]['durable_rows_per_sec']}/s", flush=True)
+    with sqlite3.connect(path) as conn:
+        out["rows_in_db"] = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    return out
+
+
+# ---------- 报告 ----------
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _meta() -> dict:
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_rev": _git_rev(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _flatten(obj, prefix: str = "") -> dict:
+    out = {}
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            out.update(_flatten(v, f"{prefix}.{k}" if prefix else str(k)))
+    elif isinstance(obj, list):
+        for item in obj:
+            key = f"writers={item.get('writers')}" if isinstance(item, dict) and "writers" in item else str(len(out))
+            out.update(_flatten(item, f"{prefix}.{key}"))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        out[prefix] = obj
+    return out
+
+
+def compare(old: dict, new: dict):
+    """逐项打印与旧报告的差异（只比较两边都有的指标）"""
+    a, b = _flatten(old.get("results", {})), _flatten(new.get("results", {}))
+    print(f"\ncompare: {old.get('meta', {}).get('git_rev') or '?'} -> {new['meta'].get('git_rev') or '?'}")
+    print(f"{'metric':<58} {'old':>12} {'new':>12} {'change':>9}")
+    for key in sorted(set(a) & set(b)):
+        leaf = key.rsplit(".", 1)[-1]
+        if not (leaf.endswith("_ms") or leaf.endswith("_sec") or leaf.endswith("_per_sec")):
+            continue
+        if not a[key]:
+            continue
+        change = (b[key] - a[key]) / a[key]
+        better = change > 0 if leaf.endswith("_per_sec") else change < 0
+        flag = "" if abs(change) < 0.05 else (" +" if better else " -")
+        print(f"{key:<58} {a[key]:>12} {b[key]:>12} {change:>+8.1%}{flag}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", default="1000,100000,1000000", help="知识库规模（逗号分隔）")
+    ap.add_argument("--queries", type=int, default=500, help="每类 FTS 检索的查询数")
+    ap.add_argument("--like-queries", type=int, default=50, help="每类 LIKE 回退检索的查询数（全表扫描，较慢）")
+    ap.add_argument("--upserts", type=int, default=200, help="逐条学习条数（批量学习同样条数）")
+    ap.add_argument("--batch", type=int, default=32, help="批量学习的批大小（对应 LEARN_BATCH_SIZE）")
+    ap.add_argument("--init-repeat", type=int, default=5, help="已迁移库 init_db 重复次数（取中位数）")
+    ap.add_argument("--no-migrate", action="store_true", help="跳过旧库升级（FTS 全量重建）计时")
+    ap.add_argument("--writers", default="1,4,16", help="log_message 并发写线程数（逗号分隔）")
+    ap.add_argument("--log-rows", type=int, default=20000, help="每个写线程的消息数（同步写为其 1/10）")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", default="bench_store.json", help="报告输出路径")
+    ap.add_argument("--compare", default="", help="与该旧报告对比")
+    ap.add_argument("--keep", action="store_true", help="保留临时数据库目录")
+    args = ap.parse_args()
+    scales = [int(x) for x in args.rows.split(",") if x.strip()]
+    args.writers = [int(x) for x in args.writers.split(",") if x.strip()]
+
+    workdir = tempfile.mkdtemp(prefix="bench_store_")
+    bot_store = _load_bot_store(os.path.join(workdir, "idle.db"))
+    bot_store.init_db()
+    try:
+        results = {"knowledge": {str(n): bench_scale(bot_store, workdir, n, args) for n in scales},
+                   "log_message": bench_log(bot_store, workdir, args)}
+    finally:
+        bot_store.flush_hits()
+        bot_store.flush_messages()
+        bot_store._db.close_all()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    params = {k: v for k, v in vars(args).items() if k not in ("out", "compare", "keep")}
+    params["rows"] = scales
+    report = {"schema": SCHEMA, "benchmark": "bench_store", "meta": _meta(), "params": params, "results": results}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"report written to {args.out}" + (f" (databases kept in {workdir})" if args.keep else ""))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+压测用本地替身服务（完全离线，单进程 gevent WSGI）：
+- LibreTranslate：POST /translate（JSON 或表单）、POST /detect
+- llama.cpp OpenAI 兼容接口：POST /v1/chat/completions（普通与 SSE 流式，带 usage）、GET /v1/models
+- GET /stats：各接口请求数 / 失败数 / 卡死数，供压测报告汇总
+
+每类接口的延迟与错误分布用规格字符串配置（逗号分隔 key=value）：
+    median=80      延迟中位数（毫秒，对数正态分布）
+    sigma=0.5      对数正态分布的 σ（0 为固定延迟）
+    error=0.01     返回 HTTP 500 的比例
+    stall=0.0      卡死比例：睡 stall_ms 后才返回（模拟挂起的上游，触发调用方超时 / 对冲）
+    stall_ms=30000
+LLM 另有：tps=40（流式每秒 token 数）、tokens=40（回复 token 数上限，不超过请求的 max_tokens）；
+LLM 的 median 为首 token 延迟。
+
+用法（由 bench_load.py 自动启动，也可单独运行）：
+    python benchmarks/loadtest_stubs.py --port 5055 --translate median=80,sigma=0.6,error=0.01 \\
+        --llm median=400,tps=40,tokens=40
+"""
+
+from __future__ import annotations
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import math  # noqa: E402
+import random  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+import uuid  # noqa: E402
+from typing import Dict, Iterator  # noqa: E402
+from urllib.parse import parse_qs  # noqa: E402
+
+DEFAULT_SPECS = {
+    "translate": "median=80,sigma=0.5,error=0.0",
+    "detect": "median=30,sigma=0.5,error=0.0",
+    "llm": "median=400,sigma=0.4,error=0.0,tps=40,tokens=40",
+}
+
+_REPLIES = [
+    "您好，您的问题已收到，我们正在为您处理。",
+    "请您提供一下账号和订单号，方便我们进一步核实。",
+    "提现一般会在二十四小时内到账，请耐心等待。",
+    "如果仍有问题，请留下您的邮箱，我们会尽快联系您。",
+]
+
+
+def _is_cjk(text: str) -> bool:
+    return any(0x4E00 <= ord(ch) <= 0x9FFF for ch in text)
+
+
+class LatencyModel:
+    def __init__(self, spec: str, seed: int = 0):
+        opts: Dict[str, float] = {"median": 50.0, "sigma": 0.0, "error": 0.0, "stall": 0.0,
+                                  "stall_ms": 30000.0, "tps": 40.0, "tokens": 40.0}
+        for part in (spec or "").split(","):
+            if "=" in part:
+                key, value = part.split("=", 1)
+                if key.strip() not in opts:
+                    raise ValueError(f"未知的规格项 {key!r}（可用：{', '.join(opts)}）")
+                opts[key.strip()] = float(value)
+        self.opts = opts
+        self.rnd = random.Random(seed)
+
+    def __getitem__(self, key: str) -> float:
+        return self.opts[key]
+
+    def delay(self) -> float:
+        """本次请求的延迟（秒）"""
+        median = self.opts["median"] / 1000.0
+        sigma = self.opts["sigma"]
+        if median <= 0:
+            return 0.0
+        return median if sigma <= 0 else self.rnd.lognormvariate(math.log(median), sigma)
+
+    def outcome(self) -> str:
+        r = self.rnd.random()
+        if r < self.opts["stall"]:
+            return "stall"
+        if r < self.opts["stall"] + self.opts["error"]:
+            return "error"
+        return "ok"
+
+
+class StubApp:
+    def __init__(self, specs: Dict[str, str], seed: int = 0):
+        self.models = {name: LatencyModel(spec, seed + i) for i, (name, spec) in enumerate(specs.items())}
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[str, int]] = {
+            name: {"requests": 0, "errors": 0, "stalls": 0} for name in self.models
+        }
+
+    def _count(self, name: str, key: str):
+        with self._lock:
+            self.counters[name][key] += 1
+
+    def _begin(self, name: str) -> str:
+        """计数并按分布等待；返回 ok / error（stall 睡满后按 ok 返回）"""
+        model = self.models[name]
+        self._count(name, "requests")
+        outcome = model.outcome()
+        if outcome == "stall":
+            self._count(name, "stalls")
+            time.sleep(model["stall_ms"] / 1000.0)
+            return "ok"
+        time.sleep(model.delay())
+        if outcome == "error":
+            self._count(name, "errors")
+        return outcome
+
+    # ---------- WSGI ----------
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        method = environ.get("REQUEST_METHOD", "GET")
+        try:
+            if method == "POST" and path.endswith("/translate"):
+                return self._translate(environ, start_response)
+            if method == "POST" and path.endswith("/detect"):
+                return self._detect(environ, start_response)
+            if method == "POST" and path.endswith("/chat/completions"):
+                return self._chat(environ, start_response)
+            if path.endswith("/models"):
+                return self._json(start_response, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+            if path == "/stats":
+                with self._lock:
+                    return self._json(start_response, self.counters)
+        except Exception as e:  # 替身自身异常按 500 返回，便于在压测报告中发现
+            return self._json(start_response, {"error": str(e)}, "500 Internal Server Error")
+        return self._json(start_response, {"error": "not found"}, "404 Not Found")
+
+    @staticmethod
+    def _json(start_response, data, status: str = "200 OK"):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    @staticmethod
+    def _body(environ) -> dict:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        raw = environ["wsgi.input"].read(length) if length else b""
+        ctype = environ.get("CONTENT_TYPE", "")
+        if "json" in ctype:
+            return json.loads(raw or b"{}")
+        return {k: v[0] for k, v in parse_qs(raw.decode("utf-8")).items()}
+
+    def _translate(self, environ, start_response):
+        body = self._body(environ)
+        if self._begin("translate") == "error":
+            return self._json(start_response, {"error": "stub failure"}, "500 Internal Server Error")
+        text, target = body.get("q", ""), (body.get("target") or "en")[:2]
+        out = f"（中）{text}" if target == "zh" else f"[{target}] {text}"
+        return self._json(start_response, {"translatedText": out})
+
+    def _detect(self, environ, start_response):
+        body = self._body(environ)
+        if self._begin("detect") == "error":
+            return self._json(start_response, {"error": "stub failure"}, "500 Internal Server Error")
+        lang = "zh" if _is_cjk(body.get("q", "")) else "fr"
+        return self._json(start_response, [{"language": lang, "confidence": 90.0}])
+
+    def _chat(self, environ, start_response):
+        body = self._body(environ)
+        model = self.models["llm"]
+        if self._begin("llm") == "error":
+            return self._json(start_response, {"error": {"message": "stub failure", "type": "server_error"}},
+                              "500 Internal Server Error")
+        reply = model.rnd.choice(_REPLIES)
+        n_tokens = int(max(1, min(int(body.get("max_tokens") or 256), model["tokens"])))
+        pieces = [reply[i:i + 2] for i in range(0, len(reply), 2)][:n_tokens]
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages") or []) // 2
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                 "total_tokens": prompt_tokens + len(pieces),
+                 "prompt_tokens_details": {"cached_tokens": prompt_tokens // 2}}
+        step = 1.0 / model["tps"] if model["tps"] > 0 else 0.0
+        ident, created = "chatcmpl-" + uuid.uuid4().hex[:12], int(time.time())
+        if not body.get("stream"):
+            time.sleep(step * len(pieces))
+            return self._json(start_response, {
+                "id": ident, "object": "chat.completion", "created": created, "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        start_response("200 OK", [("Content-Type", "text/event-stream"), ("Cache-Control", "no-cache")])
+        return self._stream(ident, created, body.get("model", "stub"), pieces, step, usage if include_usage else None)
+
+    @staticmethod
+    def _stream(ident, created, model_name, pieces, step, usage) -> Iterator[bytes]:
+        def _chunk(delta: dict, finish=None, **extra) -> bytes:
+            data = {"id": ident, "object": "chat.completion.chunk", "created": created, "model": model_name,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}], **extra}
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        yield _chunk({"role": "assistant", "content": ""})
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(step)
+            yield _chunk({"content": piece})
+        yield _chunk({}, finish="stop")
+        if usage is not None:
+            data = {"id": ident, "object": "chat.completion.chunk", "created": created, "model": model_name,
+                    "choices": [], "usage": usage}
+            yield f"data: {json.dumps(data)}\n\n".encode("utf-8")
+        yield b"data: [DONE]\n\n"
+
+
+def main():
+    from gevent import pywsgi
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=5055)
+    ap.add_argument("--seed", type=int, default=1)
+    for name, spec in DEFAULT_SPECS.items():
+        ap.add_argument(f"--{name}", default=spec, help=f"{name} 延迟 / 错误分布（默认 {spec}）")
+    args = ap.parse_args()
+
+    app = StubApp({name: getattr(args, name) for name in DEFAULT_SPECS}, seed=args.seed)
+    server = pywsgi.WSGIServer((args.host, args.port), app, log=None)
+    print(f"stubs listening on http://{args.host}:{args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -64,46 +64,139 @@ function initApp() {
   // 首次同步一次
   applyAgentOnlineState();
 
+  // ===== 机器人流式回复（增量渲染）=====
+  // stream_id -> { client: 客户端气泡 body, agent: 客服端气泡 body }
+  const streamBubbles = {};
+  function streamBody(streamId, side) {
+    const container = side === 'agent' ? agentMsgs : clientMsgs;
+    if (!container) return null;
+    const slot = streamBubbles[streamId] = streamBubbles[streamId] || {};
+    if (!slot[side]) {
+      slot[side] = addMessage(container, '', 'agent', side === 'agent' ? 'right' : 'left', false, null, true);
+    }
+    return slot[side];
+  }
+  // 最终消息到达：用完整文本覆盖流式气泡；返回是否已覆盖（覆盖后不再新建气泡）
+  function finishStream(streamId, side, text) {
+    const slot = streamBubbles[streamId];
+    if (!slot || !slot[side]) return false;
+    slot[side].textContent = text;
+    slot[side].closest('.message-wrapper')?.classList.remove('streaming');
+    return true;
+  }
+
+  socket.on('bot_reply_delta', (data) => {
+    if (!data || (data.cid && data.cid !== cid) || !data.stream_id) return;
+    const side = data.side === 'agent' ? 'agent' : 'client';
+    const body = streamBody(data.stream_id, side);
+    if (!body) return;
+    body.textContent = data.text || '';
+    const container = side === 'agent' ? agentMsgs : clientMsgs;
+    container.scrollTop = container.scrollHeight;
+  });
+
+  // ===== 渐进式消息：原文先到（带 id），译文 / 建议 / 机器人回复以 message_update 修补同一条消息 =====
+  // id -> { clientMsg, agentMsg, clientReply, agentReply, suggest, ts }（各为气泡 body 元素）
+  const msgBubbles = {};
+  function markPending(body, pending) {
+    body?.closest('.message-wrapper')?.classList.toggle('pending', pending);
+  }
+  function patchBody(body, text) {
+    if (!body) return;
+    body.textContent = text;
+    markPending(body, false);
+  }
+  function renderProgressive(data, ts) {
+    const slot = msgBubbles[data.id] = msgBubbles[data.id] || { ts };
+    if (data.from === 'client') {
+      slot.clientMsg = addMessage(clientMsgs, data.original || '', 'client', 'right', false, ts, true);
+      // 客服侧先显示原文，中文译文到达后替换
+      slot.agentMsg = addMessage(agentMsgs, data.original || '', 'client', 'left', false, ts, true);
+      markPending(slot.agentMsg, true);
+    } else if (data.from === 'agent') {
+      slot.clientMsg = addMessage(clientMsgs, data.original || '', 'agent', 'left', false, ts, true);
+      markPending(slot.clientMsg, true);
+    }
+    [slot.clientMsg, slot.agentMsg].forEach(b => b?.closest('.message-wrapper')?.classList.remove('streaming'));
+  }
+  function patchReply(slot, key, container, side, text, streamId) {
+    if (!text || !container) return;
+    if (streamId && finishStream(streamId, side, text)) return;
+    if (slot[key]) patchBody(slot[key], text);
+    else slot[key] = addMessage(container, text, 'agent', side === 'agent' ? 'right' : 'left', false, slot.ts, true);
+    slot[key]?.closest('.message-wrapper')?.classList.remove('streaming');
+  }
+
+  socket.on('message_update', (data) => {
+    if (!data || (data.cid && data.cid !== cid) || !data.id) return;
+    const slot = msgBubbles[data.id];
+    if (!slot) return;
+    if (data.client_zh !== undefined) patchBody(slot.agentMsg, data.client_zh || '');
+    if (data.translated !== undefined) patchBody(slot.clientMsg, data.translated || '');
+    if (data.suggest_zh && !slot.suggest && agentMsgs) {
+      slot.suggest = addMessage(agentMsgs, `（建议）${data.suggest_zh}`, 'agent', 'right', false, slot.ts);
+    }
+    if (data.bot_reply) {
+      patchReply(slot, 'clientReply', clientMsgs, 'client', data.reply_fr, data.stream_id);
+      patchReply(slot, 'agentReply', agentMsgs, 'agent', data.reply_zh, data.stream_id);
+    }
+    [clientMsgs, agentMsgs].forEach(c => { if (c) c.scrollTop = c.scrollHeight; });
+  });
+
   // ===== 接收服务器消息 =====
   socket.on('new_message', (data) => {
     if (data && data.cid && data.cid !== cid) return; // 只处理本会话
     const ts = data.timestamp || new Date().toISOString().replace("T", " ").substring(0, 16);
     const isTestPage = !!(clientMsgs && agentMsgs);
+    const sid = data.stream_id;
 
-    // 图片
+    // 图片（消息只带存储引用：缩略图展示，点击打开原图）
     if (data.image) {
+      const html = imageHTML(data.image, data.thumb);
       if (clientMsgs) {
-        addMessage(clientMsgs, `<img src="${data.image}" class="chat-image">`,
-          data.from, data.from === 'client' ? 'right' : 'left', true, ts);
+        addMessage(clientMsgs, html, data.from, data.from === 'client' ? 'right' : 'left', true, ts);
       }
       if (agentMsgs) {
         // 测试页里，客服自己发的图片已本地渲染，这里避免重复
         if (!(isTestPage && data.from === 'agent')) {
-          addMessage(agentMsgs, `<img src="${data.image}" class="chat-image">`,
-            data.from, data.from === 'agent' ? 'right' : 'left', true, ts);
+          addMessage(agentMsgs, html, data.from, data.from === 'agent' ? 'right' : 'left', true, ts);
         }
       }
       return;
     }
 
-    // 客户端区域
-    if (clientMsgs) {
+    // 渐进式消息（带 id，后续由 message_update 修补）
+    if (data.id && data.pending) {
+      // 测试页里，客服自己发的文本已本地渲染，客户端侧照常显示
+      renderProgressive(data, ts);
+      return;
+    }
+
+    // 客户端区域（agent_view：快速通道补发的中文视图，客户端已显示过）
+    if (clientMsgs && !data.agent_view) {
       if (data.from === 'client') {
         addMessage(clientMsgs, data.original || '', 'client', 'right', false, ts);
-    if (data.bot_reply && ((data.reply_zh || '').trim() !== (data.client_zh || '').trim())) {
-          addMessage(clientMsgs, data.reply_fr || data.bot_reply, 'agent', 'left', false, ts);
+        const showReply = data.zh_pending
+          ? !!(data.reply_fr || '').trim()
+          : ((data.reply_zh || '').trim() !== (data.client_zh || '').trim());
+        if (data.bot_reply && showReply) {
+          if (!(sid && finishStream(sid, 'client', data.reply_fr || ''))) {
+            addMessage(clientMsgs, data.reply_fr || data.bot_reply, 'agent', 'left', false, ts);
+          }
         }
       } else if (data.from === 'agent') {
         addMessage(clientMsgs, data.translated || data.original || '', 'agent', 'left', false, ts);
       }
     }
 
-    // 客服端区域
-    if (agentMsgs) {
+    // 客服端区域（zh_pending：中文视图稍后随 agent_view 消息到达）
+    if (agentMsgs && !data.zh_pending) {
       if (data.from === 'client') {
         addMessage(agentMsgs, data.client_zh || data.original || '', 'client', 'left', false, ts);
         if (data.bot_reply && ((data.reply_zh || '').trim() !== (data.client_zh || '').trim())) {
-          addMessage(agentMsgs, data.reply_zh || data.bot_reply, 'agent', 'right', false, ts);
+          if (!(sid && finishStream(sid, 'agent', data.reply_zh || ''))) {
+            addMessage(agentMsgs, data.reply_zh || data.bot_reply, 'agent', 'right', false, ts);
+          }
         } else if (data.suggest_zh) {
           addMessage(agentMsgs, `（建议）${data.suggest_zh}`, 'agent', 'right', false, ts);
         }
@@ -142,22 +235,44 @@ function initApp() {
     agentInput.value = '';
   });
 
-  // ===== 上传图片 =====
+  // ===== 上传图片（HTTP 上传到内容寻址存储，Socket 只发送引用）=====
+  const apiBase = (window.AppConfig?.API_BASE_URL || "http://3.71.28.18:5000").replace(/\/$/, '');
+  function mediaUrl(u) {
+    return /^(https?:|data:|blob:)/.test(u || '') ? u : apiBase + (u || '');
+  }
+  function escapeAttr(s) {
+    return String(s || '').replace(/[&"<>]/g, c => ({'&': '&amp;', '"': '&quot;', '<': '&lt;', '>': '&gt;'}[c]));
+  }
+  function imageHTML(image, thumb) {
+    const full = escapeAttr(mediaUrl(image));
+    return `<a href="${full}" target="_blank" rel="noopener"><img src="${escapeAttr(mediaUrl(thumb || image))}" class="chat-image" loading="lazy"></a>`;
+  }
+  async function uploadImage(file) {
+    const form = new FormData();
+    form.append('file', file);
+    const resp = await fetch(apiBase + '/api/v1/media', { method: 'POST', body: form });
+    const data = await resp.json().catch(() => ({}));
+    if (!resp.ok || data.status !== 'success') throw new Error(data.message || `HTTP ${resp.status}`);
+    return data;
+  }
+
   ;['client','agent'].forEach(roleKey => {
     const fileInput = document.getElementById(`${roleKey}-file`);
     if (!fileInput) return;
-    fileInput.addEventListener('change', (e) => {
+    fileInput.addEventListener('change', async (e) => {
       const file = e.target.files[0];
+      e.target.value = '';
       if (!file) return;
-      const reader = new FileReader();
-      reader.onload = (evt) => {
+      try {
+        const ref = await uploadImage(file);
         if (roleKey === 'agent' && agentMsgs) {
-          addMessage(agentMsgs, `<img src="${evt.target.result}" class="chat-image">`, 'agent', 'right', true);
+          addMessage(agentMsgs, imageHTML(ref.image, ref.thumb), 'agent', 'right', true);
         }
-        socket.emit(`${roleKey}_message`, { image: evt.target.result, cid });
-      };
-      reader.readAsDataURL(file);
-      e.target.value = '';
+        socket.emit(`${roleKey}_message`, { image: { media_id: ref.media_id }, cid });
+      } catch (err) {
+        console.warn('图片上传失败', err);
+        alert('图片上传失败：' + err.message);
+      }
     });
   });
 
@@ -195,17 +310,20 @@ function initApp() {
   });
 
   // ===== UI 渲染函数 =====
-  function addMessage(container, content, sender, align, isHTML=false, timestamp=null) {
-    // 简易去重：同容器+发送方+时间+内容
+  // 返回消息 body 元素（流式气泡据此增量更新）；被去重时返回 null
+  function addMessage(container, content, sender, align, isHTML=false, timestamp=null, streaming=false) {
+    if (!container) return null;
+    // 简易去重：同容器+发送方+时间+内容（流式气泡内容会变化，不参与去重）
     window.__seenMsgs = window.__seenMsgs || new Set();
     const tsKey = timestamp || new Date().toISOString().replace("T"," ").substring(0,16);
     const raw = (isHTML ? String(content) : (content ?? '')).trim();
     const k = `${container.id}|${sender}|${tsKey}|${raw}`;
-    if (window.__seenMsgs.has(k)) return;
-    window.__seenMsgs.add(k);
-    if (!container) return;
+    if (!streaming) {
+      if (window.__seenMsgs.has(k)) return null;
+      window.__seenMsgs.add(k);
+    }
     const wrap = document.createElement('div');
-    wrap.className = `message-wrapper ${align}`;
+    wrap.className = `message-wrapper ${align}${streaming ? ' streaming' : ''}`;
     const bubble = document.createElement('div');
     bubble.className = `message-content ${sender}`;
     const title = document.createElement('div');
@@ -226,5 +344,6 @@ function initApp() {
     wrap.appendChild(bubble);
     container.appendChild(wrap);
     container.scrollTop = container.scrollHeight;
+    return body;
   }
 }
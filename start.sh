@@ -4,20 +4,48 @@
 # 优先用环境变量 APP_NAME；默认指向 backend.app:app（从项目根目录运行）
 APP_NAME="${APP_NAME:-backend.app:app}"
 HOST="0.0.0.0"
-PORT=5000
+PORT="${PORT:-5000}"
 WORKERS=1
 LOGFILE="gunicorn.log"
+# 多实例：INSTANCES=N 时在 PORT..PORT+N-1 各起一个单 worker 实例，
+# 由 nginx 按 cid 一致性哈希分发（deploy/nginx-api.conf），实例间经消息队列互通
+INSTANCES="${INSTANCES:-1}"
 
 echo "🔄 正在启动客服后端服务..."
 echo "📌 模式: gevent-websocket"
-echo "📌 地址: http://${HOST}:${PORT}"
 
-# 启动 gunicorn
-exec gunicorn \
-  -k geventwebsocket.gunicorn.workers.GeventWebSocketWorker \
-  -w $WORKERS \
-  -b ${HOST}:${PORT} \
-  $APP_NAME \
-  --access-logfile $LOGFILE \
-  --error-logfile $LOGFILE \
-  --log-level info
+if [ "$INSTANCES" -le 1 ]; then
+  echo "📌 地址: http://${HOST}:${PORT}"
+
+  # 启动 gunicorn
+  exec gunicorn \
+    -k geventwebsocket.gunicorn.workers.GeventWebSocketWorker \
+    -w $WORKERS \
+    -b ${HOST}:${PORT} \
+    $APP_NAME \
+    --access-logfile $LOGFILE \
+    --error-logfile $LOGFILE \
+    --log-level info
+fi
+
+export SOCKETIO_MESSAGE_QUEUE="${SOCKETIO_MESSAGE_QUEUE:-sqlite:///sio_queue.db}"
+export CONV_SHARED_STATE="${CONV_SHARED_STATE:-true}"
+echo "📌 实例数: ${INSTANCES}  消息队列: ${SOCKETIO_MESSAGE_QUEUE}"
+
+PIDS=()
+for ((i = 0; i < INSTANCES; i++)); do
+  P=$((PORT + i))
+  echo "📌 地址: http://${HOST}:${P}"
+  gunicorn \
+    -k geventwebsocket.gunicorn.workers.GeventWebSocketWorker \
+    -w $WORKERS \
+    -b ${HOST}:${P} \
+    $APP_NAME \
+    --access-logfile "gunicorn-${P}.log" \
+    --error-logfile "gunicorn-${P}.log" \
+    --log-level info &
+  PIDS+=($!)
+done
+
+trap 'kill "${PIDS[@]}" 2>/dev/null' INT TERM
+wait